@@ -1,7 +1,9 @@
 import time
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Request
 
+from api.deps import get_config
 from api.exceptions import PipelineException, pipeline_exception_handler
 from api.routes.health import router as health_router
 from api.routes.index import router as index_router
@@ -9,10 +11,20 @@ from api.routes.embedding import router as embedding_router
 from api.routes.streaming import router as streaming_router
 from api.routes.endpoint import router as endpoint_router
 from api.routes.search import router as search_router
+from api.routes.metrics import router as metrics_router
+from api.routes.jobs import router as jobs_router
+from api.routes.pipeline import router as pipeline_router
+from functions.utils.clients import warm_clients
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    warm_clients(get_config())
+    yield
 
 
 def create_app() -> FastAPI:
-    app = FastAPI(title="Items Pipeline API", version="1.0.0")
+    app = FastAPI(title="Items Pipeline API", version="1.0.0", lifespan=lifespan)
     app.add_exception_handler(PipelineException, pipeline_exception_handler)
 
     @app.middleware("http")
@@ -30,6 +42,9 @@ def create_app() -> FastAPI:
     app.include_router(streaming_router)
     app.include_router(endpoint_router)
     app.include_router(search_router)
+    app.include_router(metrics_router)
+    app.include_router(jobs_router)
+    app.include_router(pipeline_router)
 
     return app
 
@@ -4,12 +4,21 @@ from api.deps import get_config
 from api.schemas.common import APIResponse
 from api.schemas.embedding import EmbedDataRequest, EmbedTextRequest
 from functions.core.embed_data import embed_data, embed_text
+from functions.utils.jobs import get_job_runner
 
 router = APIRouter(prefix="/v1")
 
 
 @router.post("/embed_data/", response_model=APIResponse)
 def embed_data_route(payload: EmbedDataRequest, config: dict = Depends(get_config)) -> APIResponse:
+    run_async = payload.run_async
+    if run_async is None:
+        run_async = config.get("embed_data", {}).get("run_async")
+    if run_async:
+        job = get_job_runner(config).submit(
+            "embed_data", lambda progress: embed_data(payload, config, progress=progress)
+        )
+        return APIResponse(detail="embed data job submitted", result=job)
     result = embed_data(payload, config)
     return APIResponse(detail="embed data request accepted", result=result)
 
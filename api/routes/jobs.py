@@ -0,0 +1,22 @@
+from fastapi import APIRouter, Depends
+
+from api.deps import get_config
+from api.exceptions import PipelineException
+from api.schemas.common import APIResponse
+from functions.utils.jobs import get_job_runner
+
+router = APIRouter(prefix="/v1")
+
+
+@router.get("/jobs/{job_id}", response_model=APIResponse)
+def get_job_route(job_id: str, config: dict = Depends(get_config)) -> APIResponse:
+    job = get_job_runner(config).store.get(job_id)
+    if job is None:
+        raise PipelineException(f"Job `{job_id}` not found", status_code=404)
+    return APIResponse(detail="job status", result=job)
+
+
+@router.post("/jobs/{job_id}/cancel", response_model=APIResponse)
+def cancel_job_route(job_id: str, config: dict = Depends(get_config)) -> APIResponse:
+    job = get_job_runner(config).cancel(job_id)
+    return APIResponse(detail="job cancel requested", result=job)
@@ -0,0 +1,27 @@
+from fastapi import APIRouter, Depends
+
+from api.deps import get_config
+from api.schemas.common import APIResponse
+from functions.core.search import get_search_dispatcher
+from functions.utils.embedding_scheduler import get_embedding_scheduler
+from functions.utils.local_index import local_index_stats
+from functions.utils.query_embedding_cache import get_query_embedding_cache
+from functions.utils.search_cache import get_search_result_cache
+
+router = APIRouter(prefix="/v1")
+
+
+@router.get("/metrics", response_model=APIResponse)
+def metrics_route(config: dict = Depends(get_config)) -> APIResponse:
+    scheduler = get_embedding_scheduler(config)
+    query_cache = get_query_embedding_cache(config)
+    result_cache = get_search_result_cache(config)
+    dispatcher = get_search_dispatcher(config)
+    result = {
+        "embedding_scheduler": scheduler.stats() if scheduler else None,
+        "query_embedding_cache": query_cache.stats() if query_cache else None,
+        "search_result_cache": result_cache.stats() if result_cache else None,
+        "local_indexes": local_index_stats(),
+        "search_dispatcher": dispatcher.stats() if dispatcher else None,
+    }
+    return APIResponse(detail="metrics", result=result)
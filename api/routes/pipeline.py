@@ -0,0 +1,24 @@
+from fastapi import APIRouter, Depends
+
+from api.deps import get_config
+from api.schemas.common import APIResponse
+from api.schemas.pipeline import EmbedUpsertRequest
+from functions.core.embed_upsert import embed_upsert
+from functions.utils.jobs import get_job_runner
+
+router = APIRouter(prefix="/v1")
+
+
+@router.post("/pipeline/embed_upsert", response_model=APIResponse)
+def embed_upsert_route(payload: EmbedUpsertRequest, config: dict = Depends(get_config)) -> APIResponse:
+    run_async = payload.run_async
+    if run_async is None:
+        run_async = config.get("embed_upsert", {}).get("run_async")
+    if run_async:
+        job = get_job_runner(config).submit(
+            "embed_upsert",
+            lambda progress: embed_upsert(payload, config, progress=progress),
+        )
+        return APIResponse(detail="embed upsert job submitted", result=job)
+    result = embed_upsert(payload, config)
+    return APIResponse(detail="embed upsert request accepted", result=result)
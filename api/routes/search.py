@@ -2,13 +2,19 @@ from fastapi import APIRouter, Depends
 
 from api.deps import get_config
 from api.schemas.common import APIResponse
-from api.schemas.search import SearchRequest
-from functions.core.search import search
+from api.schemas.search import SearchBatchRequest, SearchRequest
+from functions.core.search import search_batch, search_coalesced
 
 router = APIRouter(prefix="/v1")
 
 
 @router.post("/search", response_model=APIResponse)
-def search_route(payload: SearchRequest, config: dict = Depends(get_config)) -> APIResponse:
-    result = search(payload, config)
+async def search_route(payload: SearchRequest, config: dict = Depends(get_config)) -> APIResponse:
+    result = await search_coalesced(payload, config)
     return APIResponse(detail="search request completed", result=result)
+
+
+@router.post("/search/batch", response_model=APIResponse)
+def search_batch_route(payload: SearchBatchRequest, config: dict = Depends(get_config)) -> APIResponse:
+    result = search_batch(payload, config)
+    return APIResponse(detail="batch search request completed", result=result)
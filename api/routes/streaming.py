@@ -2,20 +2,59 @@ from fastapi import APIRouter, Depends
 
 from api.deps import get_config
 from api.schemas.common import APIResponse
-from api.schemas.streaming import StreamingDeleteRequest, StreamingUpdateRequest
+from api.schemas.streaming import (
+    StreamingDeleteRequest,
+    StreamingSyncRequest,
+    StreamingUpdateRequest,
+)
 from functions.core.streaming_delete import streaming_delete
+from functions.core.streaming_sync import streaming_sync
 from functions.core.streaming_update import streaming_update
+from functions.utils.jobs import get_job_runner
 
 router = APIRouter(prefix="/v1")
 
 
 @router.post("/streaming/update/", response_model=APIResponse)
 def streaming_update_route(payload: StreamingUpdateRequest, config: dict = Depends(get_config)) -> APIResponse:
+    run_async = payload.run_async
+    if run_async is None:
+        run_async = config.get("streaming_update", {}).get("run_async")
+    if run_async:
+        job = get_job_runner(config).submit(
+            "streaming_update",
+            lambda progress: streaming_update(payload, config, progress=progress),
+        )
+        return APIResponse(detail="streaming update job submitted", result=job)
     result = streaming_update(payload, config)
     return APIResponse(detail="streaming update request accepted", result=result)
 
 
 @router.post("/streaming/delete/", response_model=APIResponse)
 def streaming_delete_route(payload: StreamingDeleteRequest, config: dict = Depends(get_config)) -> APIResponse:
+    run_async = payload.run_async
+    if run_async is None:
+        run_async = config.get("streaming_delete", {}).get("run_async")
+    if run_async:
+        job = get_job_runner(config).submit(
+            "streaming_delete",
+            lambda progress: streaming_delete(payload, config, progress=progress),
+        )
+        return APIResponse(detail="streaming delete job submitted", result=job)
     result = streaming_delete(payload, config)
     return APIResponse(detail="streaming delete request accepted", result=result)
+
+
+@router.post("/streaming/sync/", response_model=APIResponse)
+def streaming_sync_route(payload: StreamingSyncRequest, config: dict = Depends(get_config)) -> APIResponse:
+    run_async = payload.run_async
+    if run_async is None:
+        run_async = config.get("streaming_sync", {}).get("run_async")
+    if run_async:
+        job = get_job_runner(config).submit(
+            "streaming_sync",
+            lambda progress: streaming_sync(payload, config, progress=progress),
+        )
+        return APIResponse(detail="streaming sync job submitted", result=job)
+    result = streaming_sync(payload, config)
+    return APIResponse(detail="streaming sync request accepted", result=result)
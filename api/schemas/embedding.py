@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic import BaseModel, Field
 
 
@@ -11,6 +13,13 @@ class EmbedDataRequest(BaseModel):
     dimension: int | None = None
     filename: str | None = None
     file_type: str | None = None
+    vector_dtype: Literal["float32", "float16"] | None = None
+    compression: Literal["gzip", "zstd"] | None = None
+    streaming: bool | None = None
+    incremental: bool | None = None
+    watermark_column: str | None = None
+    checkpoint: bool | None = None
+    run_async: bool | None = None
 
 
 class EmbedTextRequest(BaseModel):
@@ -19,4 +28,6 @@ class EmbedTextRequest(BaseModel):
     dimension: int | None = None
     filename: str | None = None
     file_type: str | None = None
+    vector_dtype: Literal["float32", "float16"] | None = None
+    compression: Literal["gzip", "zstd"] | None = None
     embedding_model_name: str | None = None
@@ -0,0 +1,20 @@
+from typing import Literal
+
+from pydantic import BaseModel, Field
+
+
+class EmbedUpsertRequest(BaseModel):
+    index_id: str = Field(..., description="Vertex index resource name")
+    bigquery_table: str = Field(..., description="BigQuery source table")
+    where: str | None = None
+    col_to_embed: list[str] | None = None
+    restrict_columns: list[str] | None = None
+    numeric_restricts_columns: list[str] | None = None
+    dimension: int | None = None
+    embedding_model_name: str | None = None
+    gcs_output_prefix: str | None = Field(
+        None, description="Optional GCS prefix for an audit copy of the datapoints"
+    )
+    filename: str | None = None
+    file_type: Literal["json", "npz"] | None = None
+    run_async: bool | None = None
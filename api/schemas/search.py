@@ -23,3 +23,25 @@ class SearchRequest(BaseModel):
         if self.query_type == "vector" and not isinstance(self.query, list):
             raise ValueError("query must be number vector when query_type=vector")
         return self
+
+
+class SearchQuery(BaseModel):
+    query: str | list[float]
+    query_type: Literal["vector", "text"] | None = None
+    top_k: int | None = Field(None, ge=1)
+    restricts: list[Restrict] | None = None
+
+    @model_validator(mode="after")
+    def validate_query(self) -> "SearchQuery":
+        if self.query_type == "text" and not isinstance(self.query, str):
+            raise ValueError("query must be string when query_type=text")
+        if self.query_type == "vector" and not isinstance(self.query, list):
+            raise ValueError("query must be number vector when query_type=vector")
+        return self
+
+
+class SearchBatchRequest(BaseModel):
+    endpoint_id: str = Field(..., description="Index endpoint resource name")
+    deployed_index_id: str = Field(..., description="Deployed index id")
+    queries: list[SearchQuery] = Field(..., min_length=1)
+    top_k: int | None = Field(None, ge=1)
@@ -1,14 +1,44 @@
 from typing import Literal
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 
 
 class StreamingUpdateRequest(BaseModel):
     index_id: str = Field(..., description="Vertex index resource name")
     datapoints_source: Literal["gcs"] | None = None
     datapoints_gcs_prefix: str = Field(..., description="GCS prefix for datapoints")
+    datapoints_file_type: Literal["json", "npz"] | None = None
+    run_async: bool | None = None
+
+
+class StreamingSyncRequest(BaseModel):
+    index_id: str = Field(..., description="Vertex index resource name")
+    datapoints_source: Literal["gcs"] | None = None
+    datapoints_gcs_prefix: str = Field(..., description="GCS prefix with the full set of datapoints")
+    datapoints_file_type: Literal["json", "npz"] | None = None
+    delete_missing: bool | None = None
+    max_delete_fraction: float | None = Field(None, ge=0, le=1)
+    force_delete: bool | None = None
+    full_resync: bool | None = None
+    run_async: bool | None = None
 
 
 class StreamingDeleteRequest(BaseModel):
     index_id: str = Field(..., description="Vertex index resource name")
-    datapoint_ids: list[str] = Field(..., min_length=1)
+    datapoint_ids: list[str] | None = Field(None, min_length=1)
+    ids_gcs_prefix: str | None = Field(None, description="GCS prefix with files of ids to delete")
+    ids_file_type: Literal["json", "txt", "npz"] | None = None
+    ids_field: str | None = None
+    bigquery_table: str | None = Field(None, description="BigQuery table with ids to delete")
+    where: str | None = None
+    id_column: str | None = None
+    run_async: bool | None = None
+
+    @model_validator(mode="after")
+    def validate_source(self) -> "StreamingDeleteRequest":
+        sources = [self.datapoint_ids, self.ids_gcs_prefix, self.bigquery_table]
+        if sum(source is not None for source in sources) != 1:
+            raise ValueError(
+                "Provide exactly one of datapoint_ids, ids_gcs_prefix or bigquery_table"
+            )
+        return self
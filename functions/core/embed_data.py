@@ -1,14 +1,36 @@
-from datetime import datetime
+import hashlib
+import json
+import time
+from collections.abc import Callable, Iterator
+from datetime import date, datetime, timezone
 from typing import Any
 
 import numpy as np
-import vertexai
 from api.exceptions import PipelineException
 from api.schemas.embedding import EmbedDataRequest, EmbedTextRequest
-from functions.utils.bigquery import query_table
-from functions.utils.gcs import write_to_gcs
+from functions.utils.batching import pack_batches, run_batches
+from functions.utils.bigquery import iter_table_pages, query_parameter, query_table
+from functions.utils.clients import get_embedding_model
+from functions.utils.embedding_cache import (
+    EmbeddingCache,
+    embedding_cache_key,
+    get_embedding_cache,
+)
+from functions.utils.embedding_scheduler import EmbeddingScheduler, get_embedding_scheduler
+from functions.utils.gcs import ShardedGCSWriter, encode_jsonl, write_to_gcs
+from functions.utils.jobs import JobProgress
+from functions.utils.jsonl import encode_datapoints_jsonl
+from functions.utils.pipeline import staged
+from functions.utils.process_pool import (
+    SharedArray,
+    map_in_processes,
+    read_shared_rows,
+    row_slices,
+    shared_array,
+)
+from functions.utils.state_store import get_state_store
 from functions.utils.validators import apply_defaults
-from vertexai.language_models import TextEmbeddingInput, TextEmbeddingModel
+from vertexai.language_models import TextEmbeddingInput
 
 
 def _l2_normalize(mat: np.ndarray) -> np.ndarray:
@@ -95,6 +117,209 @@ def _build_numeric_restricts(
     return items
 
 
+# Columnar variants of the row builders above. They work on one column at a time,
+# detect each timestamp column's format once, and must produce exactly the same
+# output as `_build_text`, `_build_restricts` and `_build_numeric_restricts`.
+_TIMESTAMP_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d")
+_TIMESTAMP_LAYOUTS = {
+    "%Y-%m-%d %H:%M:%S": "dddd-dd-dd dd:dd:dd",
+    "%Y-%m-%dT%H:%M:%S": "dddd-dd-ddTdd:dd:dd",
+    "%Y-%m-%d": "dddd-dd-dd",
+}
+
+
+def _rows_to_columns(
+    rows: list[dict[str, Any]], columns: list[str]
+) -> dict[str, list[Any]]:
+    return {column: [row.get(column) for row in rows] for column in dict.fromkeys(columns)}
+
+
+def _build_texts_columnar(
+    columns: dict[str, list[Any]], column_list: list[str], row_count: int
+) -> list[str]:
+    parts_by_column = []
+    for field in column_list:
+        values = columns.get(field) or [None] * row_count
+        parts_by_column.append(
+            ["" if value in (None, "") else str(value).strip() for value in values]
+        )
+    if not parts_by_column:
+        return [" "] * row_count
+    return [
+        "\n".join(part for part in parts if part) or " "
+        for parts in zip(*parts_by_column)
+    ]
+
+
+def _build_restricts_columnar(
+    columns: dict[str, list[Any]], restrict_columns: list[str], row_count: int
+) -> list[list[dict[str, Any]]]:
+    restricts: list[list[dict[str, Any]]] = [[] for _ in range(row_count)]
+    for column in restrict_columns:
+        # Restrict values repeat heavily (categories, flags), so scalar entries are
+        # built once per distinct token. The memo is keyed on the token itself:
+        # values that compare equal can still stringify differently
+        # (Decimal("1.0") and Decimal("1.00"), 0.0 and -0.0).
+        memo: dict[str, dict[str, Any]] = {}
+        for row_restricts, value in zip(restricts, columns.get(column) or []):
+            if value is None or value == "":
+                continue
+            if isinstance(value, (list, tuple)):
+                allow = [str(v) for v in value if v not in (None, "")]
+                if allow:
+                    row_restricts.append({"namespace": column, "allow": allow})
+                continue
+            token = str(value)
+            entry = memo.get(token)
+            if entry is None:
+                entry = memo[token] = {"namespace": column, "allow": [token]}
+            row_restricts.append(entry)
+    return restricts
+
+
+def _local_time_is_utc() -> bool:
+    return time.timezone == 0 and not time.daylight
+
+
+def _detect_timestamp_format(text: str) -> str | None:
+    if text.isdigit() or (text.startswith("-") and text[1:].isdigit()):
+        return "int"
+    for fmt in _TIMESTAMP_FORMATS:
+        try:
+            datetime.strptime(text, fmt)
+            return fmt
+        except ValueError:
+            continue
+    return None
+
+
+def _parse_fixed_layout(texts: list[str], fmt: str) -> list[int | None] | None:
+    # Bulk-parse strings that match the strict layout of `fmt` with numpy. Returns
+    # None when the fast path does not apply so callers fall back to per-value parsing.
+    layout = _TIMESTAMP_LAYOUTS[fmt]
+    if not texts or not _local_time_is_utc():
+        return None
+    if any(len(text) != len(layout) for text in texts):
+        return None
+    try:
+        raw = np.array(texts, dtype=f"S{len(layout)}")
+    except UnicodeEncodeError:
+        return None
+    chars = raw.view(np.uint8).reshape(len(texts), len(layout))
+    pattern = np.frombuffer(layout.encode("ascii"), dtype=np.uint8)
+    digit_mask = pattern == ord("d")
+    digits = chars[:, digit_mask]
+    if not (
+        np.all((digits >= ord("0")) & (digits <= ord("9")))
+        and np.all(chars[:, ~digit_mask] == pattern[~digit_mask])
+    ):
+        return None
+    values = (digits - ord("0")).astype(np.int64)
+    if np.any(values[:, :4] @ np.array([1000, 100, 10, 1]) < 1):
+        return None
+    if values.shape[1] > 8:
+        fields = values[:, 8:].reshape(len(texts), 3, 2) @ np.array([10, 1])
+        if np.any(fields[:, 0] > 23) or np.any(fields[:, 1:] > 59):
+            return None
+    try:
+        parsed = np.array(texts, dtype="datetime64[s]").astype(np.int64)
+    except ValueError:
+        return None
+    return parsed.tolist()
+
+
+def _epoch_seconds_column(
+    values: list[Any], *, column: str, format_cache: dict[str, str | None]
+) -> list[int | None]:
+    results: list[int | None] = [None] * len(values)
+    text_positions: list[int] = []
+    texts: list[str] = []
+    for pos, value in enumerate(values):
+        if value is None or value == "":
+            continue
+        if isinstance(value, datetime):
+            results[pos] = int(value.timestamp())
+        elif isinstance(value, bool):
+            results[pos] = int(value)
+        elif isinstance(value, int):
+            results[pos] = value
+        elif isinstance(value, float):
+            results[pos] = int(value)
+        else:
+            text = str(value).strip()
+            if text:
+                text_positions.append(pos)
+                texts.append(text)
+    if not texts:
+        return results
+
+    if column not in format_cache:
+        format_cache[column] = _detect_timestamp_format(texts[0])
+    fmt = format_cache[column]
+
+    parsed: list[int | None] | None = None
+    if fmt in _TIMESTAMP_LAYOUTS:
+        parsed = _parse_fixed_layout(texts, fmt)
+    if parsed is None:
+        parsed = []
+        for text in texts:
+            value = None
+            if fmt == "int":
+                if text.isdigit() or (text.startswith("-") and text[1:].isdigit()):
+                    value = int(text)
+            elif fmt is not None:
+                try:
+                    value = int(datetime.strptime(text, fmt).timestamp())
+                except ValueError:
+                    pass
+            parsed.append(value if value is not None else _to_epoch_seconds(text))
+    for pos, value in zip(text_positions, parsed):
+        results[pos] = value
+    return results
+
+
+def _build_numeric_restricts_columnar(
+    columns: dict[str, list[Any]],
+    numeric_restricts_columns: list[str],
+    row_count: int,
+    *,
+    format_cache: dict[str, str | None],
+) -> list[list[dict[str, Any]]]:
+    items: list[list[dict[str, Any]]] = [[] for _ in range(row_count)]
+    for column in numeric_restricts_columns:
+        values = columns.get(column) or [None] * row_count
+        float_positions = {
+            pos for pos, raw in enumerate(values) if isinstance(raw, float)
+        }
+        parsed = _epoch_seconds_column(
+            [None if pos in float_positions else raw for pos, raw in enumerate(values)],
+            column=column,
+            format_cache=format_cache,
+        )
+        for pos, (raw, epoch) in enumerate(zip(values, parsed)):
+            if pos in float_positions:
+                items[pos].append({"namespace": column, "value_float": float(raw)})
+            elif epoch is not None:
+                items[pos].append({"namespace": column, "value_int": int(epoch)})
+    return items
+
+
+# Per-request instance limits of the Vertex text embedding models.
+_MODEL_MAX_INSTANCES = {
+    "gemini-embedding-001": 1,
+}
+_DEFAULT_MAX_INSTANCES = 250
+
+
+def _batching_options(request: dict[str, Any]) -> dict[str, int]:
+    return {
+        "batch_size": int(request.get("batch_size") or _DEFAULT_MAX_INSTANCES),
+        "max_batch_tokens": int(request.get("max_batch_tokens") or 20000),
+        "concurrency": int(request.get("concurrency") or 1),
+        "max_retries": int(request.get("max_retries") or 0),
+    }
+
+
 def _embed_texts(
     *,
     project_id: str,
@@ -102,19 +327,91 @@ def _embed_texts(
     embedding_model: str,
     output_dimensionality: int,
     texts: list[str],
-) -> np.ndarray:
-    vertexai.init(project=project_id, location=region)
-    model = TextEmbeddingModel.from_pretrained(embedding_model)
-    inputs = [
-        TextEmbeddingInput(text=text, task_type="RETRIEVAL_DOCUMENT") for text in texts
-    ]
-    embeddings = model.get_embeddings(
-        inputs, output_dimensionality=output_dimensionality
+    task_type: str = "RETRIEVAL_DOCUMENT",
+    batch_size: int = _DEFAULT_MAX_INSTANCES,
+    max_batch_tokens: int = 20000,
+    concurrency: int = 1,
+    max_retries: int = 0,
+    cache: EmbeddingCache | None = None,
+    scheduler: EmbeddingScheduler | None = None,
+    priority: str = "bulk",
+    on_embedded: Callable[[int], None] | None = None,
+    normalize: bool = True,
+    cache_keys: list[str] | None = None,
+) -> tuple[np.ndarray, dict[str, int]]:
+    vectors = np.empty((len(texts), output_dimensionality), dtype=np.float32)
+
+    # Only texts missing from the cache are sent to Vertex; duplicates share one call.
+    # `cache_keys` lets a caller key texts its own way without changing what is sent.
+    pending = list(range(len(texts)))
+    keys: list[str] = []
+    if cache is not None:
+        keys = cache_keys or [
+            embedding_cache_key(embedding_model, output_dimensionality, task_type, text)
+            for text in texts
+        ]
+        cached = cache.get_many(keys)
+        first_index: dict[str, int] = {}
+        for idx, key in enumerate(keys):
+            if key in cached:
+                vectors[idx] = cached[key]
+            elif key not in first_index:
+                first_index[key] = idx
+        pending = list(first_index.values())
+    stats = {"cache_hits": len(texts) - len(pending), "cache_misses": len(pending)}
+    if on_embedded is not None and stats["cache_hits"]:
+        on_embedded(stats["cache_hits"])
+    if not pending:
+        return vectors, stats
+
+    model = get_embedding_model(project_id, region, embedding_model)
+
+    max_instances = min(
+        batch_size, _MODEL_MAX_INSTANCES.get(embedding_model, _DEFAULT_MAX_INSTANCES)
     )
-    return _l2_normalize(
-        np.asarray([embedding.values for embedding in embeddings], dtype=np.float32)
+    batches = [
+        [pending[pos] for pos in batch]
+        for batch in pack_batches(
+            [texts[idx] for idx in pending],
+            max_instances=max_instances,
+            max_tokens=max_batch_tokens,
+        )
+    ]
+
+    def _embed_batch(indices: list[int]) -> None:
+        inputs = [
+            TextEmbeddingInput(text=texts[idx], task_type=task_type) for idx in indices
+        ]
+
+        def _request() -> list[Any]:
+            return model.get_embeddings(inputs, output_dimensionality=output_dimensionality)
+
+        embeddings = (
+            scheduler.call(_request, priority=priority, instances=len(indices))
+            if scheduler
+            else _request()
+        )
+        if len(embeddings) != len(indices):
+            raise ValueError(
+                f"Expected {len(indices)} embeddings from {embedding_model}, got {len(embeddings)}"
+            )
+        values = np.asarray([embedding.values for embedding in embeddings], dtype=np.float32)
+        vectors[indices] = _l2_normalize(values) if normalize else values
+        if on_embedded is not None:
+            on_embedded(len(indices))
+
+    run_batches(
+        _embed_batch, batches, concurrency=concurrency, max_retries=max_retries
     )
 
+    if cache is not None:
+        fresh = {keys[idx]: vectors[idx] for idx in pending}
+        for idx, key in enumerate(keys):
+            if key in fresh:
+                vectors[idx] = fresh[key]
+        cache.put_many(fresh)
+    return vectors, stats
+
 
 def _require_project_config(config: dict) -> tuple[str, str]:
     project_id = config.get("project_id")
@@ -149,30 +446,34 @@ def embed_text(payload: EmbedTextRequest, config: dict) -> dict:
             request.get("dimension") or defaults.get("dimension") or 768
         )
 
-        vectors = _embed_texts(
+        vectors, cache_stats = _embed_texts(
             project_id=project_id,
             region=region,
             embedding_model=embedding_model,
             output_dimensionality=output_dimensionality,
             texts=texts,
+            cache=get_embedding_cache(config),
+            scheduler=get_embedding_scheduler(config),
+            **_batching_options(request),
         )
 
-        items = [{"embedding": vector.tolist()} for vector in vectors]
+        items = [{"embedding": vector} for vector in vectors]
 
-        gcs_uri = write_to_gcs(
+        manifest = write_to_gcs(
             request["gcs_output_prefix"],
             items,
-            filename=filename,
-            file_type=file_type,
+            **_writer_options(request, filename=filename, file_type=file_type),
         )
 
         return {
             "status": "EMBEDDED",
             "mode": "text",
             "gcs_output_prefix": request["gcs_output_prefix"],
-            "gcs_output_file": gcs_uri,
+            "gcs_output_file": manifest["files"][0],
+            "gcs_output_files": manifest["files"],
             "row_count": len(texts),
             "dimension": output_dimensionality,
+            **cache_stats,
         }
     except PipelineException:
         raise
@@ -184,83 +485,783 @@ def embed_text(payload: EmbedTextRequest, config: dict) -> dict:
         ) from exc
 
 
-def embed_data(payload: EmbedDataRequest, config: dict) -> dict:
-    defaults = config.get("embed_data", {})
-    request = apply_defaults(payload, defaults)
+def _build_datapoints(
+    rows: list[dict[str, Any]],
+    vectors: np.ndarray,
+    *,
+    restrict_columns: list[str],
+    numeric_restricts_columns: list[str],
+    start_index: int = 1,
+) -> list[dict[str, Any]]:
+    items: list[dict[str, Any]] = []
+    for idx, (row, vector) in enumerate(zip(rows, vectors), start=start_index):
+        datapoint_id = str(row.get("id") or row.get("uuid") or row.get("code") or idx)
+        item: dict[str, Any] = {
+            "id": datapoint_id,
+            "embedding": vector,
+            "restricts": _build_restricts(row, restrict_columns),
+            "numeric_restricts": _build_numeric_restricts(
+                row, numeric_restricts_columns
+            ),
+        }
+        items.append(item)
+    return items
 
-    project_id, region = _require_project_config(config)
 
-    try:
-        rows = query_table(request["bigquery_table"], request["where"])
-        if not rows:
-            raise PipelineException(
-                "No rows found for the given bigquery_table/where filter. No file was written to GCS.",
-                status_code=400,
-            )
+def _build_datapoints_columnar(
+    rows: list[dict[str, Any]],
+    vectors: np.ndarray,
+    *,
+    restrict_columns: list[str],
+    numeric_restricts_columns: list[str],
+    start_index: int = 1,
+    format_cache: dict[str, str | None],
+) -> list[dict[str, Any]]:
+    columns = _rows_to_columns(rows, restrict_columns + numeric_restricts_columns)
+    restricts = _build_restricts_columnar(columns, restrict_columns, len(rows))
+    numeric_restricts = _build_numeric_restricts_columnar(
+        columns, numeric_restricts_columns, len(rows), format_cache=format_cache
+    )
+    return [
+        {
+            "id": str(row.get("id") or row.get("uuid") or row.get("code") or idx),
+            "embedding": vector,
+            "restricts": row_restricts,
+            "numeric_restricts": row_numeric_restricts,
+        }
+        for idx, (row, vector, row_restricts, row_numeric_restricts) in enumerate(
+            zip(rows, vectors, restricts, numeric_restricts), start=start_index
+        )
+    ]
 
-        embedding_model = (
-            request.get("embedding_model_name")
-            or defaults.get("embedding_model_name")
-            or "gemini-embedding-001"
+
+def _build_texts(
+    rows: list[dict[str, Any]], column_list: list[str], *, columnar: bool
+) -> list[str]:
+    if columnar:
+        return _build_texts_columnar(
+            _rows_to_columns(rows, column_list), column_list, len(rows)
         )
-        restrict_columns = (
-            request.get("restrict_columns") or defaults.get("restrict_columns") or []
+    return [_build_text(row, column_list=column_list) for row in rows]
+
+
+def _datapoints(
+    rows: list[dict[str, Any]],
+    vectors: np.ndarray,
+    options: dict[str, Any],
+    *,
+    start_index: int = 1,
+) -> list[dict[str, Any]]:
+    if options["columnar"]:
+        return _build_datapoints_columnar(
+            rows,
+            vectors,
+            restrict_columns=options["restrict_columns"],
+            numeric_restricts_columns=options["numeric_restricts_columns"],
+            start_index=start_index,
+            format_cache=options["timestamp_formats"],
         )
-        numeric_restricts_columns = (
-            request.get("numeric_restricts_columns")
-            or defaults.get("numeric_restricts_columns")
-            or []
+    return _build_datapoints(
+        rows,
+        vectors,
+        restrict_columns=options["restrict_columns"],
+        numeric_restricts_columns=options["numeric_restricts_columns"],
+        start_index=start_index,
+    )
+
+
+def _encode_datapoints(
+    items: list[dict[str, Any]], vectors: np.ndarray, float_precision: int | None
+) -> str:
+    if float_precision is None:
+        return encode_jsonl(items)
+    return encode_datapoints_jsonl(items, precision=float_precision, vectors=vectors)
+
+
+def _cpu_options(request: dict[str, Any]) -> dict[str, int]:
+    return {
+        "workers": int(request.get("cpu_workers") or 0),
+        "max_rows": int(request.get("cpu_chunk_rows") or 1024),
+    }
+
+
+# Entry points of the CPU process pool. They run in worker processes, so they only
+# take picklable arguments and read their vectors from shared memory.
+def _texts_task(
+    columns: dict[str, list[Any]], column_list: list[str], columnar: bool, row_count: int
+) -> list[str]:
+    if columnar:
+        return _build_texts_columnar(columns, column_list, row_count)
+    rows = [dict(zip(columns, values)) for values in zip(*columns.values())]
+    return [_build_text(row, column_list=column_list) for row in rows]
+
+
+def _serialize_task(
+    rows: list[dict[str, Any]],
+    vectors: SharedArray,
+    start: int,
+    stop: int,
+    options: dict[str, Any],
+    start_index: int,
+    float_precision: int | None,
+    encode_json: bool,
+) -> str | list[dict[str, Any]]:
+    slice_vectors = read_shared_rows(vectors, start, stop)
+    items = _datapoints(rows, slice_vectors, options, start_index=start_index)
+    if not encode_json:
+        # Vectors stay in the parent; only ids and restricts are sent back.
+        return [{key: value for key, value in item.items() if key != "embedding"} for item in items]
+    return _encode_datapoints(items, slice_vectors, float_precision)
+
+
+def _build_texts_in_processes(
+    rows: list[dict[str, Any]], column_list: list[str], *, columnar: bool, cpu: dict[str, int]
+) -> list[str]:
+    # Workers get only the text columns, one list per column, not whole row dicts.
+    tasks = [
+        (_rows_to_columns(rows[start:stop], column_list), column_list, columnar, stop - start)
+        for start, stop in row_slices(
+            len(rows), workers=cpu["workers"], max_rows=cpu["max_rows"]
         )
-        filename = request.get("filename") or defaults.get("filename") or "part-00000"
-        file_type = request.get("file_type") or defaults.get("file_type") or "json"
-        output_dimensionality = int(request["dimension"])
+    ]
+    texts: list[str] = []
+    for part in map_in_processes(_texts_task, tasks, workers=cpu["workers"]):
+        texts.extend(part)
+    return texts
+
 
-        text_column_list = (
-            request.get("col_to_embed") or defaults.get("col_to_embed") or []
+def _serialize_in_slices(
+    rows: list[dict[str, Any]],
+    vectors: np.ndarray,
+    options: dict[str, Any],
+    *,
+    start_index: int,
+    float_precision: int | None,
+    encode_json: bool,
+    max_rows: int,
+    shard_rows: int = 0,
+) -> Iterator[tuple[str | list[dict[str, Any]], int]]:
+    # The in-process counterpart of _serialize_in_processes: the same slices, built
+    # and encoded one at a time, so intermediate items and strings stay small.
+    for start, stop in row_slices(
+        len(rows),
+        workers=1,
+        max_rows=max_rows,
+        boundary=shard_rows if encode_json else 0,
+        offset=start_index - 1,
+    ):
+        items = _datapoints(
+            rows[start:stop], vectors[start:stop], options, start_index=start_index + start
+        )
+        if encode_json:
+            yield _encode_datapoints(items, vectors[start:stop], float_precision), stop - start
+        else:
+            yield items, stop - start
+
+
+def _serialize_in_processes(
+    rows: list[dict[str, Any]],
+    vectors: np.ndarray,
+    options: dict[str, Any],
+    *,
+    start_index: int,
+    float_precision: int | None,
+    encode_json: bool,
+    cpu: dict[str, int],
+    shard_rows: int = 0,
+) -> list[tuple[str | list[dict[str, Any]], int]]:
+    # Slices never straddle a row-based shard boundary, so shards come out the same
+    # size as with in-process serialization.
+    slices = row_slices(
+        len(rows),
+        workers=cpu["workers"],
+        max_rows=cpu["max_rows"],
+        boundary=shard_rows if encode_json else 0,
+        offset=start_index - 1,
+    )
+    task_options = {
+        key: options[key]
+        for key in (
+            "columnar",
+            "restrict_columns",
+            "numeric_restricts_columns",
+            "timestamp_formats",
         )
-        if not text_column_list:
-            text_column_list = [
-                key for key in rows[0].keys() if key not in {"id", "uuid", "code"}
+    }
+    with shared_array(vectors) as handle:
+        results = map_in_processes(
+            _serialize_task,
+            [
+                (
+                    rows[start:stop],
+                    handle,
+                    start,
+                    stop,
+                    task_options,
+                    start_index + start,
+                    float_precision,
+                    encode_json,
+                )
+                for start, stop in slices
+            ],
+            workers=cpu["workers"],
+        )
+
+    chunks: list[tuple[str | list[dict[str, Any]], int]] = []
+    for (start, stop), result in zip(slices, results):
+        if not encode_json:
+            result = [
+                {
+                    "id": item["id"],
+                    "embedding": vector,
+                    "restricts": item["restricts"],
+                    "numeric_restricts": item["numeric_restricts"],
+                }
+                for item, vector in zip(result, vectors[start:stop])
             ]
-        texts = [_build_text(row, column_list=text_column_list) for row in rows]
-        vectors = _embed_texts(
-            project_id=project_id,
-            region=region,
-            embedding_model=embedding_model,
-            output_dimensionality=output_dimensionality,
+        chunks.append((result, stop - start))
+    return chunks
+
+
+def _float_precision(request: dict[str, Any]) -> int | None:
+    precision = request.get("json_float_precision")
+    return int(precision) if precision else None
+
+
+def _writer_options(
+    request: dict[str, Any], *, filename: str, file_type: str
+) -> dict[str, Any]:
+    return {
+        "filename": filename,
+        "file_type": file_type,
+        "vector_dtype": request.get("vector_dtype") or "float32",
+        "float_precision": _float_precision(request),
+        "compression": request.get("compression") or None,
+        "max_rows_per_shard": int(request.get("max_rows_per_shard") or 0),
+        "max_bytes_per_shard": int(request.get("max_bytes_per_shard") or 0),
+        "upload_concurrency": int(request.get("upload_concurrency") or 4),
+    }
+
+
+def _default_text_columns(row: dict[str, Any]) -> list[str]:
+    return [key for key in row.keys() if key not in {"id", "uuid", "code"}]
+
+
+def _progress_counter(
+    progress: JobProgress | None, counter: str
+) -> Callable[[int], None] | None:
+    if progress is None:
+        return None
+    return lambda count: progress.add(**{counter: count})
+
+
+def _check_watermark_column(rows: list[dict[str, Any]], column: str | None) -> None:
+    # A missing column would leave the watermark unset, so every "incremental"
+    # run would silently re-embed the whole table.
+    if column and rows and column not in rows[0]:
+        raise PipelineException(
+            f"watermark_column `{column}` is not a column of the bigquery_table",
+            status_code=400,
+        )
+
+
+def _max_watermark(
+    rows: list[dict[str, Any]], column: str | None, current: Any = None
+) -> Any:
+    if not column:
+        return current
+    values = [row.get(column) for row in rows if row.get(column) not in (None, "")]
+    if current is not None:
+        values.append(current)
+    return max(values, default=None)
+
+
+def _embed_data_in_memory(
+    request: dict[str, Any],
+    options: dict[str, Any],
+    config: dict,
+    progress: JobProgress | None = None,
+) -> dict[str, Any] | None:
+    rows = query_table(
+        request["bigquery_table"],
+        options["where"],
+        query_parameters=options["query_parameters"],
+    )
+    if not rows:
+        return None
+    _check_watermark_column(rows, options["watermark_column"])
+    if progress is not None:
+        progress.set(rows_read=len(rows), rows_embedded=0, rows_written=0)
+
+    cpu = _cpu_options(request)
+    text_column_list = options["text_column_list"] or _default_text_columns(rows[0])
+    if cpu["workers"]:
+        texts = _build_texts_in_processes(
+            rows, text_column_list, columnar=options["columnar"], cpu=cpu
+        )
+    else:
+        texts = _build_texts(rows, text_column_list, columnar=options["columnar"])
+    vectors, cache_stats = _embed_texts(
+        project_id=options["project_id"],
+        region=options["region"],
+        embedding_model=options["embedding_model"],
+        output_dimensionality=options["output_dimensionality"],
+        texts=texts,
+        cache=get_embedding_cache(config),
+        scheduler=get_embedding_scheduler(config),
+        on_embedded=_progress_counter(progress, "rows_embedded"),
+        **_batching_options(request),
+    )
+
+    writer_options = _writer_options(
+        request, filename=options["filename"], file_type=options["file_type"]
+    )
+    encode_json = options["file_type"].strip().lstrip(".").lower() == "json"
+    if cpu["workers"]:
+        chunks = _serialize_in_processes(
+            rows,
+            vectors,
+            options,
+            start_index=1,
+            float_precision=writer_options["float_precision"],
+            encode_json=encode_json,
+            cpu=cpu,
+            shard_rows=writer_options["max_rows_per_shard"],
+        )
+    else:
+        chunks = _serialize_in_slices(
+            rows,
+            vectors,
+            options,
+            start_index=1,
+            float_precision=writer_options["float_precision"],
+            encode_json=encode_json,
+            max_rows=cpu["max_rows"],
+            shard_rows=writer_options["max_rows_per_shard"],
+        )
+    writer = ShardedGCSWriter(request["gcs_output_prefix"], **writer_options)
+    try:
+        for payload, row_count in chunks:
+            if isinstance(payload, str):
+                writer.write_encoded(payload, row_count)
+            else:
+                writer.write(payload)
+        manifest = writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    if progress is not None:
+        progress.set(rows_written=len(rows))
+    return {
+        "gcs_output_file": manifest["files"][0],
+        "gcs_output_files": manifest["files"],
+        "row_count": len(rows),
+        "watermark": _max_watermark(rows, options["watermark_column"]),
+        **cache_stats,
+    }
+
+
+def _embed_data_streaming(
+    request: dict[str, Any],
+    options: dict[str, Any],
+    config: dict,
+    progress: JobProgress | None = None,
+) -> dict[str, Any] | None:
+    # BigQuery pages flow through text building, embedding, serialization and upload.
+    # Each stage runs in its own thread behind a bounded queue, so memory stays flat
+    # and the BigQuery, Vertex and GCS waits overlap.
+    encode_json = options["file_type"].strip().lstrip(".").lower() == "json"
+    float_precision = _float_precision(request)
+    queue_size = int(request.get("queue_size") or 2)
+    cache = get_embedding_cache(config)
+    scheduler = get_embedding_scheduler(config)
+    batching = _batching_options(request)
+    cpu = _cpu_options(request)
+    checkpoint = options["checkpoint"]
+    resume = checkpoint["state"] if checkpoint else None
+    rows_done = int(resume["rows_done"]) if resume else 0
+    state: dict[str, Any] = {
+        "next_index": rows_done + 1,
+        "text_column_list": options["text_column_list"]
+        or (resume or {}).get("text_column_list")
+        or [],
+        "watermark": _decode_watermark(resume["watermark"])
+        if resume and resume.get("watermark")
+        else None,
+    }
+    totals = {"row_count": rows_done, "cache_hits": 0, "cache_misses": 0}
+    if progress is not None and rows_done:
+        progress.set(rows_resumed=rows_done)
+
+    def _prepare(rows: list[dict[str, Any]]) -> tuple[list[dict[str, Any]], list[str], int]:
+        if not state["text_column_list"]:
+            state["text_column_list"] = _default_text_columns(rows[0])
+        _check_watermark_column(rows, options["watermark_column"])
+        if cpu["workers"]:
+            texts = _build_texts_in_processes(
+                rows, state["text_column_list"], columnar=options["columnar"], cpu=cpu
+            )
+        else:
+            texts = _build_texts(
+                rows, state["text_column_list"], columnar=options["columnar"]
+            )
+        start_index = state["next_index"]
+        state["next_index"] += len(rows)
+        if progress is not None:
+            progress.add(rows_read=len(rows))
+        state["watermark"] = _max_watermark(
+            rows, options["watermark_column"], state["watermark"]
+        )
+        return rows, texts, start_index
+
+    def _embed(
+        chunk: tuple[list[dict[str, Any]], list[str], int],
+    ) -> tuple[list[dict[str, Any]], np.ndarray, int, dict[str, int]]:
+        rows, texts, start_index = chunk
+        vectors, cache_stats = _embed_texts(
+            project_id=options["project_id"],
+            region=options["region"],
+            embedding_model=options["embedding_model"],
+            output_dimensionality=options["output_dimensionality"],
             texts=texts,
+            cache=cache,
+            scheduler=scheduler,
+            on_embedded=_progress_counter(progress, "rows_embedded"),
+            **batching,
         )
+        return rows, vectors, start_index, cache_stats
 
-        items: list[dict[str, Any]] = []
-        for idx, (row, vector) in enumerate(zip(rows, vectors), start=1):
-            datapoint_id = str(
-                row.get("id") or row.get("uuid") or row.get("code") or idx
+    def _serialize(
+        chunk: tuple[list[dict[str, Any]], np.ndarray, int, dict[str, int]],
+    ) -> tuple[str | list[dict[str, Any]], int, dict[str, int]]:
+        rows, vectors, start_index, cache_stats = chunk
+        if cpu["workers"]:
+            chunks = _serialize_in_processes(
+                rows,
+                vectors,
+                options,
+                start_index=start_index,
+                float_precision=float_precision,
+                encode_json=encode_json,
+                cpu=cpu,
             )
-            item: dict[str, Any] = {
-                "id": datapoint_id,
-                "embedding": vector.tolist(),
-                "restricts": _build_restricts(row, restrict_columns),
-                "numeric_restricts": _build_numeric_restricts(
-                    row, numeric_restricts_columns
-                ),
-            }
-            items.append(item)
+        else:
+            chunks = _serialize_in_slices(
+                rows,
+                vectors,
+                options,
+                start_index=start_index,
+                float_precision=float_precision,
+                encode_json=encode_json,
+                max_rows=cpu["max_rows"],
+            )
+        if encode_json:
+            return "".join(payload for payload, _ in chunks), len(rows), cache_stats
+        return [item for items, _ in chunks for item in items], len(rows), cache_stats
 
-        gcs_uri = write_to_gcs(
+    pages = (
+        page
+        for page in iter_table_pages(
+            request["bigquery_table"],
+            options["where"],
+            page_size=int(request.get("page_size") or 1000),
+            query_parameters=options["query_parameters"],
+            order_by=checkpoint["order_by"] if checkpoint else None,
+            start_index=rows_done,
+        )
+        if page
+    )
+    serialized = staged(
+        staged(
+            staged(staged(pages, maxsize=queue_size), _prepare, maxsize=queue_size),
+            _embed,
+            maxsize=queue_size,
+        ),
+        _serialize,
+        maxsize=queue_size,
+    )
+
+    def _open_writer() -> ShardedGCSWriter:
+        previous_shards = resume["shards"] if resume else []
+        writer = ShardedGCSWriter(
             request["gcs_output_prefix"],
-            items,
-            filename=filename,
-            file_type=file_type,
+            **_writer_options(
+                request, filename=options["filename"], file_type=options["file_type"]
+            ),
+            first_shard=len(previous_shards),
+            previous_shards=previous_shards,
         )
+        if checkpoint and not writer.sharded:
+            raise ValueError(
+                "checkpoint requires max_rows_per_shard or max_bytes_per_shard to be set"
+            )
+        return writer
 
-        return {
+    writer: ShardedGCSWriter | None = _open_writer() if resume else None
+    saved_rows = rows_done
+    saved_at = time.monotonic()
+    try:
+        for payload, row_count, cache_stats in serialized:
+            if writer is None:
+                writer = _open_writer()
+            totals["row_count"] += row_count
+            totals["cache_hits"] += cache_stats["cache_hits"]
+            totals["cache_misses"] += cache_stats["cache_misses"]
+            if isinstance(payload, str):
+                writer.write_encoded(payload, row_count)
+            else:
+                writer.write(payload)
+            if progress is not None:
+                progress.add(rows_written=row_count)
+            if checkpoint and time.monotonic() - saved_at >= checkpoint["interval"]:
+                saved_rows = _save_checkpoint(request, checkpoint, writer, state, saved_rows)
+                saved_at = time.monotonic()
+        if writer is None:
+            return None
+        manifest = writer.close()
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+            if checkpoint:
+                # Record every shard that finished uploading before the failure.
+                _save_checkpoint(request, checkpoint, writer, state, saved_rows)
+        raise
+    if checkpoint:
+        checkpoint["store"].delete(checkpoint["key"])
+
+    outcome = {
+        "gcs_output_file": manifest["files"][0],
+        "gcs_output_files": manifest["files"],
+        "watermark": state["watermark"],
+        **totals,
+    }
+    if resume:
+        outcome["resumed_from_row"] = rows_done
+    return outcome
+
+
+def _encode_watermark(value: Any) -> dict[str, Any]:
+    if isinstance(value, bool):
+        return {"type": "bool", "value": value}
+    if isinstance(value, int):
+        return {"type": "int", "value": value}
+    if isinstance(value, float):
+        return {"type": "float", "value": value}
+    if isinstance(value, datetime):
+        return {"type": "datetime", "value": value.isoformat()}
+    if isinstance(value, date):
+        return {"type": "date", "value": value.isoformat()}
+    return {"type": "str", "value": str(value)}
+
+
+def _watermark_value(value: Any) -> Any:
+    return None if value is None else _encode_watermark(value)["value"]
+
+
+def _decode_watermark(state: dict[str, Any]) -> Any:
+    kind, value = state.get("type"), state.get("value")
+    if kind == "datetime":
+        return datetime.fromisoformat(value)
+    if kind == "date":
+        return date.fromisoformat(value)
+    return value
+
+
+def _watermark_state_key(request: dict[str, Any], column: str) -> str:
+    raw = "\x1f".join([request["bigquery_table"], column, request["gcs_output_prefix"]])
+    return f"watermarks/{hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]}"
+
+
+def _checkpoint_state_key(
+    request: dict[str, Any], options: dict[str, Any], gcs_output_prefix: str
+) -> str:
+    # Everything that changes which rows are read or how the output is laid out.
+    fields = {
+        "bigquery_table": request["bigquery_table"],
+        "where": options["where"],
+        "query_parameters": [
+            [parameter.name, parameter.type_, str(parameter.value)]
+            for parameter in options["query_parameters"] or []
+        ],
+        "order_by": options["checkpoint"]["order_by"],
+        "gcs_output_prefix": gcs_output_prefix,
+        "text_column_list": options["text_column_list"],
+        "restrict_columns": options["restrict_columns"],
+        "numeric_restricts_columns": options["numeric_restricts_columns"],
+        "embedding_model": options["embedding_model"],
+        "output_dimensionality": options["output_dimensionality"],
+        "writer": _writer_options(
+            request, filename=options["filename"], file_type=options["file_type"]
+        ),
+    }
+    raw = json.dumps(fields, sort_keys=True, default=str)
+    return f"checkpoints/{hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]}"
+
+
+def _save_checkpoint(
+    request: dict[str, Any],
+    checkpoint: dict[str, Any],
+    writer: ShardedGCSWriter,
+    state: dict[str, Any],
+    saved_rows: int,
+) -> int:
+    shards = writer.completed_shards()
+    rows_done = sum(shard["row_count"] for shard in shards)
+    if rows_done <= saved_rows:
+        return saved_rows
+    checkpoint["store"].put(
+        checkpoint["key"],
+        {
+            "bigquery_table": request["bigquery_table"],
+            "gcs_output_prefix": request["gcs_output_prefix"],
+            "rows_done": rows_done,
+            "shards": shards,
+            "text_column_list": state["text_column_list"],
+            "watermark": None
+            if state["watermark"] is None
+            else _encode_watermark(state["watermark"]),
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        },
+    )
+    return rows_done
+
+
+def embed_data(
+    payload: EmbedDataRequest, config: dict, *, progress: JobProgress | None = None
+) -> dict:
+    defaults = config.get("embed_data", {})
+    request = apply_defaults(payload, defaults)
+
+    project_id, region = _require_project_config(config)
+
+    try:
+        options: dict[str, Any] = {
+            "project_id": project_id,
+            "region": region,
+            "embedding_model": (
+                request.get("embedding_model_name")
+                or defaults.get("embedding_model_name")
+                or "gemini-embedding-001"
+            ),
+            "restrict_columns": (
+                request.get("restrict_columns")
+                or defaults.get("restrict_columns")
+                or []
+            ),
+            "numeric_restricts_columns": (
+                request.get("numeric_restricts_columns")
+                or defaults.get("numeric_restricts_columns")
+                or []
+            ),
+            "filename": request.get("filename") or defaults.get("filename") or "part-00000",
+            "file_type": request.get("file_type") or defaults.get("file_type") or "json",
+            "vector_dtype": request.get("vector_dtype") or "float32",
+            "output_dimensionality": int(request["dimension"]),
+            "text_column_list": (
+                request.get("col_to_embed") or defaults.get("col_to_embed") or []
+            ),
+            "columnar": bool(request.get("columnar")),
+            "timestamp_formats": {},
+            "where": request["where"],
+            "query_parameters": None,
+            "watermark_column": None,
+            "checkpoint": None,
+        }
+
+        gcs_output_prefix = request["gcs_output_prefix"]
+        incremental = bool(request.get("incremental"))
+        store = None
+        state_key = ""
+        previous_watermark = None
+        if incremental:
+            watermark_column = request.get("watermark_column") or "updated_at"
+            options["watermark_column"] = watermark_column
+            store = get_state_store(config)
+            state_key = _watermark_state_key(request, watermark_column)
+            state = store.get(state_key)
+            if state:
+                previous_watermark = _decode_watermark(state["watermark"])
+                options["where"] = f"({request['where']}) AND `{watermark_column}` > @watermark"
+                options["query_parameters"] = [
+                    query_parameter("watermark", previous_watermark)
+                ]
+            # Each delta run writes to its own folder so earlier deltas are kept.
+            run_id = datetime.now(timezone.utc).strftime("delta-%Y%m%dT%H%M%SZ")
+            request["gcs_output_prefix"] = f"{gcs_output_prefix.rstrip('/')}/{run_id}"
+
+        if request.get("checkpoint"):
+            # Checkpointed runs stream rows in a stable order, so a retry of the same
+            # request can skip the rows already in uploaded shards.
+            options["checkpoint"] = {
+                "store": store or get_state_store(config),
+                "order_by": request.get("checkpoint_order_by") or ["id"],
+                "interval": float(request.get("checkpoint_interval_seconds") or 0),
+            }
+            options["checkpoint"]["key"] = _checkpoint_state_key(
+                request, options, gcs_output_prefix
+            )
+            options["checkpoint"]["state"] = options["checkpoint"]["store"].get(
+                options["checkpoint"]["key"]
+            )
+            if options["checkpoint"]["state"]:
+                # A resumed delta run keeps writing into the folder it started.
+                request["gcs_output_prefix"] = options["checkpoint"]["state"][
+                    "gcs_output_prefix"
+                ]
+
+        streaming = bool(request.get("streaming")) or options["checkpoint"] is not None
+        if streaming:
+            outcome = _embed_data_streaming(request, options, config, progress)
+        else:
+            outcome = _embed_data_in_memory(request, options, config, progress)
+
+        if outcome is None:
+            if incremental:
+                return {
+                    "status": "UP_TO_DATE",
+                    "mode": "vertex_index_datapoints",
+                    "incremental": True,
+                    "gcs_output_prefix": gcs_output_prefix,
+                    "row_count": 0,
+                    "watermark_column": options["watermark_column"],
+                    "watermark": _watermark_value(previous_watermark),
+                }
+            raise PipelineException(
+                "No rows found for the given bigquery_table/where filter. No file was written to GCS.",
+                status_code=400,
+            )
+
+        watermark = outcome.pop("watermark")
+        result: dict[str, Any] = {
             "status": "EMBEDDED",
             "mode": "vertex_index_datapoints",
-            "gcs_output_prefix": request["gcs_output_prefix"],
-            "gcs_output_file": gcs_uri,
-            "row_count": len(rows),
-            "dimension": output_dimensionality,
+            "streaming": streaming,
+            "gcs_output_prefix": gcs_output_prefix,
+            "dimension": options["output_dimensionality"],
+            **outcome,
         }
+        if incremental:
+            # The watermark only moves once the delta output has been written.
+            if watermark is not None:
+                store.put(
+                    state_key,
+                    {
+                        "bigquery_table": request["bigquery_table"],
+                        "watermark_column": options["watermark_column"],
+                        "watermark": _encode_watermark(watermark),
+                        "updated_at": datetime.now(timezone.utc).isoformat(),
+                    },
+                )
+            result.update(
+                {
+                    "incremental": True,
+                    "delta_gcs_prefix": request["gcs_output_prefix"],
+                    "watermark_column": options["watermark_column"],
+                    "previous_watermark": _watermark_value(previous_watermark),
+                    "watermark": _watermark_value(watermark or previous_watermark),
+                }
+            )
+        return result
     except PipelineException:
         raise
     except ValueError as exc:
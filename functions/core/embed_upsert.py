@@ -0,0 +1,206 @@
+from collections.abc import Iterator
+from typing import Any
+
+from google.cloud.aiplatform_v1.types import index as gca_index
+
+from api.exceptions import PipelineException
+from api.schemas.pipeline import EmbedUpsertRequest
+from functions.core.embed_data import (
+    _DEFAULT_MAX_INSTANCES,
+    _build_texts,
+    _datapoints,
+    _default_text_columns,
+    _embed_texts,
+    _progress_counter,
+    _require_project_config,
+    _writer_options,
+)
+from functions.utils.bigquery import iter_table_pages
+from functions.utils.clients import get_index
+from functions.utils.datapoints import (
+    batch_bytes,
+    datapoint_ids,
+    mark_sync_manifest_stale,
+    index_batch_options,
+    iter_datapoint_batches,
+    iter_index_datapoints,
+    run_index_batches,
+)
+from functions.utils.embedding_cache import get_embedding_cache
+from functions.utils.embedding_scheduler import get_embedding_scheduler
+from functions.utils.gcs import ShardedGCSWriter
+from functions.utils.jobs import JobProgress
+from functions.utils.pipeline import staged
+from functions.utils.search_cache import invalidate_search_results
+from functions.utils.validators import apply_defaults
+
+
+def _embedding_options(request: dict[str, Any]) -> dict[str, int]:
+    # `batch_size` and `concurrency` belong to the upsert stage here, so the
+    # embedding stage has its own settings.
+    return {
+        "batch_size": int(request.get("embedding_batch_size") or _DEFAULT_MAX_INSTANCES),
+        "max_batch_tokens": int(request.get("max_batch_tokens") or 20000),
+        "concurrency": int(request.get("embedding_concurrency") or 1),
+        "max_retries": int(request.get("max_retries") or 0),
+    }
+
+
+def embed_upsert(
+    payload: EmbedUpsertRequest, config: dict, *, progress: JobProgress | None = None
+) -> dict:
+    defaults = config.get("embed_upsert", {})
+    request = apply_defaults(payload, defaults)
+
+    project_id, region = _require_project_config(config)
+
+    try:
+        index_id = request["index_id"]
+        options: dict[str, Any] = {
+            "project_id": project_id,
+            "region": region,
+            "embedding_model": request.get("embedding_model_name") or "gemini-embedding-001",
+            "restrict_columns": request.get("restrict_columns") or [],
+            "numeric_restricts_columns": request.get("numeric_restricts_columns") or [],
+            "output_dimensionality": int(request["dimension"]),
+            "columnar": bool(request.get("columnar")),
+            "timestamp_formats": {},
+        }
+        queue_size = int(request.get("queue_size") or 2)
+        cache = get_embedding_cache(config)
+        scheduler = get_embedding_scheduler(config)
+        embedding = _embedding_options(request)
+        state: dict[str, Any] = {
+            "next_index": 1,
+            "text_column_list": request.get("col_to_embed") or [],
+        }
+        totals = {"row_count": 0, "cache_hits": 0, "cache_misses": 0}
+
+        def _prepare(rows: list[dict[str, Any]]) -> tuple[list[dict[str, Any]], list[str], int]:
+            if not state["text_column_list"]:
+                state["text_column_list"] = _default_text_columns(rows[0])
+            texts = _build_texts(rows, state["text_column_list"], columnar=options["columnar"])
+            start_index = state["next_index"]
+            state["next_index"] += len(rows)
+            if progress is not None:
+                progress.add(rows_read=len(rows))
+            return rows, texts, start_index
+
+        def _embed(
+            chunk: tuple[list[dict[str, Any]], list[str], int],
+        ) -> tuple[list[dict[str, Any]], dict[str, int]]:
+            rows, texts, start_index = chunk
+            vectors, cache_stats = _embed_texts(
+                project_id=project_id,
+                region=region,
+                embedding_model=options["embedding_model"],
+                output_dimensionality=options["output_dimensionality"],
+                texts=texts,
+                cache=cache,
+                scheduler=scheduler,
+                on_embedded=_progress_counter(progress, "rows_embedded"),
+                **embedding,
+            )
+            # Same builders as embed_data, so the datapoints match the two-step path.
+            return _datapoints(rows, vectors, options, start_index=start_index), cache_stats
+
+        # BigQuery reads, text building and embedding run in their own threads;
+        # the upsert stage below consumes their output while they keep going.
+        pages = (
+            page
+            for page in iter_table_pages(
+                request["bigquery_table"],
+                request.get("where") or "TRUE",
+                page_size=int(request.get("page_size") or 1000),
+            )
+            if page
+        )
+        embedded = staged(
+            staged(staged(pages, maxsize=queue_size), _prepare, maxsize=queue_size),
+            _embed,
+            maxsize=queue_size,
+        )
+
+        writer: ShardedGCSWriter | None = None
+        if request.get("gcs_output_prefix"):
+            writer = ShardedGCSWriter(
+                request["gcs_output_prefix"],
+                **_writer_options(
+                    request,
+                    filename=request.get("filename") or "part-00000",
+                    file_type=request.get("file_type") or "json",
+                ),
+            )
+
+        def _items() -> Iterator[dict[str, Any]]:
+            for items, cache_stats in embedded:
+                totals["row_count"] += len(items)
+                totals["cache_hits"] += cache_stats["cache_hits"]
+                totals["cache_misses"] += cache_stats["cache_misses"]
+                if writer is not None:
+                    writer.write(items)
+                yield from items
+
+        upsert = index_batch_options(request)
+        index = get_index(project_id, region, index_id)
+
+        def _upsert(batch: list[gca_index.IndexDatapoint]) -> None:
+            index.upsert_datapoints(datapoints=batch)
+
+        try:
+            summary = run_index_batches(
+                _upsert,
+                iter_datapoint_batches(
+                    iter_index_datapoints(_items()),
+                    max_datapoints=upsert["max_datapoints"],
+                    max_bytes=upsert["max_bytes"],
+                ),
+                options=upsert,
+                ids_of=datapoint_ids,
+                bytes_of=batch_bytes,
+                counter="upserted",
+                progress=progress,
+            )
+            if not totals["row_count"]:
+                raise PipelineException(
+                    "No rows found for the given bigquery_table/where filter. Nothing was upserted.",
+                    status_code=400,
+                )
+            manifest = writer.close() if writer is not None else None
+        except BaseException:
+            if writer is not None:
+                writer.abort()
+            raise
+        finally:
+            # Cached search results and the sync manifest may now be stale.
+            invalidate_search_results(config, index_id)
+            mark_sync_manifest_stale(config, index_id)
+        upserted = summary["upserted"]
+        failed = summary["failed"]
+        if failed and not upserted:
+            raise PipelineException(
+                f"Failed to upsert all {failed} datapoints: {summary['batches'][0]['error']}",
+                status_code=500,
+            )
+
+        result: dict[str, Any] = {
+            "status": "PARTIAL" if failed else "UPSERTED",
+            "index_id": index_id,
+            "dimension": options["output_dimensionality"],
+            **totals,
+            "upserted": upserted,
+            "failed": failed,
+            "failed_ids": summary["failed_ids"],
+            "failed_ids_truncated": summary["failed_ids_truncated"],
+            "batches": summary["batches"],
+        }
+        if manifest is not None:
+            result["gcs_output_prefix"] = request["gcs_output_prefix"]
+            result["gcs_output_files"] = manifest["files"]
+        return result
+    except PipelineException:
+        raise
+    except ValueError as exc:
+        raise PipelineException(str(exc), status_code=400) from exc
+    except Exception as exc:
+        raise PipelineException(f"Failed to embed and upsert data: {exc}", status_code=500) from exc
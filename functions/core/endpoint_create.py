@@ -2,6 +2,7 @@ from google.cloud import aiplatform
 
 from api.exceptions import PipelineException
 from api.schemas.endpoint import EndpointCreateRequest
+from functions.utils.clients import init_vertex
 from functions.utils.validators import apply_defaults
 
 
@@ -18,7 +19,7 @@ def endpoint_create(payload: EndpointCreateRequest, config: dict) -> dict:
         )
 
     try:
-        aiplatform.init(project=project_id, location=region)
+        init_vertex(project_id, region)
         endpoint = aiplatform.MatchingEngineIndexEndpoint.create(
             display_name=request["display_name"],
             description=request.get("description"),
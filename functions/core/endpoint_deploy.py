@@ -1,7 +1,6 @@
-from google.cloud import aiplatform
-
 from api.exceptions import PipelineException
 from api.schemas.endpoint import EndpointDeployRequest
+from functions.utils.clients import evict_client, get_index, get_index_endpoint
 from functions.utils.validators import apply_defaults
 
 
@@ -22,10 +21,8 @@ def endpoint_deploy(payload: EndpointDeployRequest, config: dict) -> dict:
         index_id = request["index_id"]
         deployed_index_id = request["deployed_index_id"]
 
-        aiplatform.init(project=project_id, location=region)
-
-        endpoint = aiplatform.MatchingEngineIndexEndpoint(index_endpoint_name=endpoint_id)
-        index = aiplatform.MatchingEngineIndex(index_name=index_id)
+        endpoint = get_index_endpoint(project_id, region, endpoint_id)
+        index = get_index(project_id, region, index_id)
 
         endpoint.deploy_index(
             index=index,
@@ -34,6 +31,8 @@ def endpoint_deploy(payload: EndpointDeployRequest, config: dict) -> dict:
             min_replica_count=request.get("min_replica_count", 1),
             max_replica_count=request.get("max_replica_count", 1),
         )
+        # Cached endpoints hold their deployed indexes; reload on next use.
+        evict_client("index_endpoint", project_id, region, endpoint_id)
 
         return {
             "deployed_index_id": deployed_index_id,
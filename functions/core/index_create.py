@@ -5,6 +5,7 @@ from google.cloud.aiplatform.matching_engine import matching_engine_index_config
 
 from api.exceptions import PipelineException
 from api.schemas.index import IndexCreateRequest
+from functions.utils.clients import init_vertex
 from functions.utils.validators import apply_defaults
 
 
@@ -26,7 +27,7 @@ def _feature_norm_type(value: str | None) -> matching_engine_index_config.Featur
 
 
 def _create_tree_ah_index(payload: dict[str, Any], project_id: str, region: str) -> dict[str, Any]:
-    aiplatform.init(project=project_id, location=region)
+    init_vertex(project_id, region)
 
     index = aiplatform.MatchingEngineIndex.create_tree_ah_index(
         display_name=payload["display_name"],
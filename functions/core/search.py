@@ -1,13 +1,22 @@
+import asyncio
+from collections import Counter
+from collections.abc import Hashable
 from datetime import datetime, timezone
+from functools import lru_cache
 from typing import Any
 
-from google.cloud import aiplatform
 from google.cloud.aiplatform.matching_engine.matching_engine_index_endpoint import Namespace
-import vertexai
-from vertexai.language_models import TextEmbeddingInput, TextEmbeddingModel
 
 from api.exceptions import PipelineException
-from api.schemas.search import SearchRequest
+from api.schemas.search import SearchBatchRequest, SearchQuery, SearchRequest
+from functions.core.embed_data import _embed_texts
+from functions.utils.batching import run_batches
+from functions.utils.clients import get_index_endpoint
+from functions.utils.embedding_scheduler import get_embedding_scheduler
+from functions.utils.local_index import get_local_index
+from functions.utils.micro_batch import MicroBatcher
+from functions.utils.query_embedding_cache import QUERY_TASK_TYPE, get_query_embedding_cache
+from functions.utils.search_cache import get_search_result_cache
 from functions.utils.validators import apply_defaults
 
 
@@ -82,6 +91,35 @@ def _extract_neighbor(neighbor: Any) -> dict[str, Any]:
     }
 
 
+def _search_target(
+    config: dict, project_id: str, region: str, endpoint_id: str, deployed_index_id: str
+) -> tuple[Any, str]:
+    # Deployed indexes listed under `local_search.indexes` are served in-process
+    # from their datapoint files; both targets have the same find_neighbors call.
+    local = get_local_index(config, deployed_index_id)
+    if local is not None:
+        return local, "local"
+    return get_index_endpoint(project_id, region, endpoint_id), "endpoint"
+
+
+def _text_embedding_settings(
+    request: dict[str, Any], defaults: dict[str, Any], config: dict
+) -> tuple[str, int]:
+    embedding_model = (
+        request.get("embedding_model_name")
+        or defaults.get("embedding_model_name")
+        or config.get("embed_data", {}).get("embedding_model_name")
+        or "text-embedding-005"
+    )
+    output_dimensionality = int(
+        request.get("dimension")
+        or defaults.get("dimension")
+        or config.get("embed_data", {}).get("dimension")
+        or 768
+    )
+    return embedding_model, output_dimensionality
+
+
 def search(payload: SearchRequest, config: dict) -> dict:
     defaults = config.get("search", {})
     request = apply_defaults(payload, defaults)
@@ -106,25 +144,29 @@ def search(payload: SearchRequest, config: dict) -> dict:
         if query_type == "text":
             if not isinstance(query, str):
                 raise ValueError("query must be a string when query_type is 'text'")
-            embedding_model = (
-                request.get("embedding_model_name")
-                or defaults.get("embedding_model_name")
-                or config.get("embed_data", {}).get("embedding_model_name")
-                or "text-embedding-005"
-            )
-            output_dimensionality = int(
-                request.get("dimension")
-                or defaults.get("dimension")
-                or config.get("embed_data", {}).get("dimension")
-                or 768
+            embedding_model, output_dimensionality = _text_embedding_settings(
+                request, defaults, config
             )
-            vertexai.init(project=project_id, location=region)
-            model = TextEmbeddingModel.from_pretrained(embedding_model)
-            embedding = model.get_embeddings(
-                [TextEmbeddingInput(text=query, task_type="RETRIEVAL_QUERY")],
+            # Same path as search_batch: query cache, interactive scheduler lane and retries.
+            # The normalized query is only the cache key; the model sees the query as sent.
+            query_cache = get_query_embedding_cache(config)
+            embedded, _ = _embed_texts(
+                project_id=project_id,
+                region=region,
+                embedding_model=embedding_model,
                 output_dimensionality=output_dimensionality,
-            )[0]
-            embedding_values = [float(v) for v in embedding.values]
+                texts=[query],
+                task_type=QUERY_TASK_TYPE,
+                max_retries=int(defaults.get("max_retries") or 0),
+                cache=query_cache,
+                scheduler=get_embedding_scheduler(config),
+                priority="interactive",
+                normalize=False,
+                cache_keys=[query_cache.key(embedding_model, output_dimensionality, query)]
+                if query_cache is not None
+                else None,
+            )
+            embedding_values = embedded[0].tolist()
         elif query_type == "vector":
             if not isinstance(query, list) or not all(isinstance(v, (float, int)) for v in query):
                 raise ValueError("query must be a list of numbers when query_type is 'vector'")
@@ -132,28 +174,330 @@ def search(payload: SearchRequest, config: dict) -> dict:
         else:
             raise ValueError("query_type must be 'text' or 'vector'")
 
-        aiplatform.init(project=project_id, location=region)
-        endpoint = aiplatform.MatchingEngineIndexEndpoint(index_endpoint_name=endpoint_id)
-        filters = _build_namespace_filters(restricts)
-        neighbors = endpoint.find_neighbors(
-            deployed_index_id=deployed_index_id,
-            queries=[embedding_values],
-            num_neighbors=top_k,
-            return_full_datapoint=True,
-            filter=filters or None,
+        endpoint, backend = _search_target(
+            config, project_id, region, endpoint_id, deployed_index_id
         )
+        result_cache = get_search_result_cache(config)
+        cache_key = None
+        results = None
+        if result_cache is not None:
+            cache_key = result_cache.key(
+                endpoint,
+                endpoint_id=endpoint_id,
+                deployed_index_id=deployed_index_id,
+                vector=embedding_values,
+                filters=_filter_key(restricts or []),
+                top_k=top_k,
+            )
+            results = result_cache.get(cache_key)
+        cached = results is not None
+        if results is None:
+            filters = _build_namespace_filters(restricts)
+            neighbors = endpoint.find_neighbors(
+                deployed_index_id=deployed_index_id,
+                queries=[embedding_values],
+                num_neighbors=top_k,
+                return_full_datapoint=True,
+                filter=filters or None,
+            )
 
-        results = []
-        if neighbors:
-            results = [_extract_neighbor(n) for n in neighbors[0]]
+            results = []
+            if neighbors:
+                results = [_extract_neighbor(n) for n in neighbors[0]]
+            if cache_key is not None:
+                result_cache.put(cache_key, results)
 
         return {
             "query": query,
             "query_type": query_type,
             "num_recommendations": len(results),
             "results": results,
+            "cached": cached,
+            "backend": backend,
+        }
+    except PipelineException:
+        raise
+    except Exception as exc:
+        raise PipelineException(f"Failed to search index: {exc}", status_code=500) from exc
+
+
+def _filter_key(restricts: list[dict[str, Any]]) -> tuple[Any, ...]:
+    # Queries with the same namespaces and token sets can share one filter.
+    return tuple(
+        sorted(
+            (
+                item.get("namespace") or item.get("name") or "",
+                tuple(sorted(item.get("allow") or item.get("allow_list") or [])),
+                tuple(sorted(item.get("deny") or item.get("deny_list") or [])),
+            )
+            for item in restricts
+        )
+    )
+
+
+def search_batch(payload: SearchBatchRequest, config: dict) -> dict:
+    defaults = {**config.get("search", {}), **config.get("search_batch", {})}
+    request = apply_defaults(payload, {"top_k": defaults.get("top_k")})
+
+    project_id = config.get("project_id")
+    region = config.get("region")
+    if not project_id or not region:
+        raise PipelineException(
+            "Missing `project_id` or `region` in functions/parameters/config.yaml",
+            status_code=500,
+        )
+
+    try:
+        endpoint_id = request["endpoint_id"]
+        deployed_index_id = request["deployed_index_id"]
+        default_top_k = int(request.get("top_k") or 10)
+
+        queries: list[dict[str, Any]] = []
+        for query in request["queries"]:
+            value = query["query"]
+            query_type = (
+                query.get("query_type") or ("text" if isinstance(value, str) else "vector")
+            ).lower()
+            if query_type == "vector" and not all(isinstance(v, (float, int)) for v in value):
+                raise ValueError("query must be a list of numbers when query_type is 'vector'")
+            queries.append(
+                {
+                    "query": value,
+                    "query_type": query_type,
+                    "top_k": int(query.get("top_k") or default_top_k),
+                    "restricts": query.get("restricts") or [],
+                }
+            )
+
+        vectors: list[list[float]] = [[] for _ in queries]
+        text_positions = [pos for pos, query in enumerate(queries) if query["query_type"] == "text"]
+        for pos, query in enumerate(queries):
+            if query["query_type"] == "vector":
+                vectors[pos] = [float(v) for v in query["query"]]
+        if text_positions:
+            # All text queries are embedded together; queries with the same cache key
+            # are sent once and queries already in the query cache are not sent at all.
+            # The normalized form is only the key: the model sees the queries as sent.
+            query_cache = get_query_embedding_cache(config)
+            texts = list(dict.fromkeys(queries[pos]["query"] for pos in text_positions))
+            embedding_model, output_dimensionality = _text_embedding_settings(
+                request, defaults, config
+            )
+            embedded, _ = _embed_texts(
+                project_id=project_id,
+                region=region,
+                embedding_model=embedding_model,
+                output_dimensionality=output_dimensionality,
+                texts=texts,
+                task_type=QUERY_TASK_TYPE,
+                batch_size=int(defaults.get("embedding_batch_size") or 250),
+                concurrency=int(defaults.get("embedding_concurrency") or 1),
+                max_retries=int(defaults.get("max_retries") or 0),
+                cache=query_cache,
+                scheduler=get_embedding_scheduler(config),
+                priority="interactive",
+                normalize=False,
+                cache_keys=[
+                    query_cache.key(embedding_model, output_dimensionality, text)
+                    for text in texts
+                ]
+                if query_cache is not None
+                else None,
+            )
+            rows = {text: row for text, row in zip(texts, embedded.tolist())}
+            for pos in text_positions:
+                vectors[pos] = rows[queries[pos]["query"]]
+
+        endpoint, backend = _search_target(
+            config, project_id, region, endpoint_id, deployed_index_id
+        )
+        result_cache = get_search_result_cache(config)
+        matches: list[list[dict[str, Any]] | None] = [None for _ in queries]
+        cache_keys: list[str | None] = [None for _ in queries]
+        if result_cache is not None:
+            for pos, query in enumerate(queries):
+                cache_keys[pos] = result_cache.key(
+                    endpoint,
+                    endpoint_id=endpoint_id,
+                    deployed_index_id=deployed_index_id,
+                    vector=vectors[pos],
+                    filters=_filter_key(query["restricts"]),
+                    top_k=query["top_k"],
+                )
+                matches[pos] = result_cache.get(cache_keys[pos])
+        hits = [found is not None for found in matches]
+
+        # One find_neighbors call serves every uncached query with the same filter,
+        # asking for the largest top_k in the call and trimming each result afterwards.
+        groups: dict[tuple[Any, ...], list[int]] = {}
+        for pos, query in enumerate(queries):
+            if matches[pos] is None:
+                groups.setdefault(_filter_key(query["restricts"]), []).append(pos)
+        max_queries = max(1, int(defaults.get("max_queries_per_call") or 64))
+        calls = [
+            positions[start : start + max_queries]
+            for positions in groups.values()
+            for start in range(0, len(positions), max_queries)
+        ]
+
+        def _find(positions: list[int]) -> list[Any]:
+            filters = _build_namespace_filters(queries[positions[0]]["restricts"])
+            return endpoint.find_neighbors(
+                deployed_index_id=deployed_index_id,
+                queries=[vectors[pos] for pos in positions],
+                num_neighbors=max(queries[pos]["top_k"] for pos in positions),
+                return_full_datapoint=True,
+                filter=filters or None,
+            )
+
+        responses = run_batches(
+            _find,
+            calls,
+            concurrency=int(defaults.get("concurrency") or 1),
+            max_retries=int(defaults.get("max_retries") or 0),
+        )
+        for positions, neighbors in zip(calls, responses):
+            neighbors = list(neighbors or [])
+            for offset, pos in enumerate(positions):
+                found = neighbors[offset] if offset < len(neighbors) else []
+                matches[pos] = [
+                    _extract_neighbor(n) for n in list(found)[: queries[pos]["top_k"]]
+                ]
+                if cache_keys[pos] is not None:
+                    result_cache.put(cache_keys[pos], matches[pos])
+
+        results: list[dict[str, Any]] = []
+        for query, found, hit in zip(queries, matches, hits):
+            result: dict[str, Any] = {
+                "query_type": query["query_type"],
+                "top_k": query["top_k"],
+                "num_recommendations": len(found or []),
+                "results": found or [],
+                "cached": hit,
+            }
+            if query["query_type"] == "text":
+                result["query"] = query["query"]
+            results.append(result)
+
+        return {
+            "num_queries": len(queries),
+            "find_neighbors_calls": len(calls),
+            "cached": sum(hits),
+            "backend": backend,
+            "results": results,
         }
     except PipelineException:
         raise
+    except ValueError as exc:
+        raise PipelineException(str(exc), status_code=400) from exc
     except Exception as exc:
         raise PipelineException(f"Failed to search index: {exc}", status_code=500) from exc
+
+
+def _search_or_error(payload: SearchRequest, config: dict) -> dict | Exception:
+    try:
+        return search(payload, config)
+    except Exception as exc:
+        return exc
+
+
+def _search_coalesced_batch(
+    key: Hashable, items: list[tuple[SearchRequest, dict]]
+) -> list[dict | Exception]:
+    if len(items) == 1:
+        return [_search_or_error(*items[0])]
+    endpoint_id, deployed_index_id = key
+    config = items[0][1]
+    defaults = config.get("search", {})
+    results: list[dict | Exception | None] = [None for _ in items]
+    queries: list[SearchQuery] = []
+    positions: list[int] = []
+    for pos, (payload, item_config) in enumerate(items):
+        # Same defaults as a single search, so coalescing does not change results.
+        request = apply_defaults(payload, defaults)
+        try:
+            query = SearchQuery(
+                query=request["query"],
+                query_type=(request.get("query_type") or "vector").lower(),
+                top_k=int(request.get("top_k", 10)),
+                restricts=request.get("restricts") or None,
+            )
+        except Exception:
+            # An invalid request fails on its own, with the error a single search gives.
+            results[pos] = _search_or_error(payload, item_config)
+            continue
+        queries.append(query)
+        positions.append(pos)
+    # A vector of another dimension fails the whole find_neighbors call, so the
+    # queries whose dimension differs from the rest are searched on their own.
+    _, text_dimension = _text_embedding_settings({}, defaults, config)
+    dimensions = [
+        text_dimension if query.query_type == "text" else len(query.query) for query in queries
+    ]
+    if dimensions:
+        expected = Counter(dimensions).most_common(1)[0][0]
+        for pos, dimension in zip(list(positions), dimensions):
+            if dimension != expected:
+                results[pos] = _search_or_error(*items[pos])
+        queries = [query for query, dimension in zip(queries, dimensions) if dimension == expected]
+        positions = [pos for pos, dimension in zip(positions, dimensions) if dimension == expected]
+    if not queries:
+        return results
+    try:
+        batch = search_batch(
+            SearchBatchRequest(
+                endpoint_id=endpoint_id, deployed_index_id=deployed_index_id, queries=queries
+            ),
+            config,
+        )
+    except Exception as exc:
+        # The queries are valid, so this is the backend failing; retrying each one
+        # on its own would only multiply the load on it.
+        for pos in positions:
+            results[pos] = exc
+        return results
+    for pos, result in zip(positions, batch["results"]):
+        results[pos] = {
+            "query": items[pos][0].query,
+            "query_type": result["query_type"],
+            "num_recommendations": result["num_recommendations"],
+            "results": result["results"],
+            "cached": result["cached"],
+            "backend": batch["backend"],
+        }
+    return results
+
+
+@lru_cache(maxsize=None)
+def _dispatcher_instance(
+    max_queries: int, max_wait_ms: float, concurrency: int
+) -> MicroBatcher[tuple[SearchRequest, dict], dict]:
+    return MicroBatcher(
+        _search_coalesced_batch,
+        max_batch=max_queries,
+        max_wait_seconds=max_wait_ms / 1000.0,
+        concurrency=concurrency,
+    )
+
+
+def get_search_dispatcher(config: dict) -> MicroBatcher[tuple[SearchRequest, dict], dict] | None:
+    settings = config.get("search_dispatcher") or {}
+    if not settings.get("enabled", True):
+        return None
+    return _dispatcher_instance(
+        int(settings.get("max_queries") or 64),
+        float(settings.get("max_wait_ms") or 2),
+        int(settings.get("concurrency") or 16),
+    )
+
+
+async def search_coalesced(payload: SearchRequest, config: dict) -> dict:
+    # Concurrent searches against the same deployed index are collected for a few
+    # milliseconds and served by one search_batch call: one embedding request for
+    # their texts and one find_neighbors call per filter group.
+    dispatcher = get_search_dispatcher(config)
+    if dispatcher is None:
+        return await asyncio.to_thread(search, payload, config)
+    return await dispatcher.submit(
+        (payload.endpoint_id, payload.deployed_index_id), (payload, config)
+    )
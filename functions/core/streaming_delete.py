@@ -1,12 +1,62 @@
-from google.cloud import aiplatform
+from collections.abc import Iterable, Iterator
+from typing import Any
 
 from api.exceptions import PipelineException
 from api.schemas.streaming import StreamingDeleteRequest
+from functions.utils.bigquery import iter_table_pages
+from functions.utils.blob_cache import get_blob_cache
+from functions.utils.clients import get_index
+from functions.utils.datapoints import (
+    mark_sync_manifest_stale,
+    index_batch_options,
+    iter_id_batches,
+    run_index_batches,
+)
+from functions.utils.gcs import iter_data_from_gcs_prefix
+from functions.utils.jobs import JobProgress
+from functions.utils.search_cache import invalidate_search_results
 from functions.utils.validators import apply_defaults
 
 
-def streaming_delete(payload: StreamingDeleteRequest, config: dict) -> dict:
-    request = apply_defaults(payload, {})
+def _ids_from_records(records: Iterable[Any], field: str) -> Iterator[str]:
+    # Id files hold plain ids (txt lines, JSON strings or numbers) or records
+    # with the id under `field`, like the datapoint files.
+    for record in records:
+        if isinstance(record, dict):
+            value = record.get(field)
+            if value is None:
+                raise ValueError(f"Id record without `{field}` field: {record}")
+        else:
+            value = record
+        text = str(value).strip()
+        if text:
+            yield text
+
+
+def _ids_from_table(
+    table: str, where: str, id_column: str, page_size: int
+) -> Iterator[str]:
+    for page in iter_table_pages(table, where, [id_column], page_size=page_size):
+        for row in page:
+            if row.get(id_column) is not None:
+                yield str(row[id_column])
+
+
+def _unique(ids: Iterable[str], counts: dict[str, int]) -> Iterator[str]:
+    seen: set[str] = set()
+    for datapoint_id in ids:
+        counts["read"] += 1
+        if datapoint_id in seen:
+            continue
+        seen.add(datapoint_id)
+        yield datapoint_id
+
+
+def streaming_delete(
+    payload: StreamingDeleteRequest, config: dict, *, progress: JobProgress | None = None
+) -> dict:
+    defaults = config.get("streaming_delete", {})
+    request = apply_defaults(payload, defaults)
 
     project_id = config.get("project_id")
     region = config.get("region")
@@ -18,19 +68,75 @@ def streaming_delete(payload: StreamingDeleteRequest, config: dict) -> dict:
 
     try:
         index_id = request["index_id"]
-        ids = [str(item) for item in request.get("datapoint_ids", [])]
-        if not ids:
-            raise ValueError("datapoint_ids must not be empty")
+        if request.get("datapoint_ids") is not None:
+            source = "inline"
+            ids: Iterable[str] = [str(item) for item in request["datapoint_ids"]]
+            if not ids:
+                raise ValueError("datapoint_ids must not be empty")
+        elif request.get("ids_gcs_prefix"):
+            source = "gcs"
+            records = iter_data_from_gcs_prefix(
+                request["ids_gcs_prefix"],
+                field_name="ids_gcs_prefix",
+                file_type=request.get("ids_file_type") or "json",
+                cache=get_blob_cache(config),
+            )
+            ids = _ids_from_records(records, request.get("ids_field") or "id")
+        elif request.get("bigquery_table"):
+            source = "bigquery"
+            ids = _ids_from_table(
+                request["bigquery_table"],
+                request.get("where") or "TRUE",
+                request.get("id_column") or "id",
+                int(request.get("page_size") or 10000),
+            )
+        else:
+            raise ValueError("Provide one of datapoint_ids, ids_gcs_prefix or bigquery_table")
+
+        options = index_batch_options(request)
+        counts = {"read": 0}
+        index = get_index(project_id, region, index_id)
+
+        def _remove(batch: list[str]) -> None:
+            index.remove_datapoints(datapoint_ids=batch)
 
-        aiplatform.init(project=project_id, location=region)
-        index = aiplatform.MatchingEngineIndex(index_name=index_id)
-        index.remove_datapoints(datapoint_ids=ids)
+        # Ids are read, batched and removed as they stream in; failed batches are
+        # retried on their own and reported rather than failing the whole purge.
+        try:
+            summary = run_index_batches(
+                _remove,
+                iter_id_batches(_unique(ids, counts), batch_size=options["max_datapoints"]),
+                options=options,
+                ids_of=list,
+                counter="deleted",
+                progress=progress,
+            )
+        finally:
+            # Cached search results and the sync manifest may now be stale.
+            invalidate_search_results(config, index_id)
+            mark_sync_manifest_stale(config, index_id)
+        deleted = summary["deleted"]
+        failed = summary["failed"]
+        if failed and not deleted:
+            raise PipelineException(
+                f"Failed to delete all {failed} datapoints: {summary['batches'][0]['error']}",
+                status_code=500,
+            )
 
         return {
             "index_id": index_id,
-            "deleted": len(ids),
+            "status": "PARTIAL" if failed else "DELETED",
+            "source": source,
+            "ids_read": counts["read"],
+            "deleted": deleted,
+            "failed": failed,
+            "failed_ids": summary["failed_ids"],
+            "failed_ids_truncated": summary["failed_ids_truncated"],
+            "batches": summary["batches"],
         }
     except PipelineException:
         raise
+    except ValueError as exc:
+        raise PipelineException(str(exc), status_code=400) from exc
     except Exception as exc:
         raise PipelineException(f"Failed to stream delete datapoints: {exc}", status_code=500) from exc
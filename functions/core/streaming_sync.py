@@ -0,0 +1,235 @@
+from collections.abc import Iterable, Iterator
+from datetime import datetime, timezone
+from typing import Any
+
+from google.cloud.aiplatform_v1.types import index as gca_index
+
+from api.exceptions import PipelineException
+from api.schemas.streaming import StreamingSyncRequest
+from functions.utils.batching import BatchResult
+from functions.utils.blob_cache import get_blob_cache
+from functions.utils.clients import get_index
+from functions.utils.datapoints import (
+    batch_bytes,
+    datapoint_fingerprint,
+    datapoint_ids,
+    index_batch_options,
+    iter_datapoint_batches,
+    iter_id_batches,
+    iter_index_datapoints,
+    run_index_batches,
+    sync_manifest_key,
+)
+from functions.utils.gcs import iter_data_from_gcs_prefix
+from functions.utils.jobs import JobProgress
+from functions.utils.search_cache import invalidate_search_results
+from functions.utils.state_store import get_state_store
+from functions.utils.validators import apply_defaults
+
+
+def _iter_changed(
+    datapoints: Iterable[gca_index.IndexDatapoint],
+    previous: dict[str, str],
+    seen: dict[str, str],
+    counts: dict[str, int],
+) -> Iterator[gca_index.IndexDatapoint]:
+    # Records every fingerprint in `seen` and passes on only the datapoints the
+    # index does not already hold in this exact form.
+    for datapoint in datapoints:
+        fingerprint = datapoint_fingerprint(datapoint)
+        seen[datapoint.datapoint_id] = fingerprint
+        counts["read"] += 1
+        if previous.get(datapoint.datapoint_id) == fingerprint:
+            counts["unchanged"] += 1
+            continue
+        yield datapoint
+
+
+def streaming_sync(
+    payload: StreamingSyncRequest, config: dict, *, progress: JobProgress | None = None
+) -> dict:
+    defaults = config.get("streaming_sync", {})
+    request = apply_defaults(payload, defaults)
+
+    project_id = config.get("project_id")
+    region = config.get("region")
+    if not project_id or not region:
+        raise PipelineException(
+            "Missing `project_id` or `region` in functions/parameters/config.yaml",
+            status_code=500,
+        )
+
+    try:
+        index_id = request["index_id"]
+        datapoints_source = request.get("datapoints_source", "gcs")
+        if datapoints_source != "gcs":
+            raise ValueError("Only datapoints_source='gcs' is supported")
+        datapoints_gcs_prefix = request.get("datapoints_gcs_prefix")
+        if not datapoints_gcs_prefix:
+            raise ValueError("datapoints_gcs_prefix is required")
+        datapoints_file_type = request.get("datapoints_file_type") or "json"
+        delete_missing = bool(request.get("delete_missing", True))
+        max_delete_fraction = float(request.get("max_delete_fraction", 0.2))
+        force_delete = bool(request.get("force_delete"))
+        full_resync = bool(request.get("full_resync"))
+
+        store = get_state_store(config)
+        manifest_key = sync_manifest_key(project_id, region, index_id)
+        manifest = store.get(manifest_key) or {}
+        previous: dict[str, str] = manifest.get("datapoints") or {}
+        # Other writers to the index leave a marker; their changes are not in the
+        # fingerprints, so this run compares nothing and upserts everything.
+        stale = store.get(f"{manifest_key}-stale")
+        full_resync = full_resync or stale is not None
+
+        items = iter_data_from_gcs_prefix(
+            datapoints_gcs_prefix,
+            field_name="datapoints_gcs_prefix",
+            file_type=datapoints_file_type,
+            cache=get_blob_cache(config),
+        )
+        options = index_batch_options(request)
+        seen: dict[str, str] = {}
+        counts = {"read": 0, "unchanged": 0}
+        # A full resync upserts everything; the old manifest still decides deletes.
+        batches = iter_datapoint_batches(
+            _iter_changed(
+                iter_index_datapoints(items), {} if full_resync else previous, seen, counts
+            ),
+            max_datapoints=options["max_datapoints"],
+            max_bytes=options["max_bytes"],
+        )
+
+        index = get_index(project_id, region, index_id)
+        failed_upserts: list[str] = []
+        failed_deletes: list[str] = []
+
+        def _upsert(batch: list[gca_index.IndexDatapoint]) -> None:
+            index.upsert_datapoints(datapoints=batch)
+
+        def _remove(batch: list[str]) -> None:
+            index.remove_datapoints(datapoint_ids=batch)
+
+        def _on_upsert(outcome: BatchResult) -> None:
+            if outcome.error is not None:
+                failed_upserts.extend(datapoint_ids(outcome.batch))
+
+        def _on_remove(outcome: BatchResult) -> None:
+            if outcome.error is not None:
+                failed_deletes.extend(outcome.batch)
+
+        try:
+            upserts = run_index_batches(
+                _upsert,
+                batches,
+                options=options,
+                ids_of=datapoint_ids,
+                bytes_of=batch_bytes,
+                counter="upserted",
+                failed_counter="upsert_failed",
+                progress=progress,
+                on_outcome=_on_upsert,
+            )
+
+            # Removed ids are only known once the whole prefix was read.
+            if previous and not counts["read"]:
+                # An empty, mistyped or wrong-file_type prefix reads nothing; deleting
+                # "everything missing" would wipe the index.
+                raise PipelineException(
+                    f"No datapoints read from {datapoints_gcs_prefix} "
+                    f"({datapoints_file_type}); refusing to delete {len(previous)} "
+                    "previously synced datapoints",
+                    status_code=400,
+                )
+            removed = [datapoint_id for datapoint_id in previous if datapoint_id not in seen]
+            delete_blocked = (
+                delete_missing
+                and not force_delete
+                and len(removed) > max_delete_fraction * len(previous)
+            )
+            if delete_missing and removed and not delete_blocked:
+                deletes = run_index_batches(
+                    _remove,
+                    iter_id_batches(removed, batch_size=options["max_datapoints"]),
+                    options=options,
+                    ids_of=list,
+                    counter="deleted",
+                    failed_counter="delete_failed",
+                    progress=progress,
+                    on_outcome=_on_remove,
+                )
+            else:
+                deletes = {
+                    "deleted": 0,
+                    "delete_failed": 0,
+                    "failed_ids": [],
+                    "failed_ids_truncated": False,
+                    "batches": [],
+                }
+        finally:
+            # Cached search results for this index may now be stale.
+            invalidate_search_results(config, index_id)
+
+        succeeded = upserts["upserted"] + deletes["deleted"]
+        failed = upserts["upsert_failed"] + deletes["delete_failed"]
+        if failed and not succeeded:
+            raise PipelineException(
+                f"Failed to sync datapoints: all {failed} index writes failed",
+                status_code=500,
+            )
+
+        # The new manifest describes what the index holds after this run: a failed
+        # upsert keeps the old fingerprint (or none) and a failed delete keeps its
+        # entry, so the next sync retries both.
+        datapoints = seen
+        for datapoint_id in failed_upserts:
+            if datapoint_id in previous:
+                datapoints[datapoint_id] = previous[datapoint_id]
+            else:
+                datapoints.pop(datapoint_id, None)
+        kept = removed if not delete_missing or delete_blocked else failed_deletes
+        for datapoint_id in kept:
+            datapoints[datapoint_id] = previous[datapoint_id]
+        store.put(
+            manifest_key,
+            {
+                "index_id": index_id,
+                "datapoints_gcs_prefix": datapoints_gcs_prefix,
+                "synced_at": datetime.now(timezone.utc).isoformat(),
+                "datapoints": datapoints,
+            },
+        )
+        # A write that landed during this run leaves a newer marker for the next one.
+        if stale is not None and store.get(f"{manifest_key}-stale") == stale:
+            store.delete(f"{manifest_key}-stale")
+
+        return {
+            "index_id": index_id,
+            "status": "PARTIAL" if failed or delete_blocked else "SYNCED",
+            "read": counts["read"],
+            "unchanged": counts["unchanged"],
+            "upserted": upserts["upserted"],
+            "upsert_failed": upserts["upsert_failed"],
+            "deleted": deletes["deleted"],
+            "delete_failed": deletes["delete_failed"],
+            "missing_not_deleted": len(removed) if not delete_missing or delete_blocked else 0,
+            "delete_blocked": delete_blocked,
+            "full_resync": full_resync,
+            "failed_upsert_ids": upserts["failed_ids"],
+            "failed_delete_ids": deletes["failed_ids"],
+            "failed_ids_truncated": (
+                upserts["failed_ids_truncated"] or deletes["failed_ids_truncated"]
+            ),
+            "upsert_batches": upserts["batches"],
+            "delete_batches": deletes["batches"],
+            "manifest_size": len(datapoints),
+            "datapoints_source": datapoints_source,
+            "datapoints_gcs_prefix": datapoints_gcs_prefix,
+            "datapoints_file_type": datapoints_file_type,
+        }
+    except PipelineException:
+        raise
+    except ValueError as exc:
+        raise PipelineException(str(exc), status_code=400) from exc
+    except Exception as exc:
+        raise PipelineException(f"Failed to sync datapoints: {exc}", status_code=500) from exc
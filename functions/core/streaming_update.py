@@ -1,41 +1,27 @@
-from typing import Any
-
-from google.cloud import aiplatform
 from google.cloud.aiplatform_v1.types import index as gca_index
 
 from api.exceptions import PipelineException
 from api.schemas.streaming import StreamingUpdateRequest
-from functions.utils.gcs import load_data_from_gcs_prefix
+from functions.utils.blob_cache import get_blob_cache
+from functions.utils.clients import get_index
+from functions.utils.datapoints import (
+    batch_bytes,
+    datapoint_ids,
+    mark_sync_manifest_stale,
+    index_batch_options,
+    iter_datapoint_batches,
+    iter_index_datapoints,
+    run_index_batches,
+)
+from functions.utils.gcs import iter_data_from_gcs_prefix
+from functions.utils.jobs import JobProgress
+from functions.utils.search_cache import invalidate_search_results
 from functions.utils.validators import apply_defaults
 
-def _build_index_datapoints(items: list[dict[str, Any]]) -> list[gca_index.IndexDatapoint]:
-    datapoints: list[gca_index.IndexDatapoint] = []
-    for item in items:
-        restricts = [
-            gca_index.IndexDatapoint.Restriction(
-                namespace=restrict.get("namespace", ""),
-                allow_list=restrict.get("allow") or restrict.get("allow_list") or [],
-                deny_list=restrict.get("deny") or restrict.get("deny_list") or [],
-            )
-            for restrict in item.get("restricts", []) or []
-        ]
-        numeric_restricts = [
-            gca_index.IndexDatapoint.NumericRestriction(**restrict)
-            for restrict in item.get("numeric_restricts", []) or []
-        ]
-
-        datapoints.append(
-            gca_index.IndexDatapoint(
-                datapoint_id=str(item.get("id")),
-                feature_vector=item.get("embedding", []),
-                restricts=restricts,
-                numeric_restricts=numeric_restricts,
-            )
-        )
-    return datapoints
-
 
-def streaming_update(payload: StreamingUpdateRequest, config: dict) -> dict:
+def streaming_update(
+    payload: StreamingUpdateRequest, config: dict, *, progress: JobProgress | None = None
+) -> dict:
     defaults = config.get("streaming_update", {})
     request = apply_defaults(payload, defaults)
 
@@ -56,22 +42,60 @@ def streaming_update(payload: StreamingUpdateRequest, config: dict) -> dict:
         if not datapoints_gcs_prefix:
             raise ValueError("datapoints_gcs_prefix is required")
 
-        items = load_data_from_gcs_prefix(
+        datapoints_file_type = request.get("datapoints_file_type") or "json"
+        # Datapoints are built while later files are still downloading.
+        items = iter_data_from_gcs_prefix(
             datapoints_gcs_prefix,
             field_name="datapoints_gcs_prefix",
-            file_type="json",
+            file_type=datapoints_file_type,
+            cache=get_blob_cache(config),
         )
-        datapoints = _build_index_datapoints(items)
+        options = index_batch_options(request)
+        batches = iter_datapoint_batches(
+            iter_index_datapoints(items),
+            max_datapoints=options["max_datapoints"],
+            max_bytes=options["max_bytes"],
+        )
+
+        index = get_index(project_id, region, index_id)
+
+        def _upsert(batch: list[gca_index.IndexDatapoint]) -> None:
+            index.upsert_datapoints(datapoints=batch)
 
-        aiplatform.init(project=project_id, location=region)
-        index = aiplatform.MatchingEngineIndex(index_name=index_id)
-        index.upsert_datapoints(datapoints=datapoints)
+        # Only the batches that fail are retried; the rest of the push carries on.
+        try:
+            summary = run_index_batches(
+                _upsert,
+                batches,
+                options=options,
+                ids_of=datapoint_ids,
+                bytes_of=batch_bytes,
+                counter="upserted",
+                progress=progress,
+            )
+        finally:
+            # Cached search results and the sync manifest may now be stale.
+            invalidate_search_results(config, index_id)
+            mark_sync_manifest_stale(config, index_id)
+        upserted = summary["upserted"]
+        failed = summary["failed"]
+        if failed and not upserted:
+            raise PipelineException(
+                f"Failed to upsert all {failed} datapoints: {summary['batches'][0]['error']}",
+                status_code=500,
+            )
 
         return {
             "index_id": index_id,
-            "upserted": len(datapoints),
+            "status": "PARTIAL" if failed else "UPSERTED",
+            "upserted": upserted,
+            "failed": failed,
+            "failed_ids": summary["failed_ids"],
+            "failed_ids_truncated": summary["failed_ids_truncated"],
+            "batches": summary["batches"],
             "datapoints_source": datapoints_source,
             "datapoints_gcs_prefix": datapoints_gcs_prefix,
+            "datapoints_file_type": datapoints_file_type,
         }
     except PipelineException:
         raise
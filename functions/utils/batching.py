@@ -0,0 +1,187 @@
+import random
+import time
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Generic, NamedTuple, TypeVar
+
+from google.api_core import exceptions as google_exceptions
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+RETRYABLE_EXCEPTIONS: tuple[type[BaseException], ...] = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.GatewayTimeout,
+    ConnectionError,
+    TimeoutError,
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token estimate for embedding inputs (~4 characters per token).
+    """
+    return max(1, (len(text) + 3) // 4)
+
+
+def pack_batches(
+    texts: Sequence[str], *, max_instances: int, max_tokens: int
+) -> list[list[int]]:
+    """
+    Pack text indices into batches bounded by instance count and estimated tokens.
+    A single text larger than `max_tokens` is sent on its own.
+    """
+    max_instances = max(1, int(max_instances))
+    max_tokens = max(1, int(max_tokens))
+
+    batches: list[list[int]] = []
+    current: list[int] = []
+    current_tokens = 0
+    for idx, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if current and (
+            len(current) >= max_instances or current_tokens + tokens > max_tokens
+        ):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(idx)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def call_with_retry(
+    fn: Callable[[], T],
+    *,
+    max_retries: int = 5,
+    initial_backoff: float = 1.0,
+    max_backoff: float = 32.0,
+    retryable: tuple[type[BaseException], ...] = RETRYABLE_EXCEPTIONS,
+) -> T:
+    """
+    Call `fn`, retrying retryable errors with exponential backoff and full jitter.
+    """
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except retryable:
+            if attempt >= max_retries:
+                raise
+            delay = min(max_backoff, initial_backoff * (2**attempt))
+            time.sleep(random.uniform(0, delay))
+            attempt += 1
+
+
+def run_batches(
+    fn: Callable[[T], R],
+    batches: Sequence[T],
+    *,
+    concurrency: int = 1,
+    max_retries: int = 5,
+    initial_backoff: float = 1.0,
+    max_backoff: float = 32.0,
+) -> list[R]:
+    """
+    Run `fn` over batches on a bounded thread pool, retrying each batch on its own.
+    Results are returned in batch order; the first non-retryable error is raised.
+    """
+    def _run(batch: T) -> R:
+        return call_with_retry(
+            lambda: fn(batch),
+            max_retries=max_retries,
+            initial_backoff=initial_backoff,
+            max_backoff=max_backoff,
+        )
+
+    concurrency = max(1, int(concurrency))
+    if concurrency == 1 or len(batches) <= 1:
+        return [_run(batch) for batch in batches]
+
+    results: list[R] = [None] * len(batches)  # type: ignore[list-item]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending: dict[Future, int] = {}
+        next_idx = 0
+        try:
+            while next_idx < len(batches) or pending:
+                while next_idx < len(batches) and len(pending) < concurrency:
+                    pending[executor.submit(_run, batches[next_idx])] = next_idx
+                    next_idx += 1
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[pending.pop(future)] = future.result()
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+    return results
+
+
+class BatchResult(NamedTuple, Generic[T, R]):
+    index: int
+    batch: T
+    result: R | None
+    error: BaseException | None
+    attempts: int
+    seconds: float
+
+
+def iter_batch_results(
+    fn: Callable[[T], R],
+    batches: Iterable[T],
+    *,
+    concurrency: int = 1,
+    max_retries: int = 5,
+    initial_backoff: float = 1.0,
+    max_backoff: float = 32.0,
+) -> Iterator[BatchResult[T, R]]:
+    """
+    Run `fn` over a lazy stream of batches on a bounded thread pool, retrying each
+    batch on its own. One result per batch is yielded in batch order; a batch that
+    still fails after its retries is reported with its error instead of stopping
+    the run. At most `2 * concurrency` batches are pulled from `batches` ahead of
+    the consumer.
+    """
+    def _run(batch: T) -> tuple[R | None, BaseException | None, int, float]:
+        attempts = 0
+        started = time.monotonic()
+
+        def _attempt() -> R:
+            nonlocal attempts
+            attempts += 1
+            return fn(batch)
+
+        try:
+            result = call_with_retry(
+                _attempt,
+                max_retries=max_retries,
+                initial_backoff=initial_backoff,
+                max_backoff=max_backoff,
+            )
+        except Exception as exc:
+            return None, exc, attempts, time.monotonic() - started
+        return result, None, attempts, time.monotonic() - started
+
+    concurrency = max(1, int(concurrency))
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    window: deque[tuple[int, T, Future]] = deque()
+    try:
+        for index, batch in enumerate(batches):
+            window.append((index, batch, executor.submit(_run, batch)))
+            while len(window) >= 2 * concurrency or (window and window[0][2].done()):
+                head_index, head_batch, future = window.popleft()
+                yield BatchResult(head_index, head_batch, *future.result())
+        while window:
+            head_index, head_batch, future = window.popleft()
+            yield BatchResult(head_index, head_batch, *future.result())
+    finally:
+        for _, _, future in window:
+            future.cancel()
+        executor.shutdown(wait=True)
@@ -1,8 +1,12 @@
+from collections.abc import Iterator
+from datetime import date, datetime
 from typing import Any
 
 from google.api_core.exceptions import BadRequest
 from google.cloud import bigquery
 
+from functions.utils.clients import get_bigquery_client
+
 
 def _select_clause(column_list: list[str] | None) -> str:
     if not column_list:
@@ -13,17 +17,87 @@ def _select_clause(column_list: list[str] | None) -> str:
     return ", ".join(f"`{col}`" for col in cols)
 
 
+def _select_query(
+    table: str,
+    where_clause: str,
+    column_list: list[str] | None,
+    order_by: list[str] | None = None,
+) -> str:
+    query = f"SELECT {_select_clause(column_list)} FROM `{table}` WHERE {where_clause}"
+    order_columns = [col.strip() for col in order_by or [] if col and col.strip()]
+    if order_columns:
+        query += " ORDER BY " + ", ".join(f"`{col}`" for col in order_columns)
+    return query
+
+
+def query_parameter(name: str, value: Any) -> bigquery.ScalarQueryParameter:
+    """
+    Build a named scalar query parameter, inferring the BigQuery type from the value.
+    """
+    if isinstance(value, bool):
+        type_ = "BOOL"
+    elif isinstance(value, int):
+        type_ = "INT64"
+    elif isinstance(value, float):
+        type_ = "FLOAT64"
+    elif isinstance(value, datetime):
+        type_ = "TIMESTAMP" if value.tzinfo is not None else "DATETIME"
+    elif isinstance(value, date):
+        type_ = "DATE"
+    else:
+        type_ = "STRING"
+    return bigquery.ScalarQueryParameter(name, type_, value)
+
+
+def _job_config(
+    query_parameters: list[bigquery.ScalarQueryParameter] | None,
+) -> bigquery.QueryJobConfig | None:
+    if not query_parameters:
+        return None
+    return bigquery.QueryJobConfig(query_parameters=query_parameters)
+
+
 def query_table(
-    table: str, where_clause: str, column_list: list[str] | None = None
+    table: str,
+    where_clause: str,
+    column_list: list[str] | None = None,
+    *,
+    query_parameters: list[bigquery.ScalarQueryParameter] | None = None,
 ) -> list[dict[str, Any]]:
     """
     Query a BigQuery table with a WHERE clause and return rows as dictionaries.
     """
     try:
-        client = bigquery.Client()
-        select_columns = _select_clause(column_list)
-        query = f"SELECT {select_columns} FROM `{table}` WHERE {where_clause}"
-        
-        return [dict(row.items()) for row in client.query(query)]
+        client = get_bigquery_client()
+        query = _select_query(table, where_clause, column_list)
+        job = client.query(query, job_config=_job_config(query_parameters))
+
+        return [dict(row.items()) for row in job]
+    except BadRequest as exc:
+        raise ValueError(str(exc)) from exc
+
+
+def iter_table_pages(
+    table: str,
+    where_clause: str,
+    column_list: list[str] | None = None,
+    *,
+    page_size: int = 1000,
+    query_parameters: list[bigquery.ScalarQueryParameter] | None = None,
+    order_by: list[str] | None = None,
+    start_index: int = 0,
+) -> Iterator[list[dict[str, Any]]]:
+    """
+    Query a BigQuery table and yield result pages as lists of row dictionaries,
+    so only one page is held in memory at a time. With `order_by`, rows come in a
+    stable order and `start_index` skips that many leading rows.
+    """
+    try:
+        client = get_bigquery_client()
+        query = _select_query(table, where_clause, column_list, order_by)
+        job = client.query(query, job_config=_job_config(query_parameters))
+        result = job.result(page_size=page_size, start_index=start_index or None)
+        for page in result.pages:
+            yield [dict(row.items()) for row in page]
     except BadRequest as exc:
         raise ValueError(str(exc)) from exc
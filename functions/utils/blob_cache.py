@@ -0,0 +1,154 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+
+_READ_CHUNK_BYTES = 4 * 1024 * 1024
+
+
+class BlobCache:
+    """
+    Local disk cache of GCS objects keyed by (bucket, name, generation). An
+    overwritten object gets a new generation, so a stale copy is never served;
+    older generations of the same object are dropped when a new one is stored.
+    Files are evicted least-recently-used once `max_bytes` is exceeded.
+    """
+
+    def __init__(self, local_dir: str, *, max_bytes: int = 10 * 1024**3) -> None:
+        self.root = Path(local_dir).expanduser()
+        (self.root / "objects").mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(self.root / "blobs.sqlite"), check_same_thread=False, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            "key TEXT PRIMARY KEY, bucket TEXT NOT NULL, name TEXT NOT NULL, "
+            "generation TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS blobs_last_access ON blobs (last_access)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS blobs_object ON blobs (bucket, name)")
+        self._conn.commit()
+
+    @staticmethod
+    def _key(bucket: str, name: str, generation: Any) -> str:
+        raw = f"{bucket}\x1f{name}\x1f{generation}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / "objects" / key[:2] / key
+
+    def get_path(self, bucket: str, name: str, generation: Any) -> Path | None:
+        """
+        Return the local file holding this object version, or None on a miss.
+        """
+        key = self._key(bucket, name, generation)
+        path = self._path(key)
+        with self._lock:
+            found = self._conn.execute(
+                "SELECT 1 FROM blobs WHERE key = ?", (key,)
+            ).fetchone()
+            if found is None:
+                return None
+            if not path.exists():
+                self._conn.execute("DELETE FROM blobs WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute(
+                "UPDATE blobs SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+        return path
+
+    def store(
+        self, bucket: str, name: str, generation: Any, chunks: Iterable[bytes]
+    ) -> Iterator[bytes]:
+        """
+        Pass `chunks` through while writing them to the cache. The entry is only
+        added once every chunk was written, so a partial read never becomes visible.
+        """
+        key = self._key(bucket, name, generation)
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                for chunk in chunks:
+                    fp.write(chunk)
+                    size += len(chunk)
+                    yield chunk
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        with self._lock:
+            stale = self._conn.execute(
+                "SELECT key FROM blobs WHERE bucket = ? AND name = ? AND key != ?",
+                (bucket, name, key),
+            ).fetchall()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO blobs "
+                "(key, bucket, name, generation, size, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, bucket, name, str(generation), size, time.time()),
+            )
+            self._delete([stale_key for (stale_key,) in stale])
+            self._evict()
+            self._conn.commit()
+
+    def _delete(self, keys: list[str]) -> None:
+        for key in keys:
+            self._path(key).unlink(missing_ok=True)
+        self._conn.executemany("DELETE FROM blobs WHERE key = ?", [(key,) for key in keys])
+
+    def _evict(self) -> None:
+        (total,) = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM blobs"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+        # Evict down to 90% of the budget so eviction is not run on every store.
+        target = int(self.max_bytes * 0.9)
+        evicted: list[str] = []
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM blobs ORDER BY last_access ASC"
+        ).fetchall():
+            if total <= target:
+                break
+            evicted.append(key)
+            total -= size
+        self._delete(evicted)
+
+
+def iter_file_chunks(path: Path, *, chunk_size: int = _READ_CHUNK_BYTES) -> Iterator[bytes]:
+    with path.open("rb") as fp:
+        while chunk := fp.read(chunk_size):
+            yield chunk
+
+
+@lru_cache(maxsize=None)
+def _cache_instance(local_dir: str, max_bytes: int) -> BlobCache:
+    return BlobCache(local_dir, max_bytes=max_bytes)
+
+
+def get_blob_cache(config: dict[str, Any]) -> BlobCache | None:
+    """
+    Return the process-wide GCS blob cache configured in `gcs_cache`, if enabled.
+    """
+    settings = config.get("gcs_cache") or {}
+    if not settings.get("enabled"):
+        return None
+    return _cache_instance(
+        str(settings.get("local_dir") or "/tmp/items_pipeline/gcs_cache"),
+        int(settings.get("max_bytes") or 10 * 1024**3),
+    )
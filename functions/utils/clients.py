@@ -0,0 +1,170 @@
+import threading
+from collections.abc import Callable
+from typing import Any, TypeVar
+
+import google.auth
+import requests.adapters
+import vertexai
+from google.auth.transport.requests import AuthorizedSession
+from google.cloud import aiplatform, bigquery, storage
+from vertexai.language_models import TextEmbeddingModel
+
+from functions.utils.logging import get_logger
+
+T = TypeVar("T")
+
+logger = get_logger(__name__)
+
+_lock = threading.RLock()
+_clients: dict[tuple[Any, ...], Any] = {}
+_http_pool_size = 32
+
+
+def _get_or_create(key: tuple[Any, ...], factory: Callable[[], T]) -> T:
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = factory()
+            _clients[key] = client
+        return client
+
+
+def register_client(kind: str, client: Any, *key: Any) -> None:
+    """
+    Put a client into the registry, e.g. a fake in tests:
+    `register_client("storage", fake_client, None)`.
+    """
+    with _lock:
+        _clients[(kind, *key)] = client
+
+
+def evict_client(kind: str, *key: Any) -> None:
+    with _lock:
+        _clients.pop((kind, *key), None)
+
+
+def clear_clients() -> None:
+    with _lock:
+        _clients.clear()
+
+
+def _authorized_session(scopes: tuple[str, ...]) -> tuple[Any, AuthorizedSession]:
+    # Both clients send every call through one requests session per instance; the
+    # default pool of 10 connections is smaller than our upload/download worker pools.
+    credentials, _ = google.auth.default(scopes=scopes)
+    session = AuthorizedSession(credentials)
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=_http_pool_size, pool_maxsize=_http_pool_size
+    )
+    session.mount("https://", adapter)
+    return credentials, session
+
+
+def get_bigquery_client(project: str | None = None) -> bigquery.Client:
+    def _create() -> bigquery.Client:
+        credentials, session = _authorized_session(bigquery.Client.SCOPE)
+        return bigquery.Client(project=project, credentials=credentials, _http=session)
+
+    return _get_or_create(("bigquery", project), _create)
+
+
+def get_storage_client(project: str | None = None) -> storage.Client:
+    def _create() -> storage.Client:
+        credentials, session = _authorized_session(storage.Client.SCOPE)
+        if project:
+            return storage.Client(project=project, credentials=credentials, _http=session)
+        return storage.Client(credentials=credentials, _http=session)
+
+    return _get_or_create(("storage", project), _create)
+
+
+def init_vertex(project_id: str, region: str) -> None:
+    """
+    Initialize the Vertex AI SDKs once per (project, region).
+    """
+    def _init() -> bool:
+        vertexai.init(project=project_id, location=region)
+        aiplatform.init(project=project_id, location=region)
+        return True
+
+    _get_or_create(("vertex_init", project_id, region), _init)
+
+
+def get_embedding_model(
+    project_id: str, region: str, model_name: str
+) -> TextEmbeddingModel:
+    def _create() -> TextEmbeddingModel:
+        init_vertex(project_id, region)
+        return TextEmbeddingModel.from_pretrained(model_name)
+
+    return _get_or_create(("embedding_model", project_id, region, model_name), _create)
+
+
+def get_index_endpoint(
+    project_id: str, region: str, endpoint_id: str
+) -> aiplatform.MatchingEngineIndexEndpoint:
+    def _create() -> aiplatform.MatchingEngineIndexEndpoint:
+        init_vertex(project_id, region)
+        return aiplatform.MatchingEngineIndexEndpoint(
+            index_endpoint_name=endpoint_id, project=project_id, location=region
+        )
+
+    return _get_or_create(("index_endpoint", project_id, region, endpoint_id), _create)
+
+
+def get_index(
+    project_id: str, region: str, index_id: str
+) -> aiplatform.MatchingEngineIndex:
+    def _create() -> aiplatform.MatchingEngineIndex:
+        init_vertex(project_id, region)
+        return aiplatform.MatchingEngineIndex(
+            index_name=index_id, project=project_id, location=region
+        )
+
+    return _get_or_create(("index", project_id, region, index_id), _create)
+
+
+def warm_clients(config: dict[str, Any]) -> None:
+    """
+    Create the clients listed in the `clients` section ahead of the first request.
+    Failures are logged and left for the first request to surface.
+    """
+    global _http_pool_size
+
+    settings = config.get("clients") or {}
+    _http_pool_size = int(settings.get("http_pool_size") or _http_pool_size)
+    if not settings.get("warm_on_startup"):
+        return
+
+    project_id = config.get("project_id")
+    region = config.get("region")
+    model_names = settings.get("embedding_models") or sorted(
+        {
+            section.get("embedding_model_name")
+            for section in (config.get("embed_data") or {}, config.get("embed_text") or {})
+            if section.get("embedding_model_name")
+        }
+    )
+    tasks: list[tuple[str, Callable[[], Any]]] = [
+        ("bigquery", lambda: get_bigquery_client()),
+        ("storage", lambda: get_storage_client()),
+    ]
+    if project_id and region:
+        tasks.append(("vertex", lambda: init_vertex(project_id, region)))
+        for model_name in model_names:
+            tasks.append(
+                (model_name, lambda name=model_name: get_embedding_model(project_id, region, name))
+            )
+        for endpoint_id in settings.get("index_endpoints") or []:
+            tasks.append(
+                (endpoint_id, lambda eid=endpoint_id: get_index_endpoint(project_id, region, eid))
+            )
+
+    for name, task in tasks:
+        try:
+            task()
+        except Exception as exc:
+            logger.warning("Failed to warm client %s: %s", name, exc)
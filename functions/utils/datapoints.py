@@ -0,0 +1,192 @@
+import hashlib
+import time
+from collections.abc import Callable, Iterable, Iterator
+from typing import Any, TypeVar
+
+import numpy as np
+from google.cloud.aiplatform_v1.types import index as gca_index
+
+from functions.utils.batching import BatchResult, iter_batch_results
+from functions.utils.jobs import JobProgress
+from functions.utils.search_cache import index_key
+from functions.utils.state_store import get_state_store
+
+T = TypeVar("T")
+
+# Stay well below the 10 MB request limit of the index service.
+DEFAULT_MAX_BATCH_BYTES = 8 * 1024 * 1024
+
+
+def iter_index_datapoints(items: Iterable[dict[str, Any]]) -> Iterator[gca_index.IndexDatapoint]:
+    """
+    Build `IndexDatapoint`s from datapoint records one at a time.
+    """
+    for item in items:
+        restricts = [
+            gca_index.IndexDatapoint.Restriction(
+                namespace=restrict.get("namespace", ""),
+                allow_list=restrict.get("allow") or restrict.get("allow_list") or [],
+                deny_list=restrict.get("deny") or restrict.get("deny_list") or [],
+            )
+            for restrict in item.get("restricts", []) or []
+        ]
+        numeric_restricts = [
+            gca_index.IndexDatapoint.NumericRestriction(**restrict)
+            for restrict in item.get("numeric_restricts", []) or []
+        ]
+
+        embedding = item.get("embedding", [])
+        if isinstance(embedding, np.ndarray):
+            embedding = embedding.astype(np.float32, copy=False).tolist()
+
+        yield gca_index.IndexDatapoint(
+            datapoint_id=str(item.get("id")),
+            feature_vector=embedding,
+            restricts=restricts,
+            numeric_restricts=numeric_restricts,
+        )
+
+
+def datapoint_size(datapoint: gca_index.IndexDatapoint) -> int:
+    return gca_index.IndexDatapoint.pb(datapoint).ByteSize()
+
+
+def datapoint_ids(datapoints: list[gca_index.IndexDatapoint]) -> list[str]:
+    return [datapoint.datapoint_id for datapoint in datapoints]
+
+
+def batch_bytes(datapoints: list[gca_index.IndexDatapoint]) -> int:
+    return sum(datapoint_size(datapoint) for datapoint in datapoints)
+
+
+def datapoint_fingerprint(datapoint: gca_index.IndexDatapoint) -> str:
+    """
+    Hash of everything the index stores for a datapoint: the vector and the
+    restricts. Equal fingerprints mean an upsert would not change the index.
+    """
+    data = gca_index.IndexDatapoint.pb(datapoint).SerializeToString(deterministic=True)
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def sync_manifest_key(project_id: str, region: str, index_id: str) -> str:
+    """
+    State store key of the manifest `streaming_sync` keeps for an index.
+    """
+    raw = "\x1f".join([project_id, region, index_key(index_id)])
+    return f"manifests/{hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]}"
+
+
+def mark_sync_manifest_stale(config: dict[str, Any], index_id: str) -> None:
+    """
+    Record that `index_id` was written outside `streaming_sync`, so its manifest
+    fingerprints may no longer match the index. The next sync upserts every
+    datapoint and still uses the manifest ids to find removed ones.
+    """
+    key = sync_manifest_key(config["project_id"], config["region"], index_id)
+    get_state_store(config).put(
+        f"{key}-stale", {"index_id": index_id, "marked_at": time.time_ns()}
+    )
+
+
+def iter_datapoint_batches(
+    datapoints: Iterable[gca_index.IndexDatapoint], *, max_datapoints: int, max_bytes: int
+) -> Iterator[list[gca_index.IndexDatapoint]]:
+    """
+    Group datapoints into batches bounded by count and by serialized size. A batch
+    is closed when the next datapoint would exceed either bound; a single oversized
+    datapoint still goes out alone and is rejected by the API.
+    """
+    batch: list[gca_index.IndexDatapoint] = []
+    total = 0
+    for datapoint in datapoints:
+        size = datapoint_size(datapoint)
+        if batch and (len(batch) >= max_datapoints or total + size > max_bytes):
+            yield batch
+            batch, total = [], 0
+        batch.append(datapoint)
+        total += size
+    if batch:
+        yield batch
+
+
+def iter_id_batches(ids: Iterable[Any], *, batch_size: int) -> Iterator[list[str]]:
+    batch: list[str] = []
+    for datapoint_id in ids:
+        batch.append(str(datapoint_id))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def index_batch_options(request: dict[str, Any]) -> dict[str, Any]:
+    """
+    Batching settings shared by the index write requests.
+    """
+    return {
+        "max_datapoints": max(1, int(request.get("batch_size") or 1000)),
+        "max_bytes": max(1, int(request.get("max_batch_bytes") or DEFAULT_MAX_BATCH_BYTES)),
+        "concurrency": max(1, int(request.get("concurrency") or 1)),
+        "max_retries": int(request.get("max_retries") or 0),
+        "failed_ids_limit": int(request.get("failed_ids_limit") or 10000),
+    }
+
+
+def run_index_batches(
+    fn: Callable[[list[T]], Any],
+    batches: Iterable[list[T]],
+    *,
+    options: dict[str, Any],
+    ids_of: Callable[[list[T]], list[str]],
+    counter: str,
+    failed_counter: str = "failed",
+    bytes_of: Callable[[list[T]], int] | None = None,
+    progress: JobProgress | None = None,
+    on_outcome: Callable[[BatchResult], None] | None = None,
+) -> dict[str, Any]:
+    """
+    Send `batches` to the index with `fn`, concurrently and with per-batch retry.
+    Failed batches are recorded rather than raised. Returns the `counter` and
+    `failed_counter` totals, the failed ids (capped at `failed_ids_limit`) and
+    per-batch stats.
+    """
+    done = 0
+    failed = 0
+    failed_ids: list[str] = []
+    batch_stats: list[dict[str, Any]] = []
+    for outcome in iter_batch_results(
+        fn,
+        batches,
+        concurrency=options["concurrency"],
+        max_retries=options["max_retries"],
+    ):
+        size = len(outcome.batch)
+        stats: dict[str, Any] = {"batch": outcome.index, "size": size}
+        if bytes_of is not None:
+            stats["bytes"] = bytes_of(outcome.batch)
+        stats.update(
+            attempts=outcome.attempts, seconds=round(outcome.seconds, 3), status="OK"
+        )
+        if outcome.error is None:
+            done += size
+        else:
+            failed += size
+            stats["status"] = "FAILED"
+            stats["error"] = str(outcome.error)
+            room = options["failed_ids_limit"] - len(failed_ids)
+            if room > 0:
+                failed_ids.extend(ids_of(outcome.batch[:room]))
+        batch_stats.append(stats)
+        if on_outcome is not None:
+            on_outcome(outcome)
+        if progress is not None:
+            progress.set(**{counter: done, failed_counter: failed})
+
+    return {
+        counter: done,
+        failed_counter: failed,
+        "failed_ids": failed_ids,
+        "failed_ids_truncated": len(failed_ids) < failed,
+        "batches": batch_stats,
+    }
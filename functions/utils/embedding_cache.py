@@ -0,0 +1,197 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from google.api_core.exceptions import NotFound
+
+from functions.utils.clients import get_storage_client
+from functions.utils.gcs import parse_gcs_prefix
+
+
+def embedding_cache_key(
+    embedding_model: str, output_dimensionality: int, task_type: str, text: str
+) -> str:
+    """
+    Content-addressed cache key for one embedding.
+    """
+    text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    raw = f"{embedding_model}\x1f{int(output_dimensionality)}\x1f{task_type}\x1f{text_hash}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache: a local SQLite file with size-bounded LRU eviction,
+    backed by an optional GCS prefix that is shared between workers.
+    """
+
+    def __init__(
+        self,
+        local_dir: str,
+        *,
+        max_bytes: int = 2 * 1024**3,
+        gcs_prefix: str | None = None,
+        gcs_concurrency: int = 16,
+    ) -> None:
+        path = Path(local_dir).expanduser()
+        path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_bytes)
+        self.gcs_concurrency = max(1, int(gcs_concurrency))
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(path / "embeddings.sqlite"), check_same_thread=False, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, "
+            "size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)"
+        )
+        self._conn.commit()
+
+        self._gcs_bucket = None
+        self._gcs_path = ""
+        if gcs_prefix:
+            bucket_name, gcs_path = parse_gcs_prefix(
+                gcs_prefix, field_name="embedding_cache.gcs_prefix"
+            )
+            self._gcs_bucket = get_storage_client().bucket(bucket_name)
+            self._gcs_path = gcs_path.rstrip("/")
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, np.ndarray]:
+        wanted = list(dict.fromkeys(keys))
+        found = self._local_get(wanted)
+        if self._gcs_bucket is not None:
+            missing = [key for key in wanted if key not in found]
+            remote = self._gcs_get(missing)
+            if remote:
+                self._local_put(remote)
+                found.update(remote)
+        return found
+
+    def put_many(self, entries: dict[str, np.ndarray]) -> None:
+        if not entries:
+            return
+        self._local_put(entries)
+        if self._gcs_bucket is not None:
+            self._gcs_put(entries)
+
+    def _local_get(self, keys: list[str]) -> dict[str, np.ndarray]:
+        found: dict[str, np.ndarray] = {}
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start : start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    chunk,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+                if rows:
+                    self._conn.executemany(
+                        "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                        [(now, key) for key, _ in rows],
+                    )
+            self._conn.commit()
+        return found
+
+    def _local_put(self, entries: dict[str, np.ndarray]) -> None:
+        now = time.time()
+        records = []
+        for key, vector in entries.items():
+            blob = np.ascontiguousarray(vector, dtype=np.float32).tobytes()
+            records.append((key, blob, len(blob), now))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, size, last_access) "
+                "VALUES (?, ?, ?, ?)",
+                records,
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        (total,) = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM embeddings"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+        # Evict down to 90% of the budget so eviction is not run on every put.
+        target = int(self.max_bytes * 0.9)
+        rows = self._conn.execute(
+            "SELECT key, size FROM embeddings ORDER BY last_access ASC"
+        )
+        evicted: list[tuple[str]] = []
+        for key, size in rows:
+            if total <= target:
+                break
+            evicted.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+
+    def _gcs_blob_name(self, key: str) -> str:
+        return f"{self._gcs_path}/{key[:2]}/{key}.f32"
+
+    def _gcs_get(self, keys: list[str]) -> dict[str, np.ndarray]:
+        def _download(key: str) -> tuple[str, np.ndarray | None]:
+            try:
+                raw = self._gcs_bucket.blob(self._gcs_blob_name(key)).download_as_bytes()
+            except NotFound:
+                return key, None
+            return key, np.frombuffer(raw, dtype=np.float32)
+
+        if not keys:
+            return {}
+        with ThreadPoolExecutor(max_workers=self.gcs_concurrency) as executor:
+            results = executor.map(_download, keys)
+            return {key: vector for key, vector in results if vector is not None}
+
+    def _gcs_put(self, entries: dict[str, np.ndarray]) -> None:
+        def _upload(item: tuple[str, np.ndarray]) -> None:
+            key, vector = item
+            self._gcs_bucket.blob(self._gcs_blob_name(key)).upload_from_string(
+                np.ascontiguousarray(vector, dtype=np.float32).tobytes(),
+                content_type="application/octet-stream",
+            )
+
+        with ThreadPoolExecutor(max_workers=self.gcs_concurrency) as executor:
+            list(executor.map(_upload, entries.items()))
+
+
+@lru_cache(maxsize=None)
+def _cache_instance(
+    local_dir: str, max_bytes: int, gcs_prefix: str | None, gcs_concurrency: int
+) -> EmbeddingCache:
+    return EmbeddingCache(
+        local_dir,
+        max_bytes=max_bytes,
+        gcs_prefix=gcs_prefix,
+        gcs_concurrency=gcs_concurrency,
+    )
+
+
+def get_embedding_cache(config: dict[str, Any]) -> EmbeddingCache | None:
+    """
+    Return the process-wide embedding cache configured in `embedding_cache`, if enabled.
+    """
+    settings = config.get("embedding_cache") or {}
+    if not settings.get("enabled"):
+        return None
+    return _cache_instance(
+        str(settings.get("local_dir") or "/tmp/items_pipeline/embedding_cache"),
+        int(settings.get("max_bytes") or 2 * 1024**3),
+        settings.get("gcs_prefix") or None,
+        int(settings.get("gcs_concurrency") or 16),
+    )
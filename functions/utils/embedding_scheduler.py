@@ -0,0 +1,246 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from functools import lru_cache
+from typing import Any, TypeVar
+
+from google.api_core import exceptions as google_exceptions
+
+R = TypeVar("R")
+
+# Lower value is served first.
+PRIORITIES = {"interactive": 0, "bulk": 1}
+
+_THROTTLED_EXCEPTIONS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+)
+
+
+class _QueueStats:
+    def __init__(self) -> None:
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.throttled = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.recent_waits: deque[float] = deque(maxlen=1024)
+
+    def snapshot(self) -> dict[str, Any]:
+        waits = sorted(self.recent_waits)
+
+        def _quantile(q: float) -> float:
+            if not waits:
+                return 0.0
+            return waits[min(len(waits) - 1, int(q * len(waits)))]
+
+        started = self.completed + self.failed
+        return {
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "throttled": self.throttled,
+            "wait_seconds_avg": self.wait_total / started if started else 0.0,
+            "wait_seconds_p50": _quantile(0.5),
+            "wait_seconds_p95": _quantile(0.95),
+            "wait_seconds_max": self.wait_max,
+        }
+
+
+class EmbeddingScheduler:
+    """
+    Process-wide gate for embedding API calls. Calls wait in one priority queue
+    (interactive before bulk, FIFO within a priority) and start only when the
+    adaptive concurrency limit has room and, if `instances_per_minute` is set, the
+    token bucket holds the call's instances (quotas count instances, not requests).
+    The limit grows by one per window of fast successes and is cut
+    multiplicatively on 429s or when latency exceeds `latency_target_seconds`.
+    """
+
+    def __init__(
+        self,
+        *,
+        instances_per_minute: float | None = None,
+        burst: int = 250,
+        initial_concurrency: int = 8,
+        min_concurrency: int = 1,
+        max_concurrency: int = 32,
+        latency_target_seconds: float = 5.0,
+        decrease_factor: float = 0.5,
+    ) -> None:
+        # Without a quota there is no bucket; the concurrency limit still adapts.
+        self.rate = (
+            max(float(instances_per_minute), 1.0) / 60.0 if instances_per_minute else None
+        )
+        self.burst = max(1, int(burst))
+        self.min_concurrency = max(1, int(min_concurrency))
+        self.max_concurrency = max(self.min_concurrency, int(max_concurrency))
+        self.latency_target = float(latency_target_seconds)
+        self.decrease_factor = min(max(float(decrease_factor), 0.1), 0.95)
+
+        self._cond = threading.Condition()
+        self._limit = float(
+            min(max(int(initial_concurrency), self.min_concurrency), self.max_concurrency)
+        )
+        self._in_flight = 0
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        self._last_decrease = 0.0
+        self._latency_ewma: float | None = None
+        self._waiters: list[tuple[int, int]] = []
+        self._sequence = itertools.count()
+        self._stats = {name: _QueueStats() for name in PRIORITIES}
+
+    def call(self, fn: Callable[[], R], *, priority: str = "bulk", instances: int = 1) -> R:
+        """
+        Run `fn`, a request of `instances` embedding inputs, once a slot is free.
+        Errors propagate to the caller, whose retry policy decides whether to try
+        again; 429s also shrink the limit.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"priority must be one of: {', '.join(PRIORITIES)}")
+        stats = self._stats[priority]
+        ticket = (PRIORITIES[priority], next(self._sequence))
+        # A request larger than the burst waits for a full bucket and goes into debt.
+        cost = float(max(1, int(instances)))
+        needed = min(cost, float(self.burst))
+        queued_at = time.monotonic()
+        with self._cond:
+            stats.submitted += 1
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    self._refill()
+                    if self._waiters[0] == ticket and self._in_flight < int(self._limit):
+                        if self.rate is None or self._tokens >= needed:
+                            break
+                        self._cond.wait((needed - self._tokens) / self.rate)
+                    else:
+                        self._cond.wait()
+            except BaseException:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._waiters)
+            if self.rate is not None:
+                self._tokens -= cost
+            self._in_flight += 1
+            waited = time.monotonic() - queued_at
+            stats.wait_total += waited
+            stats.wait_max = max(stats.wait_max, waited)
+            stats.recent_waits.append(waited)
+            self._cond.notify_all()
+
+        started_at = time.monotonic()
+        try:
+            result = fn()
+        except _THROTTLED_EXCEPTIONS:
+            with self._cond:
+                stats.failed += 1
+                stats.throttled += 1
+                self._in_flight -= 1
+                # Back off as a whole: shrink the limit and drain the bucket so the
+                # queued calls do not all retry into the same quota window.
+                self._decrease(started_at)
+                self._tokens = min(self._tokens, 0.0)
+                self._cond.notify_all()
+            raise
+        except BaseException:
+            with self._cond:
+                stats.failed += 1
+                self._in_flight -= 1
+                self._cond.notify_all()
+            raise
+
+        latency = time.monotonic() - started_at
+        with self._cond:
+            stats.completed += 1
+            self._in_flight -= 1
+            self._latency_ewma = (
+                latency
+                if self._latency_ewma is None
+                else 0.8 * self._latency_ewma + 0.2 * latency
+            )
+            if self.latency_target and self._latency_ewma > self.latency_target:
+                self._decrease(started_at)
+            else:
+                self._limit = min(
+                    float(self.max_concurrency), self._limit + 1.0 / self._limit
+                )
+            self._cond.notify_all()
+        return result
+
+    def _refill(self) -> None:
+        if self.rate is None:
+            return
+        now = time.monotonic()
+        self._tokens = min(
+            float(self.burst), self._tokens + (now - self._refilled_at) * self.rate
+        )
+        self._refilled_at = now
+
+    def _decrease(self, started_at: float) -> None:
+        # Calls that started before the last cut saw the old limit; counting their
+        # outcome again would collapse the limit on a single burst of errors.
+        if started_at < self._last_decrease:
+            return
+        self._limit = max(float(self.min_concurrency), self._limit * self.decrease_factor)
+        self._last_decrease = time.monotonic()
+
+    def stats(self) -> dict[str, Any]:
+        with self._cond:
+            self._refill()
+            return {
+                "concurrency_limit": int(self._limit),
+                "in_flight": self._in_flight,
+                "queued": len(self._waiters),
+                "tokens": round(self._tokens, 3) if self.rate is not None else None,
+                "instances_per_minute": self.rate * 60.0 if self.rate is not None else None,
+                "latency_seconds_ewma": self._latency_ewma,
+                "queues": {name: stats.snapshot() for name, stats in self._stats.items()},
+            }
+
+
+@lru_cache(maxsize=None)
+def _scheduler_instance(
+    instances_per_minute: float | None,
+    burst: int,
+    initial_concurrency: int,
+    min_concurrency: int,
+    max_concurrency: int,
+    latency_target_seconds: float,
+    decrease_factor: float,
+) -> EmbeddingScheduler:
+    return EmbeddingScheduler(
+        instances_per_minute=instances_per_minute,
+        burst=burst,
+        initial_concurrency=initial_concurrency,
+        min_concurrency=min_concurrency,
+        max_concurrency=max_concurrency,
+        latency_target_seconds=latency_target_seconds,
+        decrease_factor=decrease_factor,
+    )
+
+
+def get_embedding_scheduler(config: dict[str, Any]) -> EmbeddingScheduler | None:
+    """
+    Return the process-wide embedding scheduler configured in `embedding_scheduler`,
+    if enabled.
+    """
+    settings = config.get("embedding_scheduler") or {}
+    if not settings.get("enabled", True):
+        return None
+    return _scheduler_instance(
+        float(settings.get("instances_per_minute") or 0) or None,
+        int(settings.get("burst") or 250),
+        int(settings.get("initial_concurrency") or 8),
+        int(settings.get("min_concurrency") or 1),
+        int(settings.get("max_concurrency") or 32),
+        float(settings.get("latency_target_seconds") or 0),
+        float(settings.get("decrease_factor") or 0.5),
+    )
@@ -1,10 +1,25 @@
+import gzip
 import json
+import mmap
+import re
+import threading
+import zlib
+from collections import deque
 from io import BytesIO
+from pathlib import Path
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import date, datetime, time
+from collections.abc import Callable, Iterable, Iterator
 from typing import Any
 
 import numpy as np
-from google.cloud import storage
+
+from functions.utils.batching import call_with_retry
+from functions.utils.blob_cache import BlobCache, iter_file_chunks
+from functions.utils.clients import get_storage_client
+from functions.utils.jsonl import encode_datapoints_jsonl, is_datapoint_batch
+from functions.utils.npz import decode_datapoints_npz, encode_datapoints_npz, npy_view
+from functions.utils.pipeline import BackgroundIterator
 
 
 def parse_gcs_prefix(prefix: str, *, field_name: str = "gcs_prefix") -> tuple[str, str]:
@@ -20,101 +35,555 @@ def parse_gcs_prefix(prefix: str, *, field_name: str = "gcs_prefix") -> tuple[st
     return bucket, path
 
 
+_COMPRESSION_SUFFIXES = {"gzip": "gz", "zstd": "zst"}
+_SHARD_SUFFIX = re.compile(r"-\d+$")
+
+
+def _output_blob_name(path: str, filename: str, file_type: str) -> str:
+    clean_filename = filename.strip() or "part-00000"
+    clean_file_type = file_type.strip().lstrip(".") or "json"
+    return f"{path.rstrip('/')}/{clean_filename}.{clean_file_type}"
+
+
+def encode_jsonl(
+    items: Iterable[dict[str, Any]], *, float_precision: int | None = None
+) -> str:
+    """
+    Encode items as newline-terminated JSON lines.
+    With `float_precision`, datapoint records are encoded by the vectorized
+    encoder in functions/utils/jsonl.py instead of per-item `json.dumps`.
+    """
+    if float_precision is not None:
+        items = list(items)
+        if is_datapoint_batch(items):
+            return encode_datapoints_jsonl(items, precision=float_precision)
+    return "".join(
+        json.dumps(item, ensure_ascii=True, default=_json_default) + "\n"
+        for item in items
+    )
+
+
+def _compress(payload: bytes, compression: str | None) -> bytes:
+    if not compression:
+        return payload
+    if compression == "gzip":
+        return gzip.compress(payload, compresslevel=6)
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError as exc:
+            raise ValueError("compression 'zstd' requires the zstandard package") from exc
+        return zstandard.ZstdCompressor(level=3).compress(payload)
+    raise ValueError(f"Unsupported compression `{compression}`. Supported: gzip, zstd")
+
+
+def _zstandard() -> Any:
+    try:
+        import zstandard
+    except ImportError as exc:
+        raise ValueError("Reading .zst files requires the zstandard package") from exc
+    return zstandard
+
+
+def _decompress_chunks(chunks: Iterable[bytes], suffix: str) -> Iterator[bytes]:
+    if suffix == "gz":
+        # gzip files may hold several members back to back.
+        decoder = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        for chunk in chunks:
+            while chunk:
+                yield decoder.decompress(chunk)
+                if not decoder.eof:
+                    break
+                chunk = decoder.unused_data
+                decoder = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        yield decoder.flush()
+        return
+    if suffix == "zst":
+        decoder = _zstandard().ZstdDecompressor().decompressobj()
+        for chunk in chunks:
+            yield decoder.decompress(chunk)
+        return
+    yield from chunks
+
+
+class ShardedGCSWriter:
+    """
+    Write items to GCS as rolling shards (`part-00000`, `part-00001`, ...).
+    A shard is cut once it reaches `max_rows_per_shard` rows or `max_bytes_per_shard`
+    encoded bytes (0 disables a limit). An output that fits in one shard is written
+    to exactly `filename`; the `-NNNNN` names are only used once a second shard is
+    cut, so the first shard is held back until then. Shards are optionally
+    compressed and uploaded on a bounded thread pool while the next shard is
+    filled, so at most `upload_concurrency + 2` shards are held in memory.
+    """
+
+    def __init__(
+        self,
+        gcs_prefix: str,
+        *,
+        filename: str = "part-00000",
+        file_type: str = "json",
+        vector_dtype: str = "float32",
+        float_precision: int | None = None,
+        compression: str | None = None,
+        max_rows_per_shard: int = 0,
+        max_bytes_per_shard: int = 0,
+        upload_concurrency: int = 4,
+        first_shard: int = 0,
+        previous_shards: list[dict[str, Any]] | None = None,
+    ) -> None:
+        self.bucket_name, self.path = parse_gcs_prefix(
+            gcs_prefix, field_name="gcs_output_prefix"
+        )
+        self.file_type = file_type.strip().lstrip(".").lower() or "json"
+        if self.file_type not in {"json", "npz"}:
+            raise ValueError(f"Unsupported output file_type `{file_type}`. Supported: json, npz")
+        if compression and compression not in _COMPRESSION_SUFFIXES:
+            raise ValueError(f"Unsupported compression `{compression}`. Supported: gzip, zstd")
+        self.vector_dtype = vector_dtype
+        self.float_precision = float_precision
+        self.compression = compression or None
+        self.max_rows = int(max_rows_per_shard or 0)
+        self.max_bytes = int(max_bytes_per_shard or 0)
+        self.sharded = bool(self.max_rows or self.max_bytes)
+        clean_filename = filename.strip() or "part-00000"
+        self.filename = clean_filename
+        self.shard_base = _SHARD_SUFFIX.sub("", clean_filename) or "part"
+        self.next_shard = int(first_shard)
+
+        self._bucket = get_storage_client().bucket(self.bucket_name)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(upload_concurrency)))
+        self._slots = threading.BoundedSemaphore(max(1, int(upload_concurrency)) + 1)
+        self._futures: list[Future] = []
+        self._chunks: list[str] = []
+        self._items: list[dict[str, Any]] = []
+        self._rows = 0
+        self._bytes = 0
+        self._held: tuple[dict[str, Any], bytes, str] | None = None
+        # Shards uploaded by an earlier, interrupted run are carried into the manifest.
+        self.shards: list[dict[str, Any]] = [dict(shard) for shard in previous_shards or []]
+        self._previous = len(self.shards)
+
+    def write(self, items: Iterable[dict[str, Any]]) -> None:
+        if self.file_type == "json":
+            # Encode in batches that never run past the current shard's row limit.
+            batch: list[dict[str, Any]] = []
+            for item in items:
+                batch.append(item)
+                limit = 1024
+                if self.max_rows:
+                    limit = min(limit, self.max_rows - self._rows)
+                if len(batch) >= limit:
+                    self.write_encoded(
+                        encode_jsonl(batch, float_precision=self.float_precision), len(batch)
+                    )
+                    batch = []
+            if batch:
+                self.write_encoded(
+                    encode_jsonl(batch, float_precision=self.float_precision), len(batch)
+                )
+            return
+        for item in items:
+            self._items.append(item)
+            self._rows += 1
+            embedding = item.get("embedding")
+            if isinstance(embedding, np.ndarray):
+                self._bytes += embedding.nbytes
+            elif embedding is not None:
+                self._bytes += len(embedding) * 4
+            self._maybe_cut()
+
+    def write_encoded(self, payload: str, row_count: int) -> None:
+        """
+        Append already-encoded JSON lines; shards are cut on chunk boundaries.
+        """
+        if self.file_type != "json":
+            raise ValueError("write_encoded is only supported for file_type 'json'")
+        self._chunks.append(payload)
+        self._rows += row_count
+        self._bytes += len(payload)
+        self._maybe_cut()
+
+    def _maybe_cut(self) -> None:
+        if not self.sharded:
+            return
+        if (self.max_rows and self._rows >= self.max_rows) or (
+            self.max_bytes and self._bytes >= self.max_bytes
+        ):
+            self._flush()
+
+    def _shard_uri(self, name: str) -> str:
+        blob_name = _output_blob_name(self.path, name, self.file_type)
+        if self.compression:
+            blob_name = f"{blob_name}.{_COMPRESSION_SUFFIXES[self.compression]}"
+        return f"gs://{self.bucket_name}/{blob_name}"
+
+    def _flush(self, *, final: bool = False) -> None:
+        held, self._held = self._held, None
+        # A fresh write whose output is one shard keeps the exact `filename`.
+        single = final and held is None and not self.shards and self.next_shard == 0
+        if not self._rows:
+            if held is not None:
+                if final:
+                    held[0]["uri"] = self._shard_uri(self.filename)
+                self._submit(*held)
+            return
+        if self.file_type == "npz":
+            payload = encode_datapoints_npz(self._items, vector_dtype=self.vector_dtype)
+            content_type = "application/octet-stream"
+        else:
+            payload = "".join(self._chunks).encode("utf-8")
+            content_type = "application/json"
+        name = (
+            self.filename
+            if single or not self.sharded
+            else f"{self.shard_base}-{self.next_shard:05d}"
+        )
+        shard = {
+            "uri": self._shard_uri(name),
+            "shard": self.next_shard,
+            "row_count": self._rows,
+        }
+        self.next_shard += 1
+        self._chunks, self._items, self._rows, self._bytes = [], [], 0, 0
+
+        if held is not None:
+            self._submit(*held)
+        elif self.sharded and not final and not self.shards and shard["shard"] == 0:
+            # Not yet known whether a second shard follows, and so how to name this one.
+            self._held = (shard, payload, content_type)
+            return
+        self._submit(shard, payload, content_type)
+
+    def _submit(self, shard: dict[str, Any], payload: bytes, content_type: str) -> None:
+        self._raise_failed_upload()
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._upload, shard, payload, content_type)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+        self.shards.append(shard)
+
+    def _raise_failed_upload(self) -> None:
+        for future in self._futures:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+
+    def _upload(self, shard: dict[str, Any], payload: bytes, content_type: str) -> None:
+        data = _compress(payload, self.compression)
+        blob = self._bucket.blob(shard["uri"].removeprefix(f"gs://{self.bucket_name}/"))
+        # upload_from_file switches to a resumable upload above 8 MB.
+        call_with_retry(
+            lambda: blob.upload_from_file(
+                BytesIO(data), size=len(data), content_type=content_type
+            )
+        )
+        shard["bytes"] = len(data)
+
+    def completed_shards(self) -> list[dict[str, Any]]:
+        """
+        Shards whose upload has finished, in order, up to the first one still in flight.
+        """
+        completed = [dict(shard) for shard in self.shards[: self._previous]]
+        for shard, future in zip(self.shards[self._previous :], self._futures):
+            if not future.done() or future.cancelled() or future.exception() is not None:
+                break
+            completed.append(dict(shard))
+        return completed
+
+    def close(self) -> dict[str, Any]:
+        """
+        Flush the last shard, wait for all uploads, and return the shard manifest.
+        """
+        try:
+            self._flush(final=True)
+            for future in self._futures:
+                future.result()
+        finally:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+        return {
+            "gcs_output_prefix": f"gs://{self.bucket_name}/{self.path.rstrip('/')}",
+            "file_type": self.file_type,
+            "compression": self.compression,
+            "files": [shard["uri"] for shard in self.shards],
+            "shards": self.shards,
+            "row_count": sum(shard["row_count"] for shard in self.shards),
+            "bytes": sum(shard.get("bytes", 0) for shard in self.shards),
+        }
+
+    def abort(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
 def write_to_gcs(
     gcs_prefix: str,
-    items: list[dict[str, Any]],
+    items: Iterable[dict[str, Any]],
     *,
     filename: str = "part-00000",
     file_type: str = "json",
-) -> str:
+    vector_dtype: str = "float32",
+    float_precision: int | None = None,
+    compression: str | None = None,
+    max_rows_per_shard: int = 0,
+    max_bytes_per_shard: int = 0,
+    upload_concurrency: int = 4,
+) -> dict[str, Any]:
     """
-    Write items to GCS as a single file.
+    Write items to GCS and return the manifest of written files.
+    `json` writes JSON lines (Vertex batch import format); `npz` writes the binary
+    datapoint format with vectors stored as one float32/float16 block. Without
+    shard limits a single file is written.
     """
-    bucket_name, path = parse_gcs_prefix(gcs_prefix, field_name="gcs_output_prefix")
-
-    clean_filename = filename.strip() or "part-00000"
-    clean_file_type = file_type.strip().lstrip(".") or "json"
-    blob_name = f"{path.rstrip('/')}/{clean_filename}.{clean_file_type}"
-    payload = (
-        "\n".join(json.dumps(item, ensure_ascii=True, default=_json_default) for item in items)
-        + "\n"
+    writer = ShardedGCSWriter(
+        gcs_prefix,
+        filename=filename,
+        file_type=file_type,
+        vector_dtype=vector_dtype,
+        float_precision=float_precision,
+        compression=compression,
+        max_rows_per_shard=max_rows_per_shard,
+        max_bytes_per_shard=max_bytes_per_shard,
+        upload_concurrency=upload_concurrency,
     )
-
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    bucket.blob(blob_name).upload_from_string(payload, content_type="application/json")
-
-    return f"gs://{bucket_name}/{blob_name}"
+    try:
+        writer.write(items)
+        return writer.close()
+    except BaseException:
+        writer.abort()
+        raise
 
 
 def _json_default(value: Any) -> Any:
     if isinstance(value, (datetime, date, time)):
         return value.isoformat()
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
     return str(value)
 
 
-def load_data_from_gcs_prefix(
+_READ_CHUNK_BYTES = 4 * 1024 * 1024
+_READ_BUFFER_CHUNKS = 4
+_LOADABLE_TYPES = ("json", "txt", "npy", "npz")
+
+
+def _split_blob_name(name: str) -> tuple[str, str]:
+    # Returns (file type, compression suffix) for names like `part-00000.json.gz`.
+    suffix = name.rsplit(".", 1)[-1].lower() if "." in name else ""
+    compression = suffix if suffix in {"gz", "zst"} else ""
+    if compression:
+        name = name[: -len(suffix) - 1]
+    ext = name.rsplit(".", 1)[-1].lower() if "." in name else ""
+    return ext, compression
+
+
+def _iter_blob_bytes(blob: Any, *, chunk_size: int = _READ_CHUNK_BYTES) -> Iterator[bytes]:
+    """
+    Yield the stored bytes of a listed blob as ranged downloads of `chunk_size`.
+    Listed blobs carry their generation, so every range reads the same object version.
+    """
+    size = blob.size
+    if size is None or getattr(blob, "content_encoding", None) == "gzip":
+        # Ranged reads do not apply to objects that GCS decompresses on download.
+        yield call_with_retry(blob.download_as_bytes)
+        return
+    for start in range(0, size, chunk_size):
+        end = min(start + chunk_size, size) - 1
+        yield call_with_retry(lambda: blob.download_as_bytes(start=start, end=end))
+
+
+def _read_blob(blob: Any, cache: BlobCache | None) -> Iterator[bytes]:
+    # Listed blobs carry their generation, so a cached copy is always the current version.
+    generation = getattr(blob, "generation", None)
+    if cache is None or generation is None:
+        return _iter_blob_bytes(blob)
+    path = cache.get_path(blob.bucket.name, blob.name, generation)
+    if path is not None:
+        return iter_file_chunks(path, chunk_size=_READ_CHUNK_BYTES)
+    return cache.store(blob.bucket.name, blob.name, generation, _iter_blob_bytes(blob))
+
+
+def _iter_lines(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    pending = b""
+    for chunk in chunks:
+        if not chunk:
+            continue
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        yield from lines
+    if pending:
+        yield pending
+
+
+def _iter_json_records(chunks: Iterable[bytes], uri: str) -> Iterator[Any]:
+    lines = _iter_lines(chunks)
+    parsed_any = False
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as exc:
+            if parsed_any:
+                raise ValueError(f"Invalid JSON on line {number} of {uri}: {exc.msg}") from exc
+            # Not JSON lines: parse the rest of the file as one JSON document.
+            parsed = json.loads(b"\n".join([line, *lines]))
+            if isinstance(parsed, list):
+                yield from parsed
+            else:
+                yield parsed
+            return
+        parsed_any = True
+        yield record
+
+
+def _open_whole_file(
+    blob: Any, cache: BlobCache | None, compression: str
+) -> Iterator[bytes | Path]:
+    # Array files are parsed as a whole. An uncompressed file in the blob cache is
+    # handed out as its local path so it can be memory-mapped instead of read.
+    generation = getattr(blob, "generation", None)
+    if cache is not None and generation is not None and not compression:
+        path = cache.get_path(blob.bucket.name, blob.name, generation)
+        if path is None:
+            for _ in cache.store(blob.bucket.name, blob.name, generation, _iter_blob_bytes(blob)):
+                pass
+            path = cache.get_path(blob.bucket.name, blob.name, generation)
+        if path is not None:
+            yield path
+            return
+    yield b"".join(_decompress_chunks(_read_blob(blob, cache), compression))
+
+
+def _map_file(path: Path) -> mmap.mmap:
+    with path.open("rb") as fp:
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _iter_blob_records(
+    uri: str, target_type: str, chunks: Iterable[bytes | Path]
+) -> Iterator[Any]:
+    if target_type == "json":
+        yield from _iter_json_records(chunks, uri)
+    elif target_type == "txt":
+        for line in _iter_lines(chunks):
+            text = line.decode("utf-8").strip()
+            if text:
+                yield text
+    elif target_type in {"npy", "npz"}:
+        for source in chunks:
+            # Arrays are views into the mapped cache file or the downloaded bytes.
+            buffer = _map_file(source) if isinstance(source, Path) else source
+            if target_type == "npy":
+                yield npy_view(buffer)
+            else:
+                yield from decode_datapoints_npz(buffer)
+
+
+def _prefetched(
+    blobs: Iterable[Any],
+    open_chunks: Callable[[Any], Iterator[bytes | Path]],
+    *,
+    prefetch: int,
+) -> Iterator[tuple[Any, Iterator[bytes | Path]]]:
+    # Up to `prefetch` blobs download at once, each into its own bounded buffer;
+    # they are handed out in listing order.
+    window: deque[tuple[Any, BackgroundIterator]] = deque()
+    remaining = iter(blobs)
+    try:
+        while True:
+            while len(window) < prefetch:
+                blob = next(remaining, None)
+                if blob is None:
+                    break
+                window.append(
+                    (blob, BackgroundIterator(open_chunks(blob), maxsize=_READ_BUFFER_CHUNKS))
+                )
+            if not window:
+                return
+            blob, chunks = window.popleft()
+            try:
+                yield blob, chunks
+            finally:
+                chunks.close()
+    finally:
+        for _, chunks in window:
+            chunks.close()
+
+
+def iter_data_from_gcs_prefix(
     gcs_prefix: str,
     *,
     field_name: str = "gcs_prefix",
     file_type: str = "json",
-) -> list[Any]:
+    prefetch: int = 4,
+    batch_size: int | None = None,
+    cache: BlobCache | None = None,
+) -> Iterator[Any]:
     """
-    Load data items from GCS prefix. 
-    Supports json, txt, and npy file types. 
+    Stream data items from the files under a GCS prefix, in blob-name order.
+    Up to `prefetch` files download concurrently in ranged chunks, and JSON/text
+    lines are parsed as chunks arrive, so memory stays bounded by the prefetch
+    window instead of the prefix size. With `batch_size`, lists of up to that
+    many items are yielded instead of single items. With `cache`, files are read
+    from (and added to) the local blob cache.
+    Each npy file is yielded as one read-only array, and npz datapoint embeddings
+    are row views; both are memory-mapped when the file is in the blob cache.
+    Pickled object arrays are not loaded.
     """
-    supported = {"json", "txt", "npy"}
     target_type = file_type.strip().lstrip(".").lower() or "json"
+    if target_type not in _LOADABLE_TYPES:
+        raise ValueError(f"Unsupported file_type `{file_type}`. Supported: json, txt, npy, npz")
 
-    # Validate file type
-    if target_type not in supported:
-        raise ValueError(f"Unsupported file_type `{file_type}`. Supported: json, txt, npy")
-
-    # Parse GCS prefix
     bucket_name, prefix = parse_gcs_prefix(gcs_prefix, field_name=field_name)
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
+    bucket = get_storage_client().bucket(bucket_name)
+    blobs = (
+        blob
+        for blob in bucket.list_blobs(prefix=prefix.rstrip("/") + "/")
+        if not blob.name.endswith("/") and _split_blob_name(blob.name)[0] == target_type
+    )
 
-    # Load items
-    items: list[Any] = []
-    for blob in bucket.list_blobs(prefix=prefix.rstrip("/") + "/"):
-        if blob.name.endswith("/"):
-            continue
-        ext = blob.name.rsplit(".", 1)[-1].lower() if "." in blob.name else ""
-        if ext != target_type:
-            continue
+    def _open_chunks(blob: Any) -> Iterator[bytes | Path]:
+        compression = _split_blob_name(blob.name)[1]
+        if target_type in {"npy", "npz"}:
+            return _open_whole_file(blob, cache, compression)
+        return _decompress_chunks(_read_blob(blob, cache), compression)
 
-        # Load based on file type
-        if target_type == "json":
-            content = blob.download_as_text()
-            for line in content.splitlines():
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    items.append(json.loads(line))
-                except json.JSONDecodeError:
-                    # Fall back to whole-file JSON parse if not jsonl.
-                    parsed = json.loads(content)
-                    if isinstance(parsed, list):
-                        items.extend(parsed)
-                    else:
-                        items.append(parsed)
-                    break
-            continue
+    def _items() -> Iterator[Any]:
+        for blob, chunks in _prefetched(blobs, _open_chunks, prefetch=max(1, int(prefetch))):
+            yield from _iter_blob_records(f"gs://{bucket_name}/{blob.name}", target_type, chunks)
 
-        if target_type == "txt":
-            content = blob.download_as_text()
-            for line in content.splitlines():
-                line = line.strip()
-                if line:
-                    items.append(line)
-            continue
+    if not batch_size:
+        yield from _items()
+        return
+    batch: list[Any] = []
+    for item in _items():
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
-        if target_type == "npy":
-            raw = blob.download_as_bytes()
-            array = np.load(BytesIO(raw), allow_pickle=True)
-            items.append(array.tolist())
-            continue
 
-    return items
+def load_data_from_gcs_prefix(
+    gcs_prefix: str,
+    *,
+    field_name: str = "gcs_prefix",
+    file_type: str = "json",
+    cache: BlobCache | None = None,
+) -> list[Any]:
+    """
+    Load data items from GCS prefix.
+    Supports json, txt, npy and npz file types.
+    npy files are returned as arrays and npz files are datapoint files written by
+    `write_to_gcs` whose embeddings are float array views instead of lists.
+    """
+    return list(
+        iter_data_from_gcs_prefix(
+            gcs_prefix, field_name=field_name, file_type=file_type, cache=cache
+        )
+    )
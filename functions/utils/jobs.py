@@ -0,0 +1,299 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Protocol
+
+from api.exceptions import PipelineException
+from functions.utils.logging import get_logger
+
+logger = get_logger(__name__)
+
+QUEUED = "QUEUED"
+RUNNING = "RUNNING"
+SUCCEEDED = "SUCCEEDED"
+FAILED = "FAILED"
+CANCELLED = "CANCELLED"
+FINISHED_STATUSES = {SUCCEEDED, FAILED, CANCELLED}
+
+
+class JobCancelled(PipelineException):
+    def __init__(self, job_id: str) -> None:
+        super().__init__(f"Job {job_id} was cancelled", status_code=409)
+
+
+class JobStore(Protocol):
+    def create(self, job: dict[str, Any]) -> None: ...
+
+    def get(self, job_id: str) -> dict[str, Any] | None: ...
+
+    def update(self, job_id: str, **fields: Any) -> None: ...
+
+
+_JSON_FIELDS = ("progress", "result")
+_COLUMNS = (
+    "job_id",
+    "kind",
+    "status",
+    "progress",
+    "result",
+    "error",
+    "cancel_requested",
+    "created_at",
+    "started_at",
+    "finished_at",
+)
+
+
+class SQLiteJobStore:
+    """
+    Job records in a local SQLite file. API workers on the same host share the
+    file, so any of them can report on or cancel a job started by another.
+    """
+
+    def __init__(self, path: str) -> None:
+        db_path = Path(path).expanduser()
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, "
+            "progress TEXT, result TEXT, error TEXT, "
+            "cancel_requested INTEGER NOT NULL DEFAULT 0, "
+            "created_at TEXT, started_at TEXT, finished_at TEXT)"
+        )
+        self._conn.commit()
+
+    def create(self, job: dict[str, Any]) -> None:
+        record = self._encode(job)
+        columns = [column for column in _COLUMNS if column in record]
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO jobs ({', '.join(columns)}) "
+                f"VALUES ({', '.join('?' * len(columns))})",
+                [record[column] for column in columns],
+            )
+            self._conn.commit()
+
+    def get(self, job_id: str) -> dict[str, Any] | None:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(_COLUMNS, row))
+        for field in _JSON_FIELDS:
+            job[field] = json.loads(job[field]) if job[field] else None
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        return job
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        record = self._encode(fields)
+        unknown = set(record) - set(_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown job fields: {', '.join(sorted(unknown))}")
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE jobs SET {', '.join(f'{column} = ?' for column in record)} "
+                "WHERE job_id = ?",
+                [*record.values(), job_id],
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def _encode(fields: dict[str, Any]) -> dict[str, Any]:
+        record = dict(fields)
+        for field in _JSON_FIELDS:
+            if record.get(field) is not None:
+                record[field] = json.dumps(record[field], ensure_ascii=True, default=str)
+        if "cancel_requested" in record:
+            record["cancel_requested"] = int(bool(record["cancel_requested"]))
+        return record
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class JobProgress:
+    """
+    Progress reporter handed to a running job. `set` overwrites counters and `add`
+    increments them; both are safe to call from worker threads. Writes to the
+    store (and the cancellation check) are throttled to `interval` seconds, and a
+    cancelled job raises `JobCancelled` from the next call.
+    """
+
+    def __init__(self, store: JobStore, job_id: str, *, interval: float = 1.0) -> None:
+        self.store = store
+        self.job_id = job_id
+        self.interval = float(interval)
+        self.counters: dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._flushed_at = 0.0
+        self._cancelled = False
+
+    def set(self, **values: Any) -> None:
+        with self._lock:
+            self.counters.update(values)
+        self._maybe_flush()
+
+    def add(self, **increments: int) -> None:
+        with self._lock:
+            for key, value in increments.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+        self._maybe_flush()
+
+    def check_cancelled(self) -> None:
+        if self._cancelled:
+            raise JobCancelled(self.job_id)
+        job = self.store.get(self.job_id)
+        if job and job["cancel_requested"]:
+            self._cancelled = True
+            raise JobCancelled(self.job_id)
+
+    def flush(self) -> None:
+        with self._lock:
+            counters = dict(self.counters)
+            self._flushed_at = time.monotonic()
+        self.store.update(self.job_id, progress=counters)
+
+    def _maybe_flush(self) -> None:
+        if time.monotonic() - self._flushed_at < self.interval:
+            if self._cancelled:
+                raise JobCancelled(self.job_id)
+            return
+        self.flush()
+        self.check_cancelled()
+
+
+class JobRunner:
+    """
+    Run long requests as background jobs on a bounded thread pool. At most
+    `max_workers` jobs run at once and at most `max_pending` more wait in the queue.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        *,
+        max_workers: int = 2,
+        max_pending: int = 100,
+        progress_interval: float = 1.0,
+    ) -> None:
+        self.store = store
+        self.max_workers = max(1, int(max_workers))
+        self.max_pending = max(0, int(max_pending))
+        self.progress_interval = float(progress_interval)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="job"
+        )
+        self._lock = threading.Lock()
+        self._futures: dict[str, Future] = {}
+
+    def submit(self, kind: str, fn: Callable[[JobProgress], dict[str, Any]]) -> dict[str, Any]:
+        with self._lock:
+            active = [future for future in self._futures.values() if not future.done()]
+            if len(active) >= self.max_workers + self.max_pending:
+                raise PipelineException(
+                    "Too many background jobs are queued; retry later", status_code=429
+                )
+            job_id = uuid.uuid4().hex
+            self.store.create(
+                {"job_id": job_id, "kind": kind, "status": QUEUED, "created_at": _now()}
+            )
+            future = self._executor.submit(self._run, job_id, fn)
+            self._futures[job_id] = future
+        future.add_done_callback(lambda _: self._forget(job_id))
+        return self.store.get(job_id)
+
+    def cancel(self, job_id: str) -> dict[str, Any]:
+        job = self.store.get(job_id)
+        if job is None:
+            raise PipelineException(f"Job `{job_id}` not found", status_code=404)
+        if job["status"] in FINISHED_STATUSES:
+            return job
+        # Running jobs see the flag through their progress reporter, also when the
+        # job runs in another API worker that shares the store.
+        self.store.update(job_id, cancel_requested=True)
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None and future.cancel():
+            self.store.update(job_id, status=CANCELLED, finished_at=_now())
+        return self.store.get(job_id)
+
+    def _forget(self, job_id: str) -> None:
+        with self._lock:
+            self._futures.pop(job_id, None)
+
+    def _run(self, job_id: str, fn: Callable[[JobProgress], dict[str, Any]]) -> None:
+        progress = JobProgress(self.store, job_id, interval=self.progress_interval)
+        try:
+            progress.check_cancelled()
+            self.store.update(job_id, status=RUNNING, started_at=_now())
+            result = fn(progress)
+        except JobCancelled:
+            self.store.update(
+                job_id, status=CANCELLED, progress=progress.counters, finished_at=_now()
+            )
+        except PipelineException as exc:
+            self.store.update(
+                job_id,
+                status=FAILED,
+                progress=progress.counters,
+                error=exc.message,
+                finished_at=_now(),
+            )
+        except Exception as exc:
+            logger.exception("Job %s failed", job_id)
+            self.store.update(
+                job_id,
+                status=FAILED,
+                progress=progress.counters,
+                error=str(exc),
+                finished_at=_now(),
+            )
+        else:
+            self.store.update(
+                job_id,
+                status=SUCCEEDED,
+                progress=progress.counters,
+                result=result,
+                finished_at=_now(),
+            )
+
+
+@lru_cache(maxsize=None)
+def _runner_instance(
+    path: str, max_workers: int, max_pending: int, progress_interval: float
+) -> JobRunner:
+    return JobRunner(
+        SQLiteJobStore(path),
+        max_workers=max_workers,
+        max_pending=max_pending,
+        progress_interval=progress_interval,
+    )
+
+
+def get_job_runner(config: dict[str, Any]) -> JobRunner:
+    """
+    Return the process-wide job runner configured in the `jobs` section.
+    """
+    settings = config.get("jobs") or {}
+    backend = (settings.get("backend") or "sqlite").lower()
+    if backend != "sqlite":
+        raise ValueError("jobs.backend must be 'sqlite'")
+    return _runner_instance(
+        str(settings.get("path") or "/tmp/items_pipeline/jobs.sqlite"),
+        int(settings.get("max_workers") or 2),
+        int(settings.get("max_pending") or 100),
+        float(settings.get("progress_interval_seconds") or 1.0),
+    )
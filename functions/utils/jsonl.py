@@ -0,0 +1,124 @@
+import json
+from collections.abc import Sequence
+from typing import Any
+
+import numpy as np
+
+DATAPOINT_KEYS = ("id", "embedding", "restricts", "numeric_restricts")
+_ROW_CHUNK = 1024
+
+
+def _json_fallback(value: Any) -> Any:
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    return str(value)
+
+
+def _format_vector_chunk(mat: np.ndarray, precision: int) -> list[bytes]:
+    n, d = mat.shape
+    finite = np.isfinite(mat)
+    scale = 10**precision
+    scaled = np.rint(np.abs(np.where(finite, mat, 0.0)) * scale).astype(np.int64)
+    int_part = scaled // scale
+    frac = scaled % scale
+    fits = finite.all(axis=1) & (int_part < 10).all(axis=1)
+
+    # Every number is laid out as [sign][digit][.][precision digits][,] and the
+    # bytes that are not needed (plus sign, trailing zeros, last comma) are masked
+    # out, so the whole chunk is formatted without per-float Python objects.
+    width = precision + 4
+    chars = np.empty((n, d, width), dtype=np.uint8)
+    keep = np.ones((n, d, width), dtype=bool)
+    chars[..., 0] = ord("-")
+    keep[..., 0] = (mat < 0) & (scaled > 0)
+    chars[..., 1] = np.minimum(int_part, 9).astype(np.uint8) + ord("0")
+    chars[..., 2] = ord(".")
+    significant = np.zeros((n, d), dtype=bool)
+    for pos in range(precision - 1, -1, -1):
+        digit = (frac // 10 ** (precision - 1 - pos)) % 10
+        chars[..., 3 + pos] = digit.astype(np.uint8) + ord("0")
+        significant |= digit != 0
+        keep[..., 3 + pos] = significant if pos else True
+    chars[..., -1] = ord(",")
+    keep[:, -1, -1] = False
+
+    flat = chars[keep].tobytes()
+    ends = np.cumsum(keep.reshape(n, -1).sum(axis=1))
+    starts = np.concatenate(([0], ends[:-1]))
+    rows = [b"[" + flat[start:end] + b"]" for start, end in zip(starts, ends)]
+    for idx in np.flatnonzero(~fits):
+        # Rare rows (|v| >= 10, NaN/inf) fall back to the exact json.dumps output.
+        rows[idx] = json.dumps(mat[idx].tolist()).encode("ascii")
+    return rows
+
+
+def format_vectors(vectors: np.ndarray, *, precision: int = 8) -> list[bytes]:
+    """
+    Format each row of a float matrix as a JSON number array with at most
+    `precision` decimals, vectorized over the whole matrix.
+    """
+    mat = np.asarray(vectors)
+    if mat.ndim != 2:
+        raise ValueError("format_vectors expects a 2D array")
+    precision = int(precision)
+    if not 1 <= precision <= 15:
+        raise ValueError("precision must be between 1 and 15")
+    if mat.shape[1] == 0:
+        return [b"[]"] * mat.shape[0]
+    mat = mat.astype(np.float64, copy=False)
+    rows: list[bytes] = []
+    for start in range(0, mat.shape[0], _ROW_CHUNK):
+        rows.extend(_format_vector_chunk(mat[start : start + _ROW_CHUNK], precision))
+    return rows
+
+
+def is_datapoint_batch(items: Sequence[dict[str, Any]]) -> bool:
+    if not items:
+        return False
+    keys = tuple(items[0].keys())
+    if "embedding" not in keys or not set(keys) <= set(DATAPOINT_KEYS):
+        return False
+    return all(tuple(item.keys()) == keys for item in items)
+
+
+def encode_datapoints_jsonl(
+    items: Sequence[dict[str, Any]],
+    *,
+    precision: int = 8,
+    vectors: np.ndarray | None = None,
+) -> str:
+    """
+    Encode datapoint records (id, embedding, restricts, numeric_restricts) as
+    Vertex-compatible JSON lines. Embeddings are formatted in bulk from `vectors`
+    (or the stacked item embeddings) and spliced between the per-row id and
+    restrict fragments.
+    """
+    if not items:
+        return ""
+    if vectors is None:
+        vectors = np.asarray([item["embedding"] for item in items], dtype=np.float32)
+    if len(vectors) != len(items):
+        raise ValueError("vectors must have one row per item")
+    keys = [key for key in DATAPOINT_KEYS if key in items[0]]
+    prefixes = [
+        ("{" if pos == 0 else ", ").encode("ascii") + json.dumps(key).encode("ascii") + b": "
+        for pos, key in enumerate(keys)
+    ]
+    formatted = format_vectors(vectors, precision=precision)
+
+    lines: list[bytes] = []
+    for item, vector in zip(items, formatted):
+        parts: list[bytes] = []
+        for prefix, key in zip(prefixes, keys):
+            parts.append(prefix)
+            if key == "embedding":
+                parts.append(vector)
+            else:
+                parts.append(
+                    json.dumps(item[key], ensure_ascii=True, default=_json_fallback).encode(
+                        "ascii"
+                    )
+                )
+        parts.append(b"}\n")
+        lines.append(b"".join(parts))
+    return b"".join(lines).decode("ascii")
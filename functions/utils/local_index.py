@@ -0,0 +1,493 @@
+import json
+import threading
+from collections.abc import Iterable
+from typing import Any
+
+import numpy as np
+from google.cloud.aiplatform.matching_engine.matching_engine_index_endpoint import (
+    MatchNeighbor,
+    Namespace,
+    NumericNamespace,
+)
+
+from functions.utils.blob_cache import get_blob_cache
+from functions.utils.gcs import iter_data_from_gcs_prefix
+
+DISTANCE_MEASURES = ("DOT_PRODUCT", "COSINE", "L2_NORM")
+INDEX_TYPES = ("exact", "ivf")
+QUANTIZATIONS = ("none", "float16", "int8")
+
+# Rows converted and scored per block; blocks this size stay in cache while
+# quantized rows are widened to float32.
+_BLOCK_ROWS = 8192
+# Queries scored together against each block of an exact index.
+_QUERY_CHUNK = 16
+_LOAD_CHUNK_ROWS = 65536
+
+
+class LocalIndex:
+    """
+    In-process vector index over datapoint files written by `embed_data`, with the
+    `find_neighbors` interface of a deployed index endpoint. `exact` scores every
+    vector; `ivf` clusters vectors into `nlist` k-means lists and scores only the
+    `nprobe` lists closest to the query. Vectors are kept as float32 or quantized
+    to float16 or int8 (per-dimension scale). Namespace filters follow Vector
+    Search: a datapoint must hold one of the allow tokens of every filtered
+    namespace and none of its deny tokens.
+    """
+
+    def __init__(
+        self,
+        ids: list[str],
+        vectors: np.ndarray,
+        restricts: list[list[dict[str, Any]]],
+        numeric_restricts: list[list[dict[str, Any]]],
+        *,
+        distance_measure: str = "DOT_PRODUCT",
+        index_type: str = "exact",
+        quantization: str = "none",
+        nlist: int = 0,
+        nprobe: int = 8,
+        seed: int = 0,
+    ) -> None:
+        if distance_measure not in DISTANCE_MEASURES:
+            raise ValueError(
+                f"Unsupported distance_measure_type `{distance_measure}`. "
+                f"Supported: {', '.join(DISTANCE_MEASURES)}"
+            )
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unsupported index_type `{index_type}`. Supported: exact, ivf")
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(
+                f"Unsupported quantization `{quantization}`. Supported: none, float16, int8"
+            )
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or not len(vectors) or len(vectors) != len(ids):
+            raise ValueError("Local index needs one embedding of the same dimension per id")
+
+        self.distance_measure = distance_measure
+        self.index_type = index_type
+        self.quantization = quantization
+        if distance_measure == "COSINE":
+            vectors = _unit_rows(vectors)
+
+        self.offsets = np.asarray([0, len(vectors)], dtype=np.int64)
+        self.centroids: np.ndarray | None = None
+        row_lists: np.ndarray | None = None
+        if index_type == "ivf":
+            nlist = int(nlist) or max(1, int(np.sqrt(len(vectors))))
+            self.centroids = _kmeans(vectors, min(nlist, len(vectors)), seed=seed)
+            lists = _nearest_centroids(vectors, self.centroids)
+            # Rows are stored list by list, so every probed list is one contiguous slice.
+            order = np.argsort(lists, kind="stable")
+            vectors = vectors[order]
+            ids = [ids[row] for row in order]
+            restricts = [restricts[row] for row in order]
+            numeric_restricts = [numeric_restricts[row] for row in order]
+            row_lists = lists[order]
+            self.offsets = np.concatenate(
+                [[0], np.cumsum(np.bincount(lists, minlength=len(self.centroids)))]
+            ).astype(np.int64)
+        self.nprobe = max(1, int(nprobe))
+        # Quantized IVF rows store their offset from the list centroid: offsets span
+        # a much smaller range than the vectors, so the codes keep more precision.
+        self.residuals = row_lists is not None and quantization != "none"
+        if self.residuals:
+            for start in range(0, len(vectors), _BLOCK_ROWS):
+                vectors[start : start + _BLOCK_ROWS] -= self.centroids[
+                    row_lists[start : start + _BLOCK_ROWS]
+                ]
+
+        self.ids = np.asarray(ids, dtype=np.str_)
+        self.dimension = int(vectors.shape[1])
+        self.scale: np.ndarray | None = None
+        if quantization == "int8":
+            self.scale = np.maximum(np.abs(vectors).max(axis=0), 1e-12) / 127.0
+            self.vectors = np.empty(vectors.shape, dtype=np.int8)
+            for start in range(0, len(vectors), _BLOCK_ROWS):
+                block = vectors[start : start + _BLOCK_ROWS] / self.scale
+                np.rint(block, out=block)
+                np.clip(block, -127, 127, out=block)
+                self.vectors[start : start + _BLOCK_ROWS] = block
+        elif quantization == "float16":
+            self.vectors = vectors.astype(np.float16)
+        else:
+            self.vectors = np.ascontiguousarray(vectors)
+        self.norms: np.ndarray | None = None
+        if distance_measure == "L2_NORM":
+            norms = []
+            for start, block in zip(
+                range(0, len(self.vectors), _BLOCK_ROWS), self._blocks(0, len(self.vectors))
+            ):
+                if self.scale is not None:
+                    block = block * self.scale
+                if self.residuals:
+                    block = block + self.centroids[row_lists[start : start + _BLOCK_ROWS]]
+                norms.append(np.einsum("ij,ij->i", block, block))
+            self.norms = np.concatenate(norms)
+
+        # Restricts are only decoded for returned neighbors; filtering uses the
+        # token -> rows postings below.
+        self._restricts = [
+            json.dumps(row, separators=(",", ":")) if row else "" for row in restricts
+        ]
+        self._numeric_restricts = [
+            json.dumps(row, separators=(",", ":")) if row else "" for row in numeric_restricts
+        ]
+        self._allow = _postings(restricts, ("allow", "allow_list", "allow_tokens"))
+        self._deny = _postings(restricts, ("deny", "deny_list", "deny_tokens"))
+
+    @classmethod
+    def from_datapoints(cls, items: Iterable[dict[str, Any]], **options: Any) -> "LocalIndex":
+        ids: list[str] = []
+        restricts: list[list[dict[str, Any]]] = []
+        numeric_restricts: list[list[dict[str, Any]]] = []
+        chunks: list[np.ndarray] = []
+        pending: list[Any] = []
+        for item in items:
+            ids.append(str(item["id"]))
+            restricts.append(list(item.get("restricts") or []))
+            numeric_restricts.append(list(item.get("numeric_restricts") or []))
+            pending.append(item["embedding"])
+            if len(pending) >= _LOAD_CHUNK_ROWS:
+                chunks.append(np.asarray(pending, dtype=np.float32))
+                pending = []
+        if pending:
+            chunks.append(np.asarray(pending, dtype=np.float32))
+        if not chunks:
+            raise ValueError("No datapoints found for the local index")
+        return cls(ids, np.concatenate(chunks), restricts, numeric_restricts, **options)
+
+    @property
+    def deployed_indexes(self) -> list[Any]:
+        return []
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _blocks(self, start: int, stop: int) -> Iterable[np.ndarray]:
+        # int8 rows come out as unscaled codes; callers apply `scale`.
+        for begin in range(start, stop, _BLOCK_ROWS):
+            yield self.vectors[begin : min(stop, begin + _BLOCK_ROWS)].astype(
+                np.float32, copy=False
+            )
+
+    def _scores(
+        self, queries: np.ndarray, start: int, stop: int, list_id: int | None = None
+    ) -> np.ndarray:
+        # One row of scores per query; higher is closer for every measure. L2
+        # distances are negated here and flipped back when results are returned.
+        scaled = queries * self.scale if self.scale is not None else queries
+        scores = np.empty((len(queries), stop - start), dtype=np.float32)
+        begin = 0
+        for block in self._blocks(start, stop):
+            scores[:, begin : begin + len(block)] = scaled @ block.T
+            begin += len(block)
+        if self.residuals and list_id is not None:
+            scores += (queries @ self.centroids[list_id])[:, None]
+        if self.norms is not None:
+            scores *= 2.0
+            scores -= self.norms[start:stop]
+            scores -= np.einsum("ij,ij->i", queries, queries)[:, None]
+        return scores
+
+    def _filter_mask(self, filters: list[Namespace]) -> np.ndarray | None:
+        if not filters:
+            return None
+        mask = np.ones(len(self.ids), dtype=bool)
+        for namespace in filters:
+            name = namespace.name
+            allow = list(namespace.allow_tokens or [])
+            deny = list(namespace.deny_tokens or [])
+            if allow:
+                allowed = np.zeros(len(self.ids), dtype=bool)
+                for token in allow:
+                    rows = self._allow.get(name, {}).get(str(token))
+                    if rows is not None:
+                        allowed[rows] = True
+                    # A datapoint that denies a token the query allows is excluded.
+                    rows = self._deny.get(name, {}).get(str(token))
+                    if rows is not None:
+                        mask[rows] = False
+                mask &= allowed
+            for token in deny:
+                rows = self._allow.get(name, {}).get(str(token))
+                if rows is not None:
+                    mask[rows] = False
+        return mask
+
+    def _ranges(self, query: np.ndarray) -> list[tuple[int, int, int]]:
+        if self.norms is not None:
+            closeness = -((self.centroids - query) ** 2).sum(axis=1)
+        else:
+            closeness = self.centroids @ query
+        probe = min(self.nprobe, len(self.centroids))
+        lists = np.argpartition(-closeness, probe - 1)[:probe]
+        return [
+            (int(self.offsets[i]), int(self.offsets[i + 1]), int(i))
+            for i in sorted(lists)
+            if self.offsets[i + 1] > self.offsets[i]
+        ]
+
+    def _neighbor(self, row: int, score: float, full: bool) -> MatchNeighbor:
+        distance = -score if self.norms is not None else score
+        if not full:
+            return MatchNeighbor(id=str(self.ids[row]), distance=float(distance))
+        restricts = json.loads(self._restricts[row]) if self._restricts[row] else []
+        numeric = (
+            json.loads(self._numeric_restricts[row]) if self._numeric_restricts[row] else []
+        )
+        return MatchNeighbor(
+            id=str(self.ids[row]),
+            distance=float(distance),
+            restricts=[
+                Namespace(
+                    item.get("namespace") or item.get("name"),
+                    list(item.get("allow") or item.get("allow_list") or []),
+                    list(item.get("deny") or item.get("deny_list") or []),
+                )
+                for item in restricts
+            ],
+            numeric_restricts=[
+                NumericNamespace(
+                    item.get("namespace") or item.get("name"),
+                    value_int=item.get("value_int"),
+                    value_float=item.get("value_float"),
+                    value_double=item.get("value_double"),
+                )
+                for item in numeric
+            ],
+        )
+
+    def _top_k(
+        self, rows: np.ndarray, scores: np.ndarray, top_k: int, full: bool
+    ) -> list[MatchNeighbor]:
+        top_k = min(top_k, len(rows))
+        if not top_k:
+            return []
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [self._neighbor(int(rows[i]), float(scores[i]), full) for i in best]
+
+    def find_neighbors(
+        self,
+        *,
+        queries: list[list[float]],
+        num_neighbors: int = 10,
+        filter: list[Namespace] | None = None,
+        return_full_datapoint: bool = False,
+        **_: Any,
+    ) -> list[list[MatchNeighbor]]:
+        matrix = np.asarray(queries, dtype=np.float32)
+        if matrix.ndim != 2 or matrix.shape[1] != self.dimension:
+            raise ValueError(f"Queries must be vectors of dimension {self.dimension}")
+        if self.distance_measure == "COSINE":
+            matrix = _unit_rows(matrix)
+        mask = self._filter_mask(filter or [])
+        top_k = int(num_neighbors)
+        results: list[list[MatchNeighbor]] = []
+        if self.centroids is None:
+            # Exact: a chunk of queries is scored against each block at once, so
+            # quantized rows are widened once per chunk instead of once per query.
+            rows = np.arange(len(self.ids)) if mask is None else np.flatnonzero(mask)
+            for begin in range(0, len(matrix), _QUERY_CHUNK):
+                scores = self._scores(matrix[begin : begin + _QUERY_CHUNK], 0, len(self.ids))
+                for row_scores in scores:
+                    if mask is not None:
+                        row_scores = row_scores[mask]
+                    results.append(
+                        self._top_k(rows, row_scores, top_k, return_full_datapoint)
+                    )
+            return results
+
+        for query in matrix:
+            rows = []
+            scores = []
+            for start, stop, list_id in self._ranges(query):
+                range_rows = np.arange(start, stop)
+                range_scores = self._scores(query[None, :], start, stop, list_id)[0]
+                if mask is not None:
+                    keep = mask[start:stop]
+                    range_rows = range_rows[keep]
+                    range_scores = range_scores[keep]
+                rows.append(range_rows)
+                scores.append(range_scores)
+            results.append(
+                self._top_k(
+                    np.concatenate(rows) if rows else np.empty(0, dtype=np.int64),
+                    np.concatenate(scores) if scores else np.empty(0, dtype=np.float32),
+                    top_k,
+                    return_full_datapoint,
+                )
+            )
+        return results
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "vectors": len(self.ids),
+            "dimension": self.dimension,
+            "index_type": self.index_type,
+            "quantization": self.quantization,
+            "distance_measure_type": self.distance_measure,
+            "lists": len(self.centroids) if self.centroids is not None else None,
+            "nprobe": self.nprobe if self.centroids is not None else None,
+            "vector_bytes": int(self.vectors.nbytes),
+        }
+
+
+def _unit_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _nearest_centroids(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    # argmin |x - c|^2 == argmax (x.c - |c|^2 / 2), computed a block at a time.
+    half_norms = 0.5 * np.einsum("ij,ij->i", centroids, centroids)
+    return np.concatenate(
+        [
+            np.argmax(vectors[start : start + _BLOCK_ROWS] @ centroids.T - half_norms, axis=1)
+            for start in range(0, len(vectors), _BLOCK_ROWS)
+        ]
+    )
+
+
+def _kmeans(vectors: np.ndarray, nlist: int, *, seed: int, iterations: int = 10) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    # Lists are trained on a sample; 64 points per list is plenty for IVF.
+    sample_size = min(len(vectors), nlist * 64)
+    sample = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assigned = _nearest_centroids(sample, centroids)
+        counts = np.bincount(assigned, minlength=nlist)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assigned, sample)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+def _postings(
+    restricts: list[list[dict[str, Any]]], fields: tuple[str, ...]
+) -> dict[str, dict[str, np.ndarray]]:
+    postings: dict[str, dict[str, list[int]]] = {}
+    for row, items in enumerate(restricts):
+        for item in items:
+            namespace = item.get("namespace") or item.get("name")
+            if not namespace:
+                continue
+            tokens = next((item[field] for field in fields if item.get(field)), [])
+            for token in tokens:
+                postings.setdefault(namespace, {}).setdefault(str(token), []).append(row)
+    return {
+        namespace: {token: np.asarray(rows, dtype=np.int64) for token, rows in tokens.items()}
+        for namespace, tokens in postings.items()
+    }
+
+
+_lock = threading.Lock()
+_loaded: dict[tuple[Any, ...], LocalIndex] = {}
+_names: dict[str, tuple[Any, ...]] = {}
+# One lock per index being loaded, so a cold load only blocks searches on that index.
+_loading: dict[tuple[Any, ...], threading.Lock] = {}
+# Bumped by drop_local_index; a load that started before a drop is not kept.
+_generation = 0
+
+
+def local_index_settings(config: dict[str, Any], deployed_index_id: str) -> dict[str, Any] | None:
+    """
+    Settings of the local index serving `deployed_index_id`: the entry under
+    `local_search.indexes` over the section defaults, or None when the deployed
+    index is not served locally.
+    """
+    section = config.get("local_search") or {}
+    entry = (section.get("indexes") or {}).get(deployed_index_id)
+    if entry is None:
+        return None
+    defaults = {key: value for key, value in section.items() if key != "indexes"}
+    return {**defaults, **(entry or {})}
+
+
+def get_local_index(config: dict[str, Any], deployed_index_id: str) -> LocalIndex | None:
+    """
+    Return the process-wide local index for `deployed_index_id`, loading it from
+    its datapoint files on first use, or None when it is not configured. The index
+    is a snapshot of those files: writes to the `index_id` it is configured to
+    mirror drop it in this process (see `invalidate_search_results`), otherwise
+    it is only reloaded when the process restarts.
+    """
+    settings = local_index_settings(config, deployed_index_id)
+    if settings is None:
+        return None
+    if not settings.get("datapoints_gcs_prefix"):
+        raise ValueError(f"local_search index `{deployed_index_id}` needs datapoints_gcs_prefix")
+    options = {
+        "distance_measure": str(
+            settings.get("distance_measure_type")
+            or config.get("index_create", {}).get("distance_measure_type")
+            or "DOT_PRODUCT"
+        ).upper(),
+        "index_type": str(settings.get("index_type") or "exact").lower(),
+        "quantization": str(settings.get("quantization") or "none").lower(),
+        "nlist": int(settings.get("nlist") or 0),
+        "nprobe": int(settings.get("nprobe") or 8),
+    }
+    key = (
+        settings["datapoints_gcs_prefix"],
+        str(settings.get("datapoints_file_type") or "json"),
+        *sorted(options.items()),
+    )
+    index = _loaded.get(key)
+    if index is None:
+        index = _load(config, key, options)
+    if _names.get(deployed_index_id) != key:
+        with _lock:
+            _names[deployed_index_id] = key
+    return index
+
+
+def _load(config: dict[str, Any], key: tuple[Any, ...], options: dict[str, Any]) -> LocalIndex:
+    with _lock:
+        load_lock = _loading.setdefault(key, threading.Lock())
+    # Concurrent first searches of the same index wait here and load the files once.
+    with load_lock:
+        index = _loaded.get(key)
+        if index is not None:
+            return index
+        generation = _generation
+        items = iter_data_from_gcs_prefix(
+            key[0],
+            field_name="datapoints_gcs_prefix",
+            file_type=key[1],
+            cache=get_blob_cache(config),
+        )
+        index = LocalIndex.from_datapoints(items, **options)
+        with _lock:
+            if generation == _generation:
+                _loaded[key] = index
+            _loading.pop(key, None)
+    return index
+
+
+def drop_local_index(deployed_index_id: str) -> bool:
+    """
+    Forget the loaded local index serving `deployed_index_id`, so the next search
+    reloads it from its datapoint files. Returns whether one was loaded.
+    """
+    global _generation
+    with _lock:
+        _generation += 1
+        key = _names.get(deployed_index_id)
+        if key is None or _loaded.pop(key, None) is None:
+            return False
+        for name in [name for name, loaded in _names.items() if loaded == key]:
+            del _names[name]
+        return True
+
+
+def local_index_stats() -> dict[str, Any]:
+    """
+    Stats of the local indexes loaded in this process, by deployed index id.
+    """
+    with _lock:
+        return {name: _loaded[key].stats() for name, key in _names.items() if key in _loaded}
@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+from collections.abc import Callable, Hashable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Generic, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class MicroBatcher(Generic[T, R]):
+    """
+    Coalesces concurrent async requests into batches. Requests with the same key
+    are collected until `max_batch` have arrived or `max_wait_seconds` has passed
+    since the first one, then `fn(key, items)` runs once for the whole batch on a
+    worker thread and each caller gets its own entry of the returned list. An
+    entry that is an exception is raised to that caller only.
+    At most `concurrency` batches run at a time. A batch whose wait has passed
+    while every slot is busy stays pending and keeps collecting requests until a
+    running batch finishes, unless it reaches `max_batch` first.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[Hashable, list[T]], list[R | BaseException]],
+        *,
+        max_batch: int = 64,
+        max_wait_seconds: float = 0.002,
+        concurrency: int = 16,
+    ) -> None:
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait_seconds = max(0.0, float(max_wait_seconds))
+        self.concurrency = max(1, int(concurrency))
+        self._fn = fn
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="micro-batch"
+        )
+        # Pending batches and slot counts are only touched from the event loop thread.
+        self._pending: dict[Hashable, list[tuple[T, asyncio.Future]]] = {}
+        self._timers: dict[Hashable, asyncio.TimerHandle] = {}
+        # Keys whose wait has passed, in order, waiting for a free slot.
+        self._ready: dict[Hashable, None] = {}
+        self._active = 0
+        # The loop only keeps weak references to tasks, so running batches are held here.
+        self._running: set[asyncio.Task] = set()
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._batches = 0
+        self._largest = 0
+        self._failed = 0
+        self._run_seconds = 0.0
+
+    async def submit(self, key: Hashable, item: T) -> R:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(key, [])
+        pending.append((item, future))
+        if len(pending) >= self.max_batch:
+            self._flush(key)
+        elif len(pending) == 1:
+            self._timers[key] = loop.call_later(self.max_wait_seconds, self._expire, key)
+        return await future
+
+    def _expire(self, key: Hashable) -> None:
+        self._timers.pop(key, None)
+        if self._active < self.concurrency:
+            self._flush(key)
+        else:
+            self._ready[key] = None
+
+    def _flush(self, key: Hashable) -> None:
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        self._ready.pop(key, None)
+        batch = self._pending.pop(key, None)
+        if batch:
+            self._active += 1
+            task = asyncio.get_running_loop().create_task(self._run(key, batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, key: Hashable, batch: list[tuple[T, asyncio.Future]]) -> None:
+        loop = asyncio.get_running_loop()
+        items = [item for item, _ in batch]
+        start = time.monotonic()
+        try:
+            results = await loop.run_in_executor(self._executor, self._fn, key, items)
+            if len(results) != len(batch):
+                raise RuntimeError(f"Batch returned {len(results)} results for {len(batch)} items")
+        except BaseException as exc:
+            results = [exc for _ in batch]
+        # The freed slot goes to the batch that has waited longest.
+        self._active -= 1
+        while self._ready and self._active < self.concurrency:
+            self._flush(next(iter(self._ready)))
+        with self._lock:
+            self._requests += len(batch)
+            self._batches += 1
+            self._largest = max(self._largest, len(batch))
+            self._failed += sum(isinstance(result, BaseException) for result in results)
+            self._run_seconds += time.monotonic() - start
+        for (_, future), result in zip(batch, results):
+            # Callers that went away (client disconnects) have cancelled futures.
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "batches": self._batches,
+                "failed": self._failed,
+                "avg_batch_size": self._requests / self._batches if self._batches else 0.0,
+                "max_batch_size": self._largest,
+                "avg_batch_seconds": self._run_seconds / self._batches if self._batches else 0.0,
+                "max_batch": self.max_batch,
+                "max_wait_seconds": self.max_wait_seconds,
+                "concurrency": self.concurrency,
+            }
@@ -0,0 +1,129 @@
+import json
+import mmap
+import struct
+import zipfile
+from collections.abc import Iterable
+from io import BytesIO
+from typing import Any
+
+import numpy as np
+
+# Columns of the binary datapoint format. Vectors are one contiguous block;
+# restricts are JSON strings per row since their shape varies between rows.
+NPZ_COLUMNS = ("id", "embedding", "restricts", "numeric_restricts")
+VECTOR_DTYPES = {"float32": np.float32, "float16": np.float16}
+
+
+def encode_datapoints_npz(
+    items: Iterable[dict[str, Any]], *, vector_dtype: str = "float32"
+) -> bytes:
+    """
+    Encode datapoint items as an uncompressed npz archive.
+    """
+    if vector_dtype not in VECTOR_DTYPES:
+        raise ValueError(
+            f"Unsupported vector_dtype `{vector_dtype}`. Supported: float32, float16"
+        )
+    items = list(items)
+    ids = [str(item.get("id", "")) for item in items]
+    embeddings = np.asarray(
+        [item.get("embedding", []) for item in items], dtype=VECTOR_DTYPES[vector_dtype]
+    )
+    if embeddings.ndim != 2:
+        raise ValueError("All items must have embeddings of the same dimension")
+    restricts = [
+        json.dumps(item.get("restricts") or [], ensure_ascii=True, separators=(",", ":"))
+        for item in items
+    ]
+    numeric_restricts = [
+        json.dumps(item.get("numeric_restricts") or [], ensure_ascii=True, separators=(",", ":"))
+        for item in items
+    ]
+
+    buffer = BytesIO()
+    np.savez(
+        buffer,
+        id=np.asarray(ids, dtype=np.str_),
+        embedding=np.ascontiguousarray(embeddings),
+        restricts=np.asarray(restricts, dtype=np.str_),
+        numeric_restricts=np.asarray(numeric_restricts, dtype=np.str_),
+    )
+    return buffer.getvalue()
+
+
+def npy_view(buffer: bytes | memoryview | mmap.mmap) -> np.ndarray:
+    """
+    Read a .npy payload as a read-only array view into `buffer`, without copying.
+    Pickled object arrays are rejected.
+    """
+    buffer = memoryview(buffer)
+    stream = BytesIO(buffer[:4096])
+    version = np.lib.format.read_magic(stream)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+    if dtype.hasobject:
+        raise ValueError("Pickled object arrays are not supported")
+    count = int(np.prod(shape)) if shape else 1
+    array = np.frombuffer(buffer, dtype=dtype, count=count, offset=stream.tell())
+    return array.reshape(shape, order="F" if fortran_order else "C")
+
+
+def read_npz_arrays(buffer: bytes | memoryview | mmap.mmap) -> dict[str, np.ndarray]:
+    """
+    Read the arrays of an npz archive. Stored (uncompressed) members are returned
+    as read-only views into `buffer` without copying; compressed members are
+    decoded normally. Pickled object arrays are rejected. A memory-mapped file
+    can be passed as an `mmap.mmap`.
+    """
+    view = memoryview(buffer)
+    # bytes and mmap objects are read in place; BytesIO only copies other buffers.
+    source = buffer if isinstance(buffer, mmap.mmap) else BytesIO(buffer)
+    arrays: dict[str, np.ndarray] = {}
+    with zipfile.ZipFile(source) as archive:
+        for info in archive.infolist():
+            name = info.filename.removesuffix(".npy")
+            if info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as fp:
+                    arrays[name] = np.load(fp, allow_pickle=False)
+                continue
+            # Member data starts after the local file header, whose extra field can
+            # differ from the central directory entry (numpy forces zip64 there).
+            header = bytes(view[info.header_offset : info.header_offset + 30])
+            name_length, extra_length = struct.unpack("<HH", header[26:30])
+            start = info.header_offset + 30 + name_length + extra_length
+            arrays[name] = npy_view(view[start : start + info.file_size])
+    return arrays
+
+
+def decode_datapoints_npz(buffer: bytes | memoryview | mmap.mmap) -> list[dict[str, Any]]:
+    """
+    Decode an npz datapoint archive into datapoint items. Each `embedding` is a
+    row view of the archive's vector block.
+    """
+    arrays = read_npz_arrays(buffer)
+    missing = [column for column in NPZ_COLUMNS if column not in arrays]
+    if missing:
+        raise ValueError(f"npz datapoint file is missing columns: {', '.join(missing)}")
+
+    # Restrict strings repeat heavily across rows, so each distinct one is parsed once.
+    parsed: dict[str, Any] = {}
+
+    def _parse(text: str) -> Any:
+        if text not in parsed:
+            parsed[text] = json.loads(text)
+        return parsed[text]
+
+    embeddings = arrays["embedding"]
+    return [
+        {
+            "id": str(datapoint_id),
+            "embedding": embeddings[idx],
+            "restricts": _parse(str(restricts)),
+            "numeric_restricts": _parse(str(numeric_restricts)),
+        }
+        for idx, (datapoint_id, restricts, numeric_restricts) in enumerate(
+            zip(arrays["id"], arrays["restricts"], arrays["numeric_restricts"])
+        )
+    ]
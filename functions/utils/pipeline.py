@@ -0,0 +1,100 @@
+import queue
+import threading
+from collections.abc import Callable, Iterable, Iterator
+from typing import Any, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, exc: BaseException) -> None:
+        self.exc = exc
+
+
+class BackgroundIterator(Iterator[R]):
+    """
+    Iterate `source` (mapped through `fn`) in a background thread that starts right
+    away and buffers at most `maxsize` items. Errors are re-raised in the consumer;
+    `close()` stops the thread.
+    """
+
+    def __init__(
+        self,
+        source: Iterable[T],
+        fn: Callable[[T], R] | None = None,
+        *,
+        maxsize: int = 2,
+    ) -> None:
+        self._source = source
+        self._fn = fn
+        self._buffer: queue.Queue[Any] = queue.Queue(maxsize=max(1, int(maxsize)))
+        self._stop = threading.Event()
+        self._finished = False
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    def _put(self, item: Any) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _worker(self) -> None:
+        try:
+            for item in self._source:
+                if not self._put(self._fn(item) if self._fn is not None else item):
+                    return
+        except BaseException as exc:
+            self._put(_Failure(exc))
+            return
+        finally:
+            close = getattr(self._source, "close", None)
+            if close is not None:
+                close()
+        self._put(_DONE)
+
+    def __next__(self) -> R:
+        if self._finished:
+            raise StopIteration
+        item = self._buffer.get()
+        if item is _DONE:
+            self._finished = True
+            raise StopIteration
+        if isinstance(item, _Failure):
+            self._finished = True
+            self.close()
+            raise item.exc
+        return item
+
+    def close(self) -> None:
+        self._stop.set()
+
+
+def staged(
+    source: Iterable[T],
+    fn: Callable[[T], R] | None = None,
+    *,
+    maxsize: int = 2,
+) -> Iterator[R]:
+    """
+    Run one pipeline stage in a background thread.
+    Items from `source` are mapped through `fn` and buffered in a bounded queue, so a
+    chain of stages overlaps its I/O while holding at most `maxsize` items per stage.
+    Errors are re-raised in the consumer; closing the consumer stops the stage.
+    The thread starts when the consumer first asks for an item.
+    """
+
+    def _consume() -> Iterator[R]:
+        items = BackgroundIterator(source, fn, maxsize=maxsize)
+        try:
+            yield from items
+        finally:
+            items.close()
+
+    return _consume()
@@ -0,0 +1,118 @@
+import multiprocessing
+import threading
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from typing import Any, NamedTuple, TypeVar
+
+import numpy as np
+
+R = TypeVar("R")
+
+_lock = threading.Lock()
+_pools: dict[int, ProcessPoolExecutor] = {}
+
+
+class SharedArray(NamedTuple):
+    """
+    Handle to an array in shared memory. Only the name, shape and dtype are pickled
+    when it is sent to a worker process.
+    """
+
+    name: str
+    shape: tuple[int, ...]
+    dtype: str
+
+
+@contextmanager
+def shared_array(array: np.ndarray) -> Iterator[SharedArray]:
+    """
+    Copy `array` into a shared memory block that lives for the duration of the context.
+    """
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    try:
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        yield SharedArray(block.name, tuple(array.shape), array.dtype.str)
+    finally:
+        block.close()
+        block.unlink()
+
+
+def read_shared_rows(handle: SharedArray, start: int, stop: int) -> np.ndarray:
+    """
+    Copy rows `start:stop` of a shared array into a private array of the calling process.
+    """
+    block = shared_memory.SharedMemory(name=handle.name)
+    try:
+        view = np.ndarray(handle.shape, dtype=np.dtype(handle.dtype), buffer=block.buf)
+        rows = view[start:stop].copy()
+        del view
+        return rows
+    finally:
+        block.close()
+
+
+def get_process_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Return the process-wide pool with `workers` processes, creating it on first use.
+    Workers are spawned rather than forked because the parent holds gRPC and HTTP
+    client threads that are not fork-safe.
+    """
+    workers = max(1, int(workers))
+    pool = _pools.get(workers)
+    if pool is not None:
+        return pool
+    with _lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            _pools[workers] = pool
+        return pool
+
+
+def shutdown_process_pools() -> None:
+    with _lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def map_in_processes(
+    fn: Callable[..., R], tasks: Iterable[tuple[Any, ...]], *, workers: int
+) -> list[R]:
+    """
+    Run `fn(*task)` for each task on the process pool and return results in task order.
+    """
+    pool = get_process_pool(workers)
+    futures = [pool.submit(fn, *task) for task in tasks]
+    try:
+        return [future.result() for future in futures]
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+
+
+def row_slices(
+    row_count: int, *, workers: int, max_rows: int, boundary: int = 0, offset: int = 0
+) -> list[tuple[int, int]]:
+    """
+    Split `row_count` rows into contiguous slices, at least one per worker and at
+    most `max_rows` long. With `boundary`, no slice crosses a multiple of `boundary`
+    counted from `offset`, so slices line up with row-based output shards.
+    """
+    size = max(1, min(int(max_rows), -(-row_count // max(1, int(workers)))))
+    slices: list[tuple[int, int]] = []
+    start = 0
+    while start < row_count:
+        stop = min(start + size, row_count)
+        if boundary:
+            stop = min(stop, ((offset + start) // boundary + 1) * boundary - offset)
+        slices.append((start, stop))
+        start = stop
+    return slices
@@ -0,0 +1,139 @@
+import re
+import threading
+import unicodedata
+from collections.abc import Iterable
+from functools import lru_cache
+from typing import Any
+
+import numpy as np
+
+from functions.utils.embedding_cache import (
+    EmbeddingCache,
+    embedding_cache_key,
+    get_embedding_cache,
+)
+from functions.utils.ttl_cache import TTLCache
+
+QUERY_TASK_TYPE = "RETRIEVAL_QUERY"
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(text: str, *, casefold: bool = False) -> str:
+    """
+    Canonical form of a search query: NFKC, collapsed whitespace and, optionally,
+    case-folded. It is only used for cache keys, so spellings that normalize alike
+    share one cached vector; the query sent to the model is left as written.
+    """
+    text = _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+    return text.casefold() if casefold else text
+
+
+class QueryEmbeddingCache:
+    """
+    Query embeddings in an in-process LRU+TTL cache, optionally backed by the
+    shared `EmbeddingCache` so workers reuse each other's query vectors. Has the
+    `get_many`/`put_many` interface of `EmbeddingCache`.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_entries: int = 50000,
+        ttl_seconds: float = 3600.0,
+        max_bytes: int = 256 * 1024**2,
+        casefold: bool = False,
+        shared: EmbeddingCache | None = None,
+    ) -> None:
+        self.casefold = bool(casefold)
+        self.shared = shared
+        self._local: TTLCache[str, np.ndarray] = TTLCache(
+            max_entries=max_entries,
+            ttl_seconds=ttl_seconds,
+            max_bytes=max_bytes,
+            sizeof=lambda vector: int(vector.nbytes),
+        )
+        self._lock = threading.Lock()
+        self._shared_hits = 0
+
+    def normalize(self, text: str) -> str:
+        return normalize_query(text, casefold=self.casefold)
+
+    def key(self, embedding_model: str, output_dimensionality: int, text: str) -> str:
+        return embedding_cache_key(
+            embedding_model, output_dimensionality, QUERY_TASK_TYPE, self.normalize(text)
+        )
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, np.ndarray]:
+        found: dict[str, np.ndarray] = {}
+        missing: list[str] = []
+        for key in dict.fromkeys(keys):
+            vector = self._local.get(key)
+            if vector is None:
+                missing.append(key)
+            else:
+                found[key] = vector
+        if missing and self.shared is not None:
+            remote = self.shared.get_many(missing)
+            for key, vector in remote.items():
+                self._local.put(key, vector)
+            found.update(remote)
+            with self._lock:
+                self._shared_hits += len(remote)
+        return found
+
+    def put_many(self, entries: dict[str, np.ndarray]) -> None:
+        for key, vector in entries.items():
+            self._local.put(key, np.asarray(vector, dtype=np.float32))
+        if self.shared is not None:
+            self.shared.put_many(entries)
+
+    def stats(self) -> dict[str, Any]:
+        stats = self._local.stats()
+        lookups = stats["hits"] + stats["misses"]
+        with self._lock:
+            shared_hits = self._shared_hits
+        return {
+            **stats,
+            "shared_tier": self.shared is not None,
+            "shared_hits": shared_hits,
+            # A lookup served by the shared tier is a local miss but still saves
+            # the embedding call.
+            "hit_ratio": (stats["hits"] + shared_hits) / lookups if lookups else 0.0,
+            "local_hit_ratio": stats["hit_ratio"],
+        }
+
+
+@lru_cache(maxsize=None)
+def _cache_instance(
+    max_entries: int,
+    ttl_seconds: float,
+    max_bytes: int,
+    casefold: bool,
+    shared: EmbeddingCache | None,
+) -> QueryEmbeddingCache:
+    return QueryEmbeddingCache(
+        max_entries=max_entries,
+        ttl_seconds=ttl_seconds,
+        max_bytes=max_bytes,
+        casefold=casefold,
+        shared=shared,
+    )
+
+
+def get_query_embedding_cache(config: dict[str, Any]) -> QueryEmbeddingCache | None:
+    """
+    Return the process-wide query embedding cache configured in
+    `query_embedding_cache`, if enabled. With `shared`, the `embedding_cache`
+    (when enabled) is used as the tier shared between workers.
+    """
+    settings = config.get("query_embedding_cache") or {}
+    if not settings.get("enabled", True):
+        return None
+    return _cache_instance(
+        int(settings.get("max_entries") or 50000),
+        float(settings.get("ttl_seconds") or 3600),
+        int(settings.get("max_bytes") or 256 * 1024**2),
+        bool(settings.get("casefold")),
+        get_embedding_cache(config) if settings.get("shared") else None,
+    )
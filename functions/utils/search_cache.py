@@ -0,0 +1,128 @@
+import hashlib
+import threading
+from collections.abc import Hashable, Sequence
+from functools import lru_cache
+from typing import Any
+
+import numpy as np
+
+from functions.utils.local_index import drop_local_index, local_index_settings
+from functions.utils.ttl_cache import TTLCache
+
+
+def index_key(index_id: str) -> str:
+    """
+    Short id of an index, so `projects/.../indexes/123` and `123` match.
+    """
+    return str(index_id).rstrip("/").rsplit("/", 1)[-1]
+
+
+class SearchResultCache:
+    """
+    LRU+TTL cache of search results. Every key includes a generation counter of
+    the index behind the deployed index; a write to the index bumps the counter,
+    so results cached before the write are never served again and age out.
+    Counters are per process: other API workers see the write once their entries
+    expire after `ttl_seconds`.
+    """
+
+    def __init__(self, *, max_entries: int = 10000, ttl_seconds: float = 60.0) -> None:
+        self._results: TTLCache[str, list[dict[str, Any]]] = TTLCache(
+            max_entries=max_entries, ttl_seconds=ttl_seconds
+        )
+        # Deployed index -> index it serves; deployments rarely change, so the
+        # lookup is only repeated every few minutes.
+        self._targets: TTLCache[tuple[str, str], str] = TTLCache(
+            max_entries=1024, ttl_seconds=300.0
+        )
+        self._lock = threading.Lock()
+        self._generations: dict[str, int] = {}
+        self.invalidations = 0
+
+    def invalidate(self, index_id: str) -> None:
+        with self._lock:
+            key = index_key(index_id)
+            self._generations[key] = self._generations.get(key, 0) + 1
+            self.invalidations += 1
+
+    def _target(self, endpoint: Any, endpoint_id: str, deployed_index_id: str) -> str:
+        target = self._targets.get((endpoint_id, deployed_index_id))
+        if target is not None:
+            return target
+        target = f"deployed:{endpoint_id}/{deployed_index_id}"
+        try:
+            for deployed in getattr(endpoint, "deployed_indexes", None) or []:
+                if getattr(deployed, "id", None) == deployed_index_id and deployed.index:
+                    target = index_key(deployed.index)
+                    break
+        except Exception:
+            # Without the mapping, writes cannot invalidate these entries; the TTL
+            # still bounds how stale they get.
+            pass
+        self._targets.put((endpoint_id, deployed_index_id), target)
+        return target
+
+    def key(
+        self,
+        endpoint: Any,
+        *,
+        endpoint_id: str,
+        deployed_index_id: str,
+        vector: Sequence[float],
+        filters: Hashable,
+        top_k: int,
+    ) -> str:
+        target = self._target(endpoint, endpoint_id, deployed_index_id)
+        with self._lock:
+            generation = self._generations.get(target, 0)
+        digest = hashlib.sha256(np.asarray(vector, dtype=np.float32).tobytes())
+        digest.update(
+            repr((endpoint_id, deployed_index_id, target, generation, filters, int(top_k))).encode(
+                "utf-8"
+            )
+        )
+        return digest.hexdigest()
+
+    def get(self, key: str) -> list[dict[str, Any]] | None:
+        return self._results.get(key)
+
+    def put(self, key: str, results: list[dict[str, Any]]) -> None:
+        self._results.put(key, results)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            invalidations = self.invalidations
+        return {**self._results.stats(), "invalidations": invalidations}
+
+
+@lru_cache(maxsize=None)
+def _cache_instance(max_entries: int, ttl_seconds: float) -> SearchResultCache:
+    return SearchResultCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+
+
+def get_search_result_cache(config: dict[str, Any]) -> SearchResultCache | None:
+    """
+    Return the process-wide search result cache configured in `search_cache`, if enabled.
+    """
+    settings = config.get("search_cache") or {}
+    if not settings.get("enabled"):
+        return None
+    return _cache_instance(
+        int(settings.get("max_entries") or 10000),
+        float(settings.get("ttl_seconds") or 60),
+    )
+
+
+def invalidate_search_results(config: dict[str, Any], index_id: str) -> None:
+    """
+    Drop cached search results for `index_id` after a write to the index, and the
+    local indexes configured to mirror it.
+    """
+    cache = get_search_result_cache(config)
+    if cache is not None:
+        cache.invalidate(index_id)
+    target = index_key(index_id)
+    for deployed_index_id in (config.get("local_search") or {}).get("indexes") or {}:
+        settings = local_index_settings(config, deployed_index_id) or {}
+        if settings.get("index_id") and index_key(settings["index_id"]) == target:
+            drop_local_index(deployed_index_id)
@@ -0,0 +1,101 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Protocol
+
+from google.api_core.exceptions import NotFound
+from google.cloud import storage
+
+from functions.utils.clients import get_storage_client
+from functions.utils.gcs import parse_gcs_prefix
+
+
+class StateStore(Protocol):
+    def get(self, key: str) -> dict[str, Any] | None: ...
+
+    def put(self, key: str, value: dict[str, Any]) -> None: ...
+
+    def delete(self, key: str) -> None: ...
+
+
+class LocalStateStore:
+    """
+    JSON documents on local disk, replaced atomically on write.
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = Path(root).expanduser()
+
+    def _path(self, key: str) -> Path:
+        return self.root / f"{key}.json"
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        path = self._path(key)
+        if not path.exists():
+            return None
+        with path.open("r", encoding="utf-8") as fp:
+            return json.load(fp)
+
+    def put(self, key: str, value: dict[str, Any]) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as fp:
+                json.dump(value, fp, ensure_ascii=True)
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+    def delete(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+
+
+class GCSStateStore:
+    """
+    JSON documents under a GCS prefix, so state is shared between workers.
+    """
+
+    def __init__(self, gcs_prefix: str) -> None:
+        bucket_name, path = parse_gcs_prefix(gcs_prefix, field_name="state_store.gcs_prefix")
+        self.bucket = get_storage_client().bucket(bucket_name)
+        self.path = path.rstrip("/")
+
+    def _blob(self, key: str) -> storage.Blob:
+        return self.bucket.blob(f"{self.path}/{key}.json")
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        try:
+            return json.loads(self._blob(key).download_as_text())
+        except NotFound:
+            return None
+
+    def put(self, key: str, value: dict[str, Any]) -> None:
+        # Single-object uploads are atomic in GCS; readers see the old or new document.
+        self._blob(key).upload_from_string(
+            json.dumps(value, ensure_ascii=True), content_type="application/json"
+        )
+
+    def delete(self, key: str) -> None:
+        try:
+            self._blob(key).delete()
+        except NotFound:
+            pass
+
+
+def get_state_store(config: dict[str, Any]) -> StateStore:
+    """
+    Build the state store configured in the `state_store` section.
+    """
+    settings = config.get("state_store") or {}
+    backend = (settings.get("backend") or "local").lower()
+    if backend == "gcs":
+        gcs_prefix = settings.get("gcs_prefix")
+        if not gcs_prefix:
+            raise ValueError("state_store.gcs_prefix is required when backend is 'gcs'")
+        return GCSStateStore(gcs_prefix)
+    if backend == "local":
+        return LocalStateStore(settings.get("local_dir") or "/tmp/items_pipeline/state")
+    raise ValueError("state_store.backend must be 'local' or 'gcs'")